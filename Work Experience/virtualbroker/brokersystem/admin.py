@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, Stock, PriceHistory, Transaction, Position, BalanceHistory
+from .models import CustomUser, Stock, PriceHistory, Transaction, Position, BalanceHistory, LatestQuote, LeaderboardScore, Order, PriceHourly, PriceDaily, PriceChunk, WorkerLease, FetchCycle
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
@@ -11,6 +11,14 @@ class CustomUserAdmin(UserAdmin):
 
 admin.site.register(Stock)
 admin.site.register(PriceHistory)
+admin.site.register(LatestQuote)
+admin.site.register(PriceHourly)
+admin.site.register(PriceDaily)
+admin.site.register(PriceChunk)
 admin.site.register(Transaction)
 admin.site.register(Position)
-admin.site.register(BalanceHistory)
\ No newline at end of file
+admin.site.register(BalanceHistory)
+admin.site.register(Order)
+admin.site.register(LeaderboardScore)
+admin.site.register(WorkerLease)
+admin.site.register(FetchCycle)
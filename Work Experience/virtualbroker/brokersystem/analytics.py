@@ -0,0 +1,177 @@
+import math
+import os
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+
+from brokersystem.charts import close_matrix
+from brokersystem.fragments import PORTFOLIO_KEY, bump_portfolio
+from brokersystem.models import Transaction
+
+DAY = 86400
+# Net worth is sampled at each calendar day's close, so returns annualize by 365
+PERIODS_PER_YEAR = 365
+RISK_FREE_RATE = float(os.getenv("ANALYTICS_RISK_FREE_RATE", "0"))
+HISTORY_KEY = "analytics:history:{}"
+HISTORY_TTL_SECONDS = 7 * DAY
+
+
+def _today() -> int:
+    return int(timezone.now().timestamp()) // DAY
+
+
+def _closes(stock_ids: List[int], first_day: int, last_day: int, fallback: np.ndarray) -> np.ndarray:
+    """
+    Each stock's last price at the end of each day in first_day..last_day,
+    as a days x stocks matrix; `fallback` (e.g. trade prices) where there is
+    no sample yet. One read per storage tier covers all the stocks.
+    """
+    _, prices = close_matrix(
+        stock_ids,
+        datetime.fromtimestamp(first_day * DAY, tz=dt_timezone.utc),
+        datetime.fromtimestamp((last_day + 1) * DAY, tz=dt_timezone.utc),
+        DAY,
+    )
+    return np.where(np.isnan(prices), fallback, prices)
+
+
+def replay(user_id: int, balance: Decimal, last_day: int) -> dict:
+    """
+    Rebuild a user's end-of-day net worth up to `last_day` (days since the
+    epoch, UTC) from their Transaction ledger. Cash is walked back from the
+    current balance, holdings are cumulative signed quantities, and both are
+    read off at every day's close with searchsorted, so the cost is one
+    query for the ledger plus one price read per storage tier, however many
+    stocks were traded.
+    """
+    trades = list(
+        Transaction.objects.filter(user_id=user_id)
+        .order_by("executed_at", "id")
+        .values_list("executed_at", "stock_id", "side", "quantity", "price")
+    )
+    state = {"first_day": None, "worth": [], "holdings": {}, "closes": {}}
+    if not trades:
+        return state
+
+    n = len(trades)
+    t = np.fromiter((row[0].timestamp() for row in trades), dtype=np.float64, count=n)
+    stock_ids = np.fromiter((row[1] for row in trades), dtype=np.int64, count=n)
+    signed = np.fromiter((row[3] if row[2] == "buy" else -row[3] for row in trades), dtype=np.int64, count=n)
+    price = np.fromiter((float(row[4]) for row in trades), dtype=np.float64, count=n)
+
+    first_day = int(t[0]) // DAY
+    state["first_day"] = first_day
+    for stock_id in np.unique(stock_ids).tolist():
+        mask = stock_ids == stock_id
+        state["holdings"][stock_id] = int(signed[mask].sum())
+        state["closes"][stock_id] = float(price[mask][-1])
+    if last_day < first_day:
+        return state
+
+    day_end = (np.arange(first_day, last_day + 1) + 1) * DAY
+    done = np.searchsorted(t, day_end, side="left")  # trades executed by each close
+    flows = np.r_[0.0, np.cumsum(-signed * price)]
+    worth = float(balance) - (flows[-1] - flows[done])
+    held_ids, quantities, last_trades = [], [], []
+    for stock_id in state["holdings"]:
+        mask = stock_ids == stock_id
+        held = np.searchsorted(t[mask], day_end, side="left")
+        qty = np.r_[0, np.cumsum(signed[mask])][held]
+        if qty.any():
+            held_ids.append(stock_id)
+            quantities.append(qty)
+            last_trades.append(np.r_[0.0, price[mask]][held])
+    if held_ids:
+        closes = _closes(held_ids, first_day, last_day, np.column_stack(last_trades))
+        worth = worth + (np.column_stack(quantities) * closes).sum(axis=1)
+        state["closes"].update(zip(held_ids, closes[-1].tolist()))
+    state["worth"] = worth.tolist()
+    return state
+
+
+def _extend(state: dict, balance: Decimal, last_day: int):
+    """
+    Append the days since the cached series ended. Holdings and cash are
+    unchanged (any trade bumps the portfolio version and forces a replay),
+    so only the prices of the stocks still held are read.
+    """
+    first_new = state["first_day"] + len(state["worth"])
+    if last_day < first_new:
+        return
+    worth = np.full(last_day - first_new + 1, float(balance))
+    held_ids = [stock_id for stock_id, qty in state["holdings"].items() if qty]
+    if held_ids:
+        closes = _closes(held_ids, first_new, last_day, np.array([state["closes"][stock_id] for stock_id in held_ids]))
+        worth += closes @ np.array([state["holdings"][stock_id] for stock_id in held_ids], dtype=np.float64)
+        state["closes"].update(zip(held_ids, closes[-1].tolist()))
+    state["worth"].extend(worth.tolist())
+
+
+def history(user_id: int, balance: Decimal) -> dict:
+    """
+    The user's end-of-day net worth for every completed day since their
+    first trade, cached per user. A trade (new portfolio version) replays
+    the ledger; otherwise only the days since the last call are added.
+    """
+    key, version_key = HISTORY_KEY.format(user_id), PORTFOLIO_KEY.format(user_id)
+    found = cache.get_many([key, version_key])
+    version = found.get(version_key)
+    if version is None:
+        bump_portfolio(user_id)
+        version = cache.get(version_key)
+    state = found.get(key)
+    yesterday = _today() - 1
+    if state is None or state["version"] != version:
+        state = replay(user_id, balance, yesterday)
+        state["version"] = version
+    elif state["first_day"] is not None:
+        _extend(state, balance, yesterday)
+    cache.set(key, state, timeout=HISTORY_TTL_SECONDS)
+    return state
+
+
+def performance(worth: np.ndarray, periods_per_year: float = PERIODS_PER_YEAR) -> Dict[str, object]:
+    """
+    Per-period returns of an equity curve, their annualized volatility and
+    Sharpe ratio, and the max drawdown (a fraction, <= 0).
+    """
+    prev = worth[:-1]
+    returns = np.divide(worth[1:] - prev, prev, out=np.zeros(len(prev)), where=prev > 0)
+    stats = {
+        "returns": returns,
+        "volatility": None,
+        "sharpe": None,
+        "max_drawdown": float((worth / np.maximum.accumulate(worth) - 1).min()) if (worth > 0).all() else None,
+    }
+    if len(returns) >= 2:
+        std = returns.std(ddof=1)
+        stats["volatility"] = std * math.sqrt(periods_per_year)
+        if std > 0:
+            excess = returns.mean() - RISK_FREE_RATE / periods_per_year
+            stats["sharpe"] = excess / std * math.sqrt(periods_per_year)
+    return stats
+
+
+def summarize(state: dict, worth_now: Decimal) -> Optional[Dict[str, object]]:
+    """
+    Net-worth series (completed days plus a live point for today), daily
+    returns and their annualized volatility, max drawdown and Sharpe ratio.
+    None before the user's first trade.
+    """
+    if state["first_day"] is None:
+        return None
+    worth = np.r_[np.asarray(state["worth"], dtype=np.float64), float(worth_now)]
+    days = np.arange(state["first_day"], state["first_day"] + len(worth)) * DAY
+    stats = performance(worth)
+    returns = stats["returns"]
+    stats.update({
+        "days": days.tolist(),
+        "worth": np.round(worth, 2).tolist(),
+        "returns": returns.tolist(),
+        "change_pct": returns[-1] * 100 if len(returns) else None,
+    })
+    return stats
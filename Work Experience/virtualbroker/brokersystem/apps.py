@@ -1,12 +1,35 @@
 from django.apps import AppConfig
+from django.conf import settings
 import os
 
+
+def fetch_in_web() -> bool:
+    """
+    Whether runserver fetches prices itself. By default it does while the
+    cache is per-process memory, since run_price_worker needs a shared one.
+    """
+    if settings.PRICE_SCHEDULER_IN_WEB:
+        return settings.PRICE_SCHEDULER_IN_WEB == "1"
+    from .fragments import cache_is_shared
+    return not cache_is_shared()
+
+
 class BrokersystemConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'brokersystem'
 
     def ready(self):
-        # prevent double-start with autoreload
-        if os.environ.get("RUN_MAIN") == "true":
+        # keep the stock search index in sync with Stock changes
+        from . import search  # noqa: F401
+
+        # SQLite's journal mode lives in the database file: set it on migrate
+        from django.db.models.signals import post_migrate
+        from .sqlite.base import journal_mode_after_migrate
+        post_migrate.connect(journal_mode_after_migrate, sender=self)
+
+        # With a shared cache prices are fetched by `manage.py run_price_worker`,
+        # so web workers start fast and never fetch; without one runserver
+        # fetches (RUN_MAIN: not in the autoreloader's parent too)
+        if os.environ.get("RUN_MAIN") == "true" and fetch_in_web():
             from .scheduler import start_scheduler
             start_scheduler()
\ No newline at end of file
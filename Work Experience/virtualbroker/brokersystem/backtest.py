@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from django.utils import timezone
+
+from brokersystem.analytics import performance
+from brokersystem.charts import close_matrix
+from brokersystem.models import Stock
+
+DAY = 86400
+YEAR = 365 * DAY
+
+
+def load_matrix(symbols: List[str] = None, start: datetime = None, end: datetime = None, step: int = DAY):
+    """
+    Closing prices on a common grid of `step`-second bars from `start` to
+    `end` (default: the last year) as (symbols, bar start times, T x N
+    price matrix), oldest first; see charts.close_matrix.
+    """
+    end = end or timezone.now()
+    start = start or end - timedelta(seconds=YEAR)
+    stocks = Stock.objects.order_by("symbol")
+    if symbols is not None:
+        stocks = stocks.filter(symbol__in=symbols)
+    listed = list(stocks.values_list("id", "symbol"))
+    times, prices = close_matrix([stock_id for stock_id, _ in listed], start, end, step)
+    return [symbol for _, symbol in listed], times, prices
+
+
+def _rolling_mean(prices: np.ndarray, window: int) -> np.ndarray:
+    """
+    Mean of the last `window` bars per column; NaN until a column has
+    `window` prices.
+    """
+    valid = ~np.isnan(prices)
+    total = np.cumsum(np.where(valid, prices, 0.0), axis=0)
+    count = np.cumsum(valid, axis=0)
+    total[window:] = total[window:] - total[:-window]
+    count[window:] = count[window:] - count[:-window]
+    mean = np.full(prices.shape, np.nan)
+    np.divide(total, count, out=mean, where=count == window)
+    return mean
+
+
+# Strategies turn a T x N price matrix into target weights (fractions of
+# equity per symbol, row sums <= 1, the rest in cash) decided at each bar's close.
+
+def sma_crossover(prices: np.ndarray, fast: int = 20, slow: int = 50) -> np.ndarray:
+    """
+    Hold a symbol while its fast moving average is above its slow one; every
+    symbol gets an equal 1/N sleeve, in cash while out.
+    """
+    with np.errstate(invalid="ignore"):
+        signal = _rolling_mean(prices, fast) > _rolling_mean(prices, slow)
+    return signal / max(1, prices.shape[1])
+
+
+def momentum(prices: np.ndarray, lookback: int = 20, top: int = 10) -> np.ndarray:
+    """
+    Hold the `top` symbols with the best trailing `lookback`-bar return (if
+    positive), equal weight, re-picked every bar.
+    """
+    weights = np.zeros(prices.shape)
+    if len(prices) <= lookback:
+        return weights
+    with np.errstate(invalid="ignore", divide="ignore"):
+        trailing = prices[lookback:] / prices[:-lookback] - 1
+    trailing = np.where(np.isfinite(trailing) & (trailing > 0), trailing, -np.inf)
+    top = min(top, prices.shape[1])
+    picks = np.argpartition(-trailing, top - 1, axis=1)[:, :top]
+    rows = np.arange(len(trailing))[:, None]
+    weights[lookback:][rows, picks] = np.where(np.isfinite(trailing[rows, picks]), 1.0 / top, 0.0)
+    return weights
+
+
+def rebalance(prices: np.ndarray, every: int = 20) -> np.ndarray:
+    """
+    Equal-weight every priced symbol each `every` bars and let the weights
+    drift with prices in between (buy and hold within a period).
+    """
+    anchor = np.arange(len(prices)) // every * every
+    growth = prices / prices[anchor]
+    growth = np.where(np.isfinite(growth), growth, 0.0)
+    held = growth.sum(axis=1, keepdims=True)
+    return np.divide(growth, held, out=np.zeros(prices.shape), where=held > 0)
+
+
+STRATEGIES: Dict[str, Callable[..., np.ndarray]] = {
+    "sma": sma_crossover,
+    "momentum": momentum,
+    "rebalance": rebalance,
+}
+
+
+def run(prices: np.ndarray, weights: np.ndarray, capital: float = 10000, step: int = DAY) -> Dict[str, object]:
+    """
+    Equity curve of trading to `weights` at every bar's close. Fills are at
+    the close with no commission, as in trade_view, so weights decided at
+    bar t earn the returns from t to t + 1. Also returns, per symbol, the
+    growth of capital fully invested in it whenever the strategy held it,
+    and the number of times a symbol was entered or exited ("trades").
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = prices[1:] / prices[:-1] - 1
+    returns = np.where(np.isfinite(returns), returns, 0.0)
+    held = weights > 0
+
+    equity = capital * np.r_[1.0, np.cumprod(1 + (weights[:-1] * returns).sum(axis=1))]
+    symbol_growth = np.prod(1 + held[:-1] * returns, axis=0)
+    stats = performance(equity, periods_per_year=YEAR / step)
+    stats.update({
+        "equity": equity,
+        "total_return": equity[-1] / capital - 1,
+        "symbol_returns": symbol_growth - 1,
+        "trades": int((np.diff(held.astype(np.int8), axis=0) != 0).sum() + held[0].sum()),
+    })
+    return stats
+
+
+def backtest(strategy: str, symbols: List[str] = None, start: datetime = None, end: datetime = None,
+             step: int = DAY, capital: float = 10000, **params) -> Optional[Dict[str, object]]:
+    """
+    Load prices and run one strategy over them. None when there is no data.
+    """
+    symbols, times, prices = load_matrix(symbols, start, end, step)
+    if not symbols:
+        return None
+    result = run(prices, STRATEGIES[strategy](prices, **params), capital, step)
+    result.update({"symbols": symbols, "times": times})
+    return result
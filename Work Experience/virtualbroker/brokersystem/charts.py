@@ -0,0 +1,324 @@
+import json
+import os
+from datetime import timedelta, datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.db import connection
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from brokersystem import series
+from brokersystem.dbutils import chunks
+from brokersystem.models import LatestQuote, PriceChunk, PriceHistory
+from brokersystem.rollups import rebucket, tiers
+from brokersystem.series import load_raw
+
+# Upper bound on points sent to the browser per chart series
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "300"))
+
+# Chart window -> (how far back from the latest sample, OHLC bucket size in seconds).
+# Raw 25-minute samples are fine for a day; longer windows are bucketed first
+# and then capped at CHART_MAX_POINTS with LTTB.
+PERIODS: Dict[str, Tuple[timedelta, Optional[int]]] = {
+    "1D": (timedelta(days=1), None),
+    "1W": (timedelta(weeks=1), 3600),
+    "1M": (timedelta(days=30), 4 * 3600),
+    "3M": (timedelta(days=90), 12 * 3600),
+    "1Y": (timedelta(days=365), 24 * 3600),
+}
+DEFAULT_PERIOD = "1D"
+
+# Bucket sizes the price API can serve ("raw" = stored samples)
+RESOLUTIONS: Dict[str, Optional[int]] = {
+    "raw": None,
+    "1h": 3600,
+    "4h": 4 * 3600,
+    "12h": 12 * 3600,
+    "1d": 24 * 3600,
+}
+
+
+def parse_period(value: Optional[str]) -> str:
+    value = (value or "").upper()
+    return value if value in PERIODS else DEFAULT_PERIOD
+
+
+def auto_resolution(span: timedelta) -> str:
+    """
+    Finest resolution that keeps a span of time within CHART_MAX_POINTS buckets.
+    """
+    if span <= timedelta(days=1):
+        return "raw"
+    for name, seconds in RESOLUTIONS.items():
+        if seconds and span.total_seconds() / seconds <= CHART_MAX_POINTS:
+            return name
+    return "1d"
+
+
+def load_bars(stock_id: int, start: datetime = None, end: datetime = None):
+    """
+    Price history for one stock as (epoch seconds, open, high, low, close)
+    float arrays, oldest first: daily and hourly rollups for the part of the
+    window that has been compacted, raw samples (o = h = l = c, from rows or
+    packed chunks) for the rest.
+    Rollup tables are only read when the window reaches back past what is
+    kept at the finer resolution, so recent windows cost one query.
+    Reads plain tuples, never model instances.
+    """
+    parts = []
+    since = start
+    now = timezone.now()
+    for bucket_seconds, model, kept_finer in tiers():
+        if start is not None and start >= now - kept_finer:
+            continue
+        qs = model.objects.filter(stock_id=stock_id)
+        if since is not None:
+            qs = qs.filter(bucket__gte=since)
+        if end is not None:
+            qs = qs.filter(bucket__lte=end)
+        rows = list(qs.order_by("bucket").values_list("bucket", "open", "high", "low", "close"))
+        if rows:
+            parts.append([
+                np.fromiter((row[i].timestamp() if i == 0 else float(row[i]) for row in rows), dtype=np.float64, count=len(rows))
+                for i in range(5)
+            ])
+            # Finer tiers only hold what comes after the last bar
+            since = rows[-1][0] + timedelta(seconds=bucket_seconds)
+
+    x, y = load_raw(stock_id, start=since, end=end)
+    parts.append([x, y, y, y, y])
+    if len(parts) == 1:
+        return tuple(parts[0])
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+def load_series(stock_id: int, start: datetime = None, end: datetime = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Price history for one stock as (epoch seconds, prices) float arrays,
+    oldest first; compacted stretches contribute their bars' closes.
+    """
+    t, _, _, _, c = load_bars(stock_id, start=start, end=end)
+    return t, c
+
+
+def _group_in_sql() -> bool:
+    return connection.vendor == "sqlite"
+
+
+def _tier_rows(model, time_field: str, ids: List[int], start: datetime, end: datetime, step: int):
+    """
+    (stock id, time, close) arrays for one storage table. On SQLite only
+    the last row per stock and bar comes back, grouped in SQL with epoch
+    seconds computed there: at a daily step that is one row per day instead
+    of 24 hourly bars or ~58 samples, and no datetime is parsed per row.
+    Other backends read every row, with prices cast to float in SQL.
+    """
+    price_field = "price" if model is PriceHistory else "close"
+    if _group_in_sql():
+        qn = connection.ops.quote_name
+        column = qn(model._meta.get_field(time_field).column)
+        # SQLite fills bare columns from the row that matched MAX()
+        sql = (
+            f"SELECT stock_id, MAX(epoch), value FROM ("
+            f"SELECT stock_id, CAST(round((julianday({column}) - 2440587.5) * 86400) AS INTEGER) AS epoch, "
+            f"CAST({qn(price_field)} AS REAL) AS value FROM {qn(model._meta.db_table)} "
+            f"WHERE stock_id IN ({', '.join(['%s'] * len(ids))}) AND {column} >= %s AND {column} < %s"
+            f") GROUP BY stock_id, epoch / %s"
+        )
+        params = [*ids, connection.ops.adapt_datetimefield_value(start), connection.ops.adapt_datetimefield_value(end), step]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        return (
+            np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows)),
+            np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows)),
+        )
+
+    rows = list(
+        model.objects.filter(stock_id__in=ids, **{f"{time_field}__gte": start, f"{time_field}__lt": end})
+        .annotate(value=Cast(price_field, FloatField()))
+        .values_list("stock_id", time_field, "value")
+        .order_by()
+    )
+    return (
+        np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+        np.fromiter((row[1].timestamp() for row in rows), dtype=np.float64, count=len(rows)),
+        np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows)),
+    )
+
+
+def _chunk_rows(ids: List[int], start: datetime, end: datetime):
+    """
+    (stock id, time, price) arrays decoded from packed PriceChunk blobs.
+    """
+    packed = list(
+        PriceChunk.objects.filter(
+            stock_id__in=ids, start__gt=start - timedelta(seconds=series.CHUNK_SECONDS), start__lt=end
+        ).values_list("stock_id", "samples", "data")
+    )
+    if not packed:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    decoded = [series.decode(bytes(data), samples) for _, samples, data in packed]
+    return (
+        np.repeat([stock_id for stock_id, _, _ in packed], [samples for _, samples, _ in packed]),
+        np.concatenate([t for t, _ in decoded]).astype(np.float64),
+        np.concatenate([cents for _, cents in decoded]) / 100.0,
+    )
+
+
+def forward_fill(prices: np.ndarray) -> np.ndarray:
+    """
+    Carry each column's last price down over NaN gaps.
+    """
+    rows = np.where(np.isnan(prices), 0, np.arange(len(prices))[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return prices[rows, np.arange(prices.shape[1])]
+
+
+def close_matrix(stock_ids: List[int], start: datetime, end: datetime, step: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Closing prices of `stock_ids` on a common grid of `step`-second bars
+    from `start` to `end` as (bar start times, T x N price matrix), oldest
+    first, columns in `stock_ids` order. Each cell holds the last price seen
+    in its bar, carried forward over gaps; NaN before a stock's first price.
+    Every storage tier (daily and hourly rollups, raw rows, packed chunks)
+    is read once per chunk of stocks, never once per stock.
+    """
+    ids = np.asarray(stock_ids, dtype=np.int64)
+    sorter = np.argsort(ids)
+    t0 = int(start.timestamp()) // step * step
+    n_bars = max(1, -(-(int(end.timestamp()) - t0) // step))
+    times = t0 + np.arange(n_bars, dtype=np.float64) * step
+
+    now = timezone.now()
+    parts = []
+    for part in chunks(ids.tolist()):
+        for _, model, kept_finer in tiers():
+            if start < now - kept_finer:
+                parts.append(_tier_rows(model, "bucket", part, start, end, step))
+        if series.chunked():
+            parts.append(_chunk_rows(part, start, end))
+        parts.append(_tier_rows(PriceHistory, "timestamp", part, start, end, step))
+
+    prices = np.full((n_bars, len(ids)), np.nan)
+    if parts:
+        found, t, price = (np.concatenate(column) for column in zip(*parts))
+        col = sorter[np.searchsorted(ids, found, sorter=sorter)]
+        bar = ((t - t0) // step).astype(np.int64)
+        keep = (bar >= 0) & (bar < n_bars) & (t < end.timestamp())
+        col, bar, t, price = col[keep], bar[keep], t[keep], price[keep]
+        # The last sample of each (stock, bar)
+        order = np.lexsort((t, bar, col))
+        key = col[order] * n_bars + bar[order]
+        last = order[np.r_[key[1:] != key[:-1], True]] if len(key) else order
+        prices[bar[last], col[last]] = price[last]
+        prices = forward_fill(prices)
+    return times, prices
+
+
+def ohlc_buckets(x: np.ndarray, y: np.ndarray, bucket_seconds: int):
+    """
+    Group sorted samples into fixed time buckets.
+    Returns (bucket start, open, high, low, close) arrays.
+    """
+    return rebucket(x, y, y, y, y, bucket_seconds)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Largest-Triangle-Three-Buckets downsampling: keeps the first and last
+    points and, per bucket, the point forming the largest triangle with the
+    previously kept point and the next bucket's average. Preserves the
+    visual shape (peaks and troughs) far better than taking every n-th point.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        if end >= next_end:
+            avg_x, avg_y = x[-1], y[-1]
+        else:
+            avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return x[keep], y[keep]
+
+
+def downsample(x: np.ndarray, y: np.ndarray, bucket_seconds: Optional[int], max_points: int = None):
+    """
+    Bucket to the period's resolution (closing price per bucket), then cap
+    the series at max_points with LTTB.
+    """
+    if bucket_seconds and len(x):
+        x, _, _, _, y = ohlc_buckets(x, y, bucket_seconds)
+    return lttb(x, y, max_points or CHART_MAX_POINTS)
+
+
+def chart_points(stock_id: int, period: str = DEFAULT_PERIOD, latest: datetime = None) -> List[dict]:
+    """
+    Chart.js points ({x: epoch ms, y: price}) for one stock over `period`,
+    ending at its latest sample so stale data still charts.
+    """
+    if latest is None:
+        latest = LatestQuote.objects.filter(stock_id=stock_id).values_list("timestamp", flat=True).first()
+        if latest is None:
+            return []
+    window, bucket_seconds = PERIODS[period]
+    x, y = downsample(*load_series(stock_id, start=latest - window), bucket_seconds)
+    return [{"x": int(t * 1000), "y": round(float(p), 2)} for t, p in zip(x, y)]
+
+
+def _json_numbers(values: np.ndarray, ints: bool = False) -> Iterator[str]:
+    chunk = 1000
+    for i in range(0, len(values), chunk):
+        part = values[i:i + chunk]
+        text = ",".join(str(int(v)) for v in part) if ints else ",".join(repr(round(float(v), 2)) for v in part)
+        yield ("," if i else "") + text
+
+
+def stream_columns(stock_id: int, symbol: str, start: datetime, end: datetime, resolution: str) -> Iterator[str]:
+    """
+    Yield a compact columnar JSON document for one stock's history:
+    {"symbol", "resolution", "from", "to", "t": [epoch s...], "c": [close...]}
+    plus "o"/"h"/"l" columns when bucketed. Like the dashboard charts, the
+    series is capped at CHART_MAX_POINTS with LTTB on the closes; the bars
+    it keeps carry their own open/high/low. The query runs before the first
+    chunk is yielded so database errors surface before streaming starts.
+    """
+    t, o, h, l, c = load_bars(stock_id, start=start, end=end)
+    bucket_seconds = RESOLUTIONS[resolution]
+    if bucket_seconds:
+        t, o, h, l, c = rebucket(t, o, h, l, c, bucket_seconds)
+    kept, c = downsample(t, c, None)
+    if len(kept) < len(t):
+        at = np.searchsorted(t, kept)
+        o, h, l = o[at], h[at], l[at]
+    t = kept
+    columns = [("o", o), ("h", h), ("l", l), ("c", c)] if bucket_seconds else [("c", c)]
+
+    def chunks():
+        yield (
+            f'{{"symbol":{json.dumps(symbol)},"resolution":"{resolution}",'
+            f'"from":{int(start.timestamp())},"to":{int(end.timestamp())},"t":['
+        )
+        yield from _json_numbers(t, ints=True)
+        for name, values in columns:
+            yield f'],"{name}":['
+            yield from _json_numbers(values)
+        yield "]}"
+    return chunks()
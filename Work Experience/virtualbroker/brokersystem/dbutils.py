@@ -0,0 +1,67 @@
+from typing import Iterable, List
+
+from django.db import connection, models
+
+# Bound parameters per statement, under SQLite's historic 999 limit
+MAX_PARAMS = 999
+# Ids per IN (...) clause, leaving room for the statement's other parameters
+ID_CHUNK = MAX_PARAMS - 99
+
+
+def chunks(ids, size=ID_CHUNK):
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def supports_update_from() -> bool:
+    if connection.vendor == "sqlite":
+        return connection.Database.sqlite_version_info >= (3, 33, 0)
+    return connection.vendor == "postgresql"
+
+
+def bulk_update_values(objs: Iterable[models.Model], fields: List[str]) -> int:
+    """
+    Write `fields` of loaded model instances with one statement per chunk:
+        UPDATE t SET f1 = v.column2, ... FROM (VALUES (pk, f1, ...), ...) v WHERE t.pk = v.column1
+    QuerySet.bulk_update builds a CASE expression per field and row, which
+    costs far more to compile than to run; backends without UPDATE ... FROM
+    still fall back to it. Returns the number of rows updated.
+    """
+    objs = list(objs)
+    if not objs:
+        return 0
+    model = type(objs[0])
+    if not supports_update_from():
+        return model.objects.bulk_update(objs, fields, batch_size=500)
+
+    opts = model._meta
+    model_fields = [opts.get_field(name) for name in fields]
+    qn = connection.ops.quote_name
+    table = qn(opts.db_table)
+    # Postgres types VALUES columns from the first row, so cast explicitly
+    casts = [
+        f"::{field.cast_db_type(connection)}" if connection.vendor == "postgresql" else ""
+        for field in model_fields
+    ]
+    assignments = ", ".join(
+        f"{qn(field.column)} = v.column{i + 2}{cast}" for i, (field, cast) in enumerate(zip(model_fields, casts))
+    )
+    row = "(" + ", ".join(["%s"] * (len(fields) + 1)) + ")"
+    chunk = MAX_PARAMS // (len(fields) + 1)
+
+    updated = 0
+    with connection.cursor() as cursor:
+        for i in range(0, len(objs), chunk):
+            part = objs[i:i + chunk]
+            params = []
+            for obj in part:
+                params.append(obj.pk)
+                params.extend(field.get_db_prep_save(getattr(obj, field.attname), connection) for field in model_fields)
+            cursor.execute(
+                f"UPDATE {table} SET {assignments} "
+                f"FROM (VALUES {', '.join([row] * len(part))}) AS v WHERE {table}.{qn(opts.pk.column)} = v.column1",
+                params,
+            )
+            updated += cursor.rowcount
+    return updated
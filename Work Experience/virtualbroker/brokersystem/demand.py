@@ -0,0 +1,77 @@
+import os
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, List
+
+from django.db.models import Count
+from django.utils import timezone
+
+from brokersystem.models import Position, Stock, Transaction
+
+# How far back trades and dashboard views count towards a symbol's demand
+DEMAND_WINDOW_HOURS = int(os.getenv("DEMAND_WINDOW_HOURS", "24"))
+
+# Relative weight of each demand signal
+HELD_WEIGHT = 10      # per open position
+TRADE_WEIGHT = 3      # per recent transaction
+VIEW_WEIGHT = 5       # selected on a dashboard recently
+
+# Each process writes a symbol's view time at most this often
+VIEW_WRITE_SECONDS = 300
+
+_written: Dict[str, float] = {}
+
+
+def record_view(*symbols: str):
+    """
+    Note that a user picked these symbols on a dashboard. Stored on the Stock
+    rows, where the price worker's ranking reads them; a symbol written by
+    this process in the last VIEW_WRITE_SECONDS is skipped.
+    """
+    now = time.time()
+    due = [sym for sym in set(symbols) if sym and now - _written.get(sym, 0) >= VIEW_WRITE_SECONDS]
+    if not due:
+        return
+    Stock.objects.filter(symbol__in=due).update(last_viewed_at=timezone.now())
+    _written.update(dict.fromkeys(due, now))
+
+
+def demand_scores(symbols: Iterable[str]) -> Dict[str, int]:
+    """
+    Score each symbol by open positions, recent transactions and recent
+    dashboard views. Symbols with no demand are left out.
+    """
+    symbols = list(symbols)
+    since = timezone.now() - timedelta(hours=DEMAND_WINDOW_HOURS)
+    scores: Dict[str, int] = {}
+
+    held = (
+        Position.objects.filter(quantity__gt=0)
+        .values_list("stock__symbol")
+        .annotate(n=Count("id"))
+    )
+    for sym, n in held:
+        scores[sym] = scores.get(sym, 0) + HELD_WEIGHT * n
+
+    traded = (
+        Transaction.objects.filter(executed_at__gte=since)
+        .values_list("stock__symbol")
+        .annotate(n=Count("id"))
+    )
+    for sym, n in traded:
+        scores[sym] = scores.get(sym, 0) + TRADE_WEIGHT * n
+
+    viewed = Stock.objects.filter(last_viewed_at__gte=since).values_list("symbol", flat=True)
+    for sym in viewed:
+        scores[sym] = scores.get(sym, 0) + VIEW_WEIGHT
+
+    wanted = set(symbols)
+    return {sym: score for sym, score in scores.items() if sym in wanted}
+
+
+def rank_symbols(symbols: Iterable[str]) -> List[str]:
+    """
+    Symbols with any demand, highest score first (ties by symbol).
+    """
+    scores = demand_scores(symbols)
+    return sorted(scores, key=lambda sym: (-scores[sym], sym))
@@ -1,5 +1,5 @@
 from django import forms
-from .models import CustomUser
+from .models import CustomUser, Order, Stock
 from django.contrib.auth import authenticate, get_user_model
 
 class CustomUserCreationForm(forms.ModelForm):
@@ -16,3 +16,33 @@ class CustomUserCreationForm(forms.ModelForm):
         if commit:
             user.save()
         return user
+
+class OrderForm(forms.ModelForm):
+    symbol = forms.CharField(max_length=10)
+
+    class Meta:
+        model = Order
+        fields = ('side', 'order_type', 'quantity', 'limit_price', 'stop_price')
+
+    def clean_symbol(self):
+        symbol = self.cleaned_data['symbol'].strip().upper()
+        try:
+            self.instance.stock = Stock.objects.get(symbol=symbol)
+        except Stock.DoesNotExist:
+            raise forms.ValidationError(f"Unknown symbol: {symbol}")
+        return symbol
+
+    def clean(self):
+        cleaned = super().clean()
+        order_type = cleaned.get('order_type')
+        if order_type in ('limit', 'stop_limit') and not cleaned.get('limit_price'):
+            self.add_error('limit_price', "A limit price is required for this order type.")
+        if order_type in ('stop', 'stop_limit') and not cleaned.get('stop_price'):
+            self.add_error('stop_price', "A stop price is required for this order type.")
+        # Only keep the prices the order type uses
+        if order_type == 'limit':
+            cleaned['stop_price'] = None
+        elif order_type == 'stop':
+            cleaned['limit_price'] = None
+        return cleaned
+
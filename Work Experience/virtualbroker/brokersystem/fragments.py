@@ -0,0 +1,104 @@
+import os
+import random
+import threading
+from collections import OrderedDict
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from brokersystem import search
+
+# Rendered dashboard tiles kept per process (least recently used evicted first)
+FRAGMENT_CACHE_SIZE = int(os.getenv("DASHBOARD_FRAGMENT_CACHE_SIZE", "256"))
+
+# Version counters, shared through the Django cache so the scheduler and
+# every web process agree. Prices change once per fetch cycle; a user's
+# positions only change when they trade.
+PRICE_CYCLE_KEY = "dashboard:price_cycle"
+PORTFOLIO_KEY = "dashboard:portfolio:{}"
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU map.
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = max(1, maxsize)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+fragments = LRUCache(FRAGMENT_CACHE_SIZE)
+
+
+def cache_is_shared() -> bool:
+    """
+    Whether every process sees the same Django cache. With per-process memory
+    (the default) versions bumped outside a web process, by the price worker
+    or a management command, never reach the web processes.
+    """
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def _bump(key: str):
+    # A counter evicted from the cache restarts at a random value, so keys
+    # built from it never line up with fragments rendered before the eviction
+    cache.add(key, random.getrandbits(48), timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, random.getrandbits(48), timeout=None)
+
+
+def bump_price_cycle():
+    """
+    Call after a fetch cycle has written new prices.
+    """
+    _bump(PRICE_CYCLE_KEY)
+
+
+def bump_portfolio(user_id: int):
+    """
+    Call after a user's positions or balance have changed.
+    """
+    _bump(PORTFOLIO_KEY.format(user_id))
+
+
+def dashboard_key(user_id: int, params) -> tuple:
+    """
+    Every input that can change a user's dashboard tiles: the price cycle,
+    their portfolio version, the Stock universe version and the query
+    parameters. Versions are read in one cache round trip.
+    """
+    keys = [PRICE_CYCLE_KEY, PORTFOLIO_KEY.format(user_id), search.VERSION_KEY]
+    found = cache.get_many(keys)
+    if search.VERSION_KEY not in found:
+        found[search.VERSION_KEY] = search.current_version()
+    for key in keys[:2]:
+        if key not in found:
+            _bump(key)
+            found[key] = cache.get(key)
+    return (user_id,) + tuple(found[key] for key in keys) + (tuple(sorted(params)),)
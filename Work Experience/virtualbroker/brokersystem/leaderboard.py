@@ -0,0 +1,187 @@
+import bisect
+import os
+import threading
+import uuid
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Cast, Coalesce
+
+from brokersystem.dbutils import chunks
+from brokersystem.models import CustomUser, LeaderboardScore
+from brokersystem.trading import money
+
+# Every process keeps the whole ranking in memory, rebuilt from the
+# LeaderboardScore table when the shared version changes (once per fetch
+# cycle). Trades in between publish their users' new worth as numbered
+# deltas in the Django cache, which each process applies in place.
+VERSION_KEY = "leaderboard:version"
+SEQ_KEY = "leaderboard:seq"
+DELTA_KEY = "leaderboard:delta:{}"
+DELTA_TTL_SECONDS = 3600
+# Further behind than this, a process rebuilds instead of replaying deltas
+MAX_BACKLOG = 500
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10"))
+
+
+def net_worths(user_ids: Iterable[int] = None) -> List[Tuple[int, Decimal, Decimal]]:
+    """
+    (user id, cash, net worth) for every user, or just `user_ids`, in one
+    aggregate query over users LEFT JOIN positions. Positions are valued at
+    current_price, falling back to cost, as on the dashboard.
+    """
+    qty_dec = Cast(F("position__quantity"), output_field=DecimalField(max_digits=12, decimal_places=2))
+    holdings = Sum(
+        ExpressionWrapper(
+            qty_dec * Coalesce(F("position__current_price"), F("position__price")),
+            output_field=DecimalField(max_digits=24, decimal_places=2),
+        )
+    )
+    users = CustomUser.objects.all()
+    if user_ids is not None:
+        users = users.filter(id__in=list(user_ids))
+    rows = users.annotate(holdings=holdings).values_list("id", "balance", "holdings").order_by()
+    return [(user_id, balance, money(balance + (held or 0))) for user_id, balance, held in rows]
+
+
+def _cents(worth: Decimal) -> int:
+    return int(worth * 100)
+
+
+class Leaderboard:
+    """
+    Users ordered by net worth, richest first, as one sorted list of
+    (-worth in cents, user id) keys. Rank and top-N lookups are a bisect and
+    a slice; moving one user is a bisect, a delete and an insort. Equal worth
+    shares a rank.
+    """
+    def __init__(self, rows: Iterable[Tuple[int, Decimal]]):
+        self._keys: Dict[int, Tuple[int, int]] = {user_id: (-_cents(worth), user_id) for user_id, worth in rows}
+        self.keys = sorted(self._keys.values())
+
+    def set(self, user_id: int, worth: Decimal):
+        old = self._keys.get(user_id)
+        if old is not None:
+            del self.keys[bisect.bisect_left(self.keys, old)]
+        key = self._keys[user_id] = (-_cents(worth), user_id)
+        bisect.insort(self.keys, key)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        key = self._keys.get(user_id)
+        if key is None:
+            return None
+        return bisect.bisect_left(self.keys, (key[0],)) + 1
+
+    def top(self, n: int) -> List[Tuple[int, int, Decimal]]:
+        """
+        [(rank, user id, worth), ...] for the first n users.
+        """
+        rows, rank, previous = [], 0, None
+        for i, (neg_cents, user_id) in enumerate(self.keys[:n]):
+            if neg_cents != previous:
+                rank, previous = i + 1, neg_cents
+            rows.append((rank, user_id, Decimal(-neg_cents) / 100))
+        return rows
+
+    def worth(self, user_id: int) -> Optional[Decimal]:
+        key = self._keys.get(user_id)
+        return None if key is None else Decimal(-key[0]) / 100
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def _upsert(worths: Dict[int, Decimal]):
+    for ids in chunks(worths):
+        LeaderboardScore.objects.bulk_create(
+            [LeaderboardScore(user_id=user_id, worth=worths[user_id]) for user_id in ids],
+            update_conflicts=True,
+            unique_fields=["user"],
+            update_fields=["worth", "updated_at"],
+        )
+
+
+def refresh_scores(rows: List[Tuple[int, Decimal, Decimal]] = None) -> int:
+    """
+    Bring the score table in line with `rows` from net_worths() (all users
+    if not given), writing only the scores that changed, and make every
+    process rebuild its ranking. Call after a fetch cycle.
+    Returns the number of scores written.
+    """
+    rows = net_worths() if rows is None else rows
+    stored = dict(LeaderboardScore.objects.values_list("user_id", "worth"))
+    changed = {user_id: worth for user_id, _, worth in rows if stored.get(user_id) != worth}
+    _upsert(changed)
+    cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    return len(changed)
+
+
+def record_trade(*user_ids: int):
+    """
+    Re-score users whose cash or positions just changed and publish the new
+    scores to every process. Call after a trade has committed.
+    """
+    worths = {user_id: worth for user_id, _, worth in net_worths(user_ids)}
+    _upsert(worths)
+    cache.add(SEQ_KEY, 0, timeout=None)
+    try:
+        seq = cache.incr(SEQ_KEY)
+    except ValueError:
+        cache.set(SEQ_KEY, 1, timeout=None)
+        seq = 1
+    cache.set(DELTA_KEY.format(seq), worths, timeout=DELTA_TTL_SECONDS)
+
+
+_board = None
+_version = None
+_seq = 0
+_lock = threading.Lock()
+
+
+def current_version() -> str:
+    """
+    The shared version of the score table, started if missing.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(VERSION_KEY, version, timeout=None)
+        version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def _replay(last: int, seq: int) -> bool:
+    """
+    Apply the deltas published after `last` to the process-wide board.
+    False when they can't be replayed (expired, too many, counter reset).
+    """
+    if last > seq or seq - last > MAX_BACKLOG:
+        return False
+    wanted = [DELTA_KEY.format(n) for n in range(last + 1, seq + 1)]
+    found = cache.get_many(wanted)
+    if len(found) < len(wanted):
+        return False
+    for key in wanted:
+        for user_id, worth in found[key].items():
+            _board.set(user_id, worth)
+    return True
+
+
+def get_board() -> Leaderboard:
+    """
+    The process-wide ranking: rebuilt from the score table when the shared
+    version has changed, otherwise brought up to date with any trade deltas.
+    """
+    global _board, _version, _seq
+    version = current_version()
+    seq = cache.get(SEQ_KEY, 0)
+    with _lock:
+        if _board is not None and _version == version and _seq != seq and _replay(_seq, seq):
+            _seq = seq
+        elif _board is None or _version != version or _seq != seq:
+            # Deltas up to `seq` are already in the table; re-applying later ones is harmless
+            _board = Leaderboard(LeaderboardScore.objects.values_list("user_id", "worth").iterator(chunk_size=5000))
+            _version, _seq = version, seq
+    return _board
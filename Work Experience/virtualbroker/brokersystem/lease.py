@@ -0,0 +1,51 @@
+import os
+import socket
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from brokersystem.models import WorkerLease
+
+# A holder that stops renewing (crashed, hung, lost its host) is replaced
+# by a standby within this long
+LEASE_SECONDS = int(os.getenv("WORKER_LEASE_SECONDS", "60"))
+
+
+def holder_id() -> str:
+    """
+    A name for this process that is unique across hosts and restarts.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquire_lease(name: str, holder: str, seconds: int = LEASE_SECONDS, now=None) -> bool:
+    """
+    Take or renew the lease `name` for `seconds`. True when `holder` now
+    holds it: it already did, the lease had expired, or nobody had taken it
+    yet. Each case is one conditional statement, so of several processes
+    racing for a free lease exactly one wins.
+    """
+    now = now or timezone.now()
+    expires_at = now + timedelta(seconds=seconds)
+    if WorkerLease.objects.filter(name=name, holder=holder).update(expires_at=expires_at):
+        return True
+    if WorkerLease.objects.filter(name=name, expires_at__lte=now).update(
+        holder=holder, expires_at=expires_at, acquired_at=now
+    ):
+        return True
+    try:
+        with transaction.atomic():
+            WorkerLease.objects.create(name=name, holder=holder, expires_at=expires_at, acquired_at=now)
+    except IntegrityError:
+        return False
+    return True
+
+
+def release_lease(name: str, holder: str) -> bool:
+    """
+    Give the lease up at once so a standby need not wait for it to expire.
+    False when `holder` didn't hold it.
+    """
+    return bool(WorkerLease.objects.filter(name=name, holder=holder).update(expires_at=timezone.now()))
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import time
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+# One diff of changed quotes per fetch cycle, shared through the Django cache
+# so the scheduler can publish from any process. Streams poll the sequence
+# counter (one cache read) and forward the diffs they have not sent yet.
+SEQ_KEY = "live:quotes:seq"
+DIFF_KEY = "live:quotes:{}"
+DIFF_TTL_SECONDS = int(os.getenv("LIVE_DIFF_TTL_SECONDS", "3600"))
+POLL_SECONDS = float(os.getenv("LIVE_POLL_SECONDS", "1"))
+HEARTBEAT_SECONDS = 15
+# Streams end after this long and the browser reconnects with Last-Event-ID
+STREAM_SECONDS = int(os.getenv("LIVE_STREAM_SECONDS", "300"))
+# How often dashboards served under WSGI poll for new diffs; the event
+# stream is only routed under ASGI
+CLIENT_POLL_SECONDS = int(os.getenv("LIVE_CLIENT_POLL_SECONDS", "30"))
+# Further behind than this, a client reloads instead of replaying diffs
+MAX_BACKLOG = 50
+
+
+def publish_quotes(changed: Dict[str, Decimal], when) -> Optional[int]:
+    """
+    Publish one cycle's changed quotes ({symbol: price}). Returns the diff's
+    sequence number, or None when nothing changed.
+    """
+    if not changed:
+        return None
+    cache.add(SEQ_KEY, 0, timeout=None)
+    try:
+        seq = cache.incr(SEQ_KEY)
+    except ValueError:
+        cache.set(SEQ_KEY, 1, timeout=None)
+        seq = 1
+    diff = {"t": int(when.timestamp()), "q": {symbol: float(price) for symbol, price in changed.items()}}
+    cache.set(DIFF_KEY.format(seq), diff, timeout=DIFF_TTL_SECONDS)
+    return seq
+
+
+def current_seq() -> int:
+    return cache.get(SEQ_KEY, 0)
+
+
+def pending(last: int) -> Tuple[int, Optional[List[Tuple[int, dict]]]]:
+    """
+    (current sequence, [(seq, diff), ...] published after `last`). The list is
+    None when those diffs can't be replayed (expired, too many, or the counter
+    was reset); the client then reloads the page.
+    """
+    seq = current_seq()
+    if seq == last:
+        return seq, []
+    if last > seq or seq - last > MAX_BACKLOG:
+        return seq, None
+    wanted = range(last + 1, seq + 1)
+    found = cache.get_many([DIFF_KEY.format(n) for n in wanted])
+    if len(found) < len(wanted):
+        return seq, None
+    return seq, [(n, found[DIFF_KEY.format(n)]) for n in wanted]
+
+
+def format_event(event: str, data, seq: int = None) -> str:
+    lines = [f"id: {seq}"] if seq is not None else []
+    lines += [f"event: {event}", "data: " + json.dumps(data, separators=(",", ":"))]
+    return "\n".join(lines) + "\n\n"
+
+
+class QuoteStream:
+    """
+    Server-sent events for one client, as a sync or an async iterator. Each
+    tick forwards new diffs as "quotes" events; a "reload" event tells the
+    client it missed diffs it can no longer get. Comments keep idle
+    connections open.
+    """
+    def __init__(self, last_event_id: str = None, duration: float = None, poll: float = None):
+        try:
+            self.last = int(last_event_id)
+        except (TypeError, ValueError):
+            self.last = None  # new client: only diffs from now on
+        self.duration = STREAM_SECONDS if duration is None else duration
+        self.poll = POLL_SECONDS if poll is None else poll
+
+    def _tick(self) -> str:
+        if self.last is None:
+            self.last = current_seq()
+            return ""
+        seq, diffs = pending(self.last)
+        self.last = seq
+        if diffs is None:
+            return format_event("reload", {}, seq)
+        return "".join(format_event("quotes", diff, n) for n, diff in diffs)
+
+    def _frame(self, chunk: str, now: float, sent: float) -> Tuple[str, float]:
+        """
+        (text to send, time of the last send).
+        """
+        if chunk:
+            return chunk, now
+        if now - sent >= HEARTBEAT_SECONDS:
+            return ": ping\n\n", now
+        return "", sent
+
+    def __iter__(self) -> Iterator[str]:
+        yield f"retry: {int(self.poll * 1000) + 1000}\n\n"
+        start = sent = time.monotonic()
+        while True:
+            chunk, sent = self._frame(self._tick(), time.monotonic(), sent)
+            if chunk:
+                yield chunk
+            if time.monotonic() - start >= self.duration:
+                return
+            time.sleep(self.poll)
+
+    async def __aiter__(self):
+        yield f"retry: {int(self.poll * 1000) + 1000}\n\n"
+        start = sent = time.monotonic()
+        tick = sync_to_async(self._tick, thread_sensitive=False)
+        while True:
+            chunk, sent = self._frame(await tick(), time.monotonic(), sent)
+            if chunk:
+                yield chunk
+            if time.monotonic() - start >= self.duration:
+                return
+            await asyncio.sleep(self.poll)
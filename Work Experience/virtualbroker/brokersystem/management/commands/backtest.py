@@ -0,0 +1,72 @@
+import csv
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from brokersystem.backtest import STRATEGIES, backtest
+from brokersystem.charts import RESOLUTIONS
+
+
+class Command(BaseCommand):
+    help = "Backtest a rule-based strategy (sma, momentum, rebalance) over stored price history."
+
+    def add_arguments(self, parser):
+        parser.add_argument("strategy", choices=sorted(STRATEGIES))
+        parser.add_argument("--symbols", help="Comma-separated symbols (default: every stock)")
+        parser.add_argument("--days", type=int, default=365, help="How far back to test (default 365)")
+        parser.add_argument("--step", choices=[name for name, seconds in RESOLUTIONS.items() if seconds], default="1d")
+        parser.add_argument("--capital", type=float, default=10000)
+        parser.add_argument("--fast", type=int, default=20, help="sma: fast window in bars")
+        parser.add_argument("--slow", type=int, default=50, help="sma: slow window in bars")
+        parser.add_argument("--lookback", type=int, default=20, help="momentum: trailing return window in bars")
+        parser.add_argument("--top", type=int, default=10, help="momentum: symbols held")
+        parser.add_argument("--every", type=int, default=20, help="rebalance: bars between rebalances")
+        parser.add_argument("--csv", help="Write the equity curve to this file")
+
+    def handle(self, *args, **options):
+        strategy = options["strategy"]
+        params = {
+            "sma": {"fast": options["fast"], "slow": options["slow"]},
+            "momentum": {"lookback": options["lookback"], "top": options["top"]},
+            "rebalance": {"every": options["every"]},
+        }[strategy]
+        if min(params.values()) < 1:
+            raise CommandError("Window sizes must be positive.")
+        symbols = [s.strip().upper() for s in options["symbols"].split(",") if s.strip()] if options["symbols"] else None
+        end = timezone.now()
+
+        started = time.perf_counter()
+        result = backtest(
+            strategy, symbols, start=end - timedelta(days=options["days"]), end=end,
+            step=RESOLUTIONS[options["step"]], capital=options["capital"], **params,
+        )
+        elapsed = time.perf_counter() - started
+        if result is None:
+            raise CommandError("No matching stocks.")
+
+        equity = result["equity"]
+        fmt = lambda value, scale=100: "n/a" if value is None else f"{value * scale:.2f}"
+        self.stdout.write(
+            f"{strategy} {params} over {len(result['symbols'])} symbols x {len(equity)} bars "
+            f"({options['step']}) in {elapsed:.2f}s"
+        )
+        self.stdout.write(
+            f"Equity {options['capital']:.2f} -> {equity[-1]:.2f} ({fmt(result['total_return'])}%), "
+            f"volatility {fmt(result['volatility'])}%, Sharpe {fmt(result['sharpe'], 1)}, "
+            f"max drawdown {fmt(result['max_drawdown'])}%, {result['trades']} trades"
+        )
+        order = np.argsort(result["symbol_returns"])[::-1]
+        for label, picks in (("Best", order[:5]), ("Worst", order[::-1][:5])):
+            listed = ", ".join(f"{result['symbols'][i]} {result['symbol_returns'][i] * 100:+.1f}%" for i in picks)
+            self.stdout.write(f"{label}: {listed}")
+
+        if options["csv"]:
+            with open(options["csv"], "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["time", "equity"])
+                for t, value in zip(result["times"], equity):
+                    writer.writerow([datetime.fromtimestamp(t, tz=dt_timezone.utc).isoformat(), f"{value:.2f}"])
+            self.stdout.write(f"Equity curve written to {options['csv']}.")
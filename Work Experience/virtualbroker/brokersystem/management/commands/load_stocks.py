@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from brokersystem.fragments import cache_is_shared
+from brokersystem.universe import load_universe, read_rows
+
+
+class Command(BaseCommand):
+    help = "Upsert the Stock universe from a CSV (name,symbol[,is_public]), JSON or JSON Lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument(
+            "--remove-missing", action="store_true",
+            help="Delete symbols missing from the file, with their price history, unless held or traded",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            report = load_universe(
+                read_rows(options["path"]), remove_missing=options["remove_missing"], dry_run=options["dry_run"]
+            )
+        except OSError as e:
+            raise CommandError(f"Can't read {options['path']}: {e}")
+        except (ValueError, AttributeError, TypeError) as e:
+            raise CommandError(f"Can't parse {options['path']}: {e}")
+
+        listed = lambda symbols: ", ".join(symbols[:10]) + (f" (+{len(symbols) - 10} more)" if len(symbols) > 10 else "")
+        self.stdout.write(
+            f"{'Would load' if options['dry_run'] else 'Loaded'} {options['path']} in {time.perf_counter() - started:.2f}s: "
+            f"{len(report['added'])} added, {len(report['changed'])} changed, {len(report['removed'])} removed, "
+            f"{len(report['skipped'])} skipped."
+        )
+        for label in ("added", "changed", "removed"):
+            if report[label]:
+                self.stdout.write(f"{label.capitalize()}: {listed(report[label])}")
+        if report["kept"]:
+            self.stdout.write(f"Kept {len(report['kept'])} delisted symbols still held or traded: {listed(report['kept'])}")
+        if report["missing"]:
+            self.stdout.write(
+                f"Left {len(report['missing'])} symbols missing from the file in place (--remove-missing deletes them): "
+                f"{listed(report['missing'])}"
+            )
+        if not options["dry_run"] and (report["added"] or report["changed"] or report["removed"]) and not cache_is_shared():
+            self.stderr.write(
+                "The cache is per-process memory: web processes already running keep their old stock search "
+                "index until they restart. Set CACHE_LOCATION to a shared cache to update them in place."
+            )
@@ -0,0 +1,41 @@
+import signal
+
+from apscheduler.schedulers.blocking import BlockingScheduler
+from django.core.management.base import BaseCommand, CommandError
+
+from brokersystem.fragments import cache_is_shared
+from brokersystem.lease import LEASE_SECONDS
+from brokersystem.scheduler import SCHEDULE_MODE, SCHEDULER_TIMEZONE, PriceWorker, cycle_interval_minutes
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch prices in this process, apart from the web workers. Run as many as you like: a database lease "
+        "lets exactly one fetch at a time, and a standby takes over within WORKER_LEASE_SECONDS if it dies."
+    )
+
+    def handle(self, *args, **options):
+        if not cache_is_shared():
+            raise CommandError(
+                "The cache is per-process memory, so web processes would never see this worker's new quotes, "
+                "dashboard versions or leaderboard changes. Set CACHE_LOCATION to a shared cache, or leave it unset "
+                "and let runserver fetch, as it does by default."
+            )
+        sched = BlockingScheduler(timezone=SCHEDULER_TIMEZONE)
+        worker = PriceWorker(sched)
+        worker.install()
+        # Stop on SIGTERM as on Ctrl+C: finish the running cycle, then hand over the lease
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        self.stdout.write(
+            f"Price worker {worker.holder} started ({SCHEDULE_MODE} mode, every {cycle_interval_minutes()} min, "
+            f"{LEASE_SECONDS}s lease)."
+        )
+        try:
+            sched.start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if sched.running:
+                sched.shutdown()
+            worker.release()
+            self.stdout.write(f"Price worker {worker.holder} stopped.")
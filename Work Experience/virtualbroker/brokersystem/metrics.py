@@ -0,0 +1,226 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence
+
+from django.db import DatabaseError
+from django.utils import timezone
+
+from brokersystem.models import FetchCycle
+
+# Every fetch cycle leaves a FetchCycle row (stage timings and counters,
+# written by whichever process fetched), and /metrics sums those rows into
+# Prometheus counters and histograms. Each web process folds in only the
+# rows added since its last scrape.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# When set, scrapers must send "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Upper bounds (seconds) of the quote request latency histogram
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# ... and of the per-stage cycle duration histogram; the last ones bracket
+# the 5-minute tiered and 25-minute flat intervals
+STAGE_BUCKETS = (0.01, 0.05, 0.25, 1, 5, 15, 60, 150, 300, 600, 1500, 3000)
+STAGES = ("fetch", "write", "positions", "orders", "valuation", "total")
+
+
+class Histogram:
+    """
+    Observation counts per bucket (the last one unbounded) and their sum.
+    """
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def merge(self, counts: List[int], total: float):
+        if len(counts) == len(self.counts):
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.sum += total
+
+    def lines(self, name: str, labels: str = "") -> List[str]:
+        """
+        The histogram's _bucket (cumulative), _sum and _count samples.
+        """
+        prefix = f"{labels}," if labels else ""
+        rows, running = [], 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            running += count
+            rows.append(f'{name}_bucket{{{prefix}le="{bound}"}} {running}')
+        braces = f"{{{labels}}}" if labels else ""
+        rows.append(f"{name}_sum{braces} {self.sum:.6f}")
+        rows.append(f"{name}_count{braces} {running}")
+        return rows
+
+
+class RequestStats:
+    """
+    One cycle's quote requests as reported by the provider, possibly from
+    several fetch threads at once.
+    """
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.failed = 0
+        self.throttle_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def request(self, seconds: float, ok: bool):
+        with self._lock:
+            self.latency.observe(seconds)
+            self.failed += not ok
+
+    def throttle(self, seconds: float):
+        with self._lock:
+            self.throttle_seconds += seconds
+
+
+class CycleTracker:
+    """
+    The FetchCycle being filled in by a running fetch job.
+    """
+    def __init__(self, cycle):
+        self.cycle = cycle
+        self.stats = RequestStats()
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            field = f"{name}_seconds"
+            setattr(self.cycle, field, getattr(self.cycle, field) + time.perf_counter() - started)
+
+
+@contextmanager
+def track_cycle(provider, symbols: int, interval_seconds: int):
+    """
+    Time a fetch cycle and collect `provider`'s request stats for it, then
+    save it as a FetchCycle, also when the cycle raises.
+    """
+    tracker = CycleTracker(FetchCycle(
+        started_at=timezone.now(), provider=provider.name, symbols=symbols, interval_seconds=interval_seconds
+    ))
+    provider.stats = tracker.stats
+    started = time.perf_counter()
+    try:
+        yield tracker
+    except Exception as e:
+        tracker.cycle.ok = False
+        tracker.cycle.error = f"{type(e).__name__}: {e}"[:500]
+        raise
+    finally:
+        provider.stats = None
+        cycle, stats = tracker.cycle, tracker.stats
+        cycle.total_seconds = time.perf_counter() - started
+        cycle.requests = sum(stats.latency.counts)
+        cycle.failed_requests = stats.failed
+        cycle.request_latency = stats.latency.counts
+        cycle.request_seconds = stats.latency.sum
+        cycle.throttle_seconds = stats.throttle_seconds
+        try:
+            cycle.save()
+        except DatabaseError as e:
+            print(f"Couldn't record the fetch cycle: {e}")
+
+
+class Totals:
+    """
+    Running sums over every FetchCycle row up to `last_id`.
+    """
+    COUNTERS = ("symbols", "fetched", "requests", "failed_requests", "throttle_seconds",
+                "prices_written", "positions_updated", "orders_filled")
+
+    def __init__(self):
+        self.last_id = 0
+        self.cycles = {True: 0, False: 0}
+        self.sums: Dict[str, float] = dict.fromkeys(self.COUNTERS, 0)
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.stages = {stage: Histogram(STAGE_BUCKETS) for stage in STAGES}
+        self.last = None
+
+    def add(self, row: dict):
+        self.last_id = row["id"]
+        self.cycles[row["ok"]] += 1
+        for name in self.COUNTERS:
+            self.sums[name] += row[name]
+        self.latency.merge(row["request_latency"] or [], row["request_seconds"])
+        for stage in STAGES:
+            self.stages[stage].observe(row[f"{stage}_seconds"])
+        self.last = row
+
+
+_totals = Totals()
+_lock = threading.Lock()
+
+
+def totals() -> Totals:
+    """
+    The process-wide totals, brought up to date with new FetchCycle rows.
+    """
+    fields = ["id", "ok", "started_at", "interval_seconds", "request_latency", "request_seconds", *Totals.COUNTERS,
+              *(f"{stage}_seconds" for stage in STAGES)]
+    with _lock:
+        for row in FetchCycle.objects.filter(id__gt=_totals.last_id).order_by("id").values(*fields).iterator():
+            _totals.add(row)
+        return _totals
+
+
+def _metric(lines: List[str], name: str, kind: str, help_text: str, samples: List[str]):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    lines.extend(samples)
+
+
+def render() -> str:
+    """
+    Fetch-cycle metrics in the Prometheus text exposition format.
+    """
+    t = totals()
+    s = t.sums
+    lines: List[str] = []
+    _metric(lines, "broker_fetch_cycles_total", "counter", "Price fetch cycles run, by outcome.", [
+        f'broker_fetch_cycles_total{{outcome="ok"}} {t.cycles[True]}',
+        f'broker_fetch_cycles_total{{outcome="error"}} {t.cycles[False]}',
+    ])
+    _metric(lines, "broker_fetch_symbols_total", "counter", "Symbols asked for, by whether a price came back.", [
+        f'broker_fetch_symbols_total{{result="fetched"}} {s["fetched"]}',
+        f'broker_fetch_symbols_total{{result="missing"}} {s["symbols"] - s["fetched"]}',
+    ])
+    _metric(lines, "broker_quote_requests_total", "counter", "Requests made to the quote provider, by outcome.", [
+        f'broker_quote_requests_total{{result="ok"}} {s["requests"] - s["failed_requests"]}',
+        f'broker_quote_requests_total{{result="failed"}} {s["failed_requests"]}',
+    ])
+    _metric(lines, "broker_quote_request_duration_seconds", "histogram", "Quote provider request latency.",
+            t.latency.lines("broker_quote_request_duration_seconds"))
+    _metric(lines, "broker_quote_throttle_seconds_total", "counter",
+            "Time fetch threads spent waiting on the rate limiter.",
+            [f"broker_quote_throttle_seconds_total {s['throttle_seconds']:.6f}"])
+    _metric(lines, "broker_fetch_stage_duration_seconds", "histogram", "Fetch cycle duration per stage.", [
+        line for stage in STAGES
+        for line in t.stages[stage].lines("broker_fetch_stage_duration_seconds", f'stage="{stage}"')
+    ])
+    for name, field, help_text in (
+        ("broker_prices_written_total", "prices_written", "PriceHistory rows written."),
+        ("broker_positions_updated_total", "positions_updated", "Position prices updated."),
+        ("broker_orders_filled_total", "orders_filled", "Resting orders filled by new prices."),
+    ):
+        _metric(lines, name, "counter", help_text, [f"{name} {s[field]}"])
+
+    if t.last is not None:
+        last = t.last
+        _metric(lines, "broker_fetch_last_cycle_timestamp_seconds", "gauge", "When the last fetch cycle started.",
+                [f"broker_fetch_last_cycle_timestamp_seconds {last['started_at'].timestamp():.3f}"])
+        _metric(lines, "broker_fetch_last_cycle_duration_seconds", "gauge", "The last fetch cycle's duration per stage.", [
+            f'broker_fetch_last_cycle_duration_seconds{{stage="{stage}"}} {last[f"{stage}_seconds"]:.6f}'
+            for stage in STAGES
+        ])
+        _metric(lines, "broker_fetch_interval_utilization", "gauge",
+                "The last fetch cycle's duration as a fraction of the schedule interval.",
+                [f"broker_fetch_interval_utilization {last['total_seconds'] / max(1, last['interval_seconds']):.6f}"])
+    return "\n".join(lines) + "\n"
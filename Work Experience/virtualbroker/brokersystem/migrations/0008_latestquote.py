@@ -0,0 +1,37 @@
+# Generated by Django 4.2.24 on 2026-10-17 03:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_latest_quotes(apps, schema_editor):
+    PriceHistory = apps.get_model("brokersystem", "PriceHistory")
+    LatestQuote = apps.get_model("brokersystem", "LatestQuote")
+    latest = {}
+    for stock_id, price, timestamp in PriceHistory.objects.order_by("stock_id", "timestamp").values_list(
+        "stock_id", "price", "timestamp"
+    ).iterator():
+        latest[stock_id] = (price, timestamp)
+    LatestQuote.objects.bulk_create(
+        [LatestQuote(stock_id=stock_id, price=price, timestamp=ts) for stock_id, (price, ts) in latest.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brokersystem', '0007_position_current_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestQuote',
+            fields=[
+                ('stock', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='latest_quote', serialize=False, to='brokersystem.stock')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('timestamp', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(backfill_latest_quotes, migrations.RunPython.noop),
+    ]
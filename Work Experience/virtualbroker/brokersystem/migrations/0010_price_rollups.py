@@ -0,0 +1,46 @@
+# Generated by Django 4.2.24 on 2026-10-17 03:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brokersystem', '0009_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('open', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('high', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('low', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('close', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='brokersystem.stock')),
+            ],
+            options={
+                'abstract': False,
+                'unique_together': {('stock', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PriceDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('open', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('high', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('low', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('close', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='brokersystem.stock')),
+            ],
+            options={
+                'abstract': False,
+                'unique_together': {('stock', 'bucket')},
+            },
+        ),
+    ]
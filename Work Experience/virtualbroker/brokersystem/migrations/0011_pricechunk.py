@@ -0,0 +1,27 @@
+# Generated by Django 4.2.24 on 2026-10-17 03:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brokersystem', '0010_price_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('samples', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='brokersystem.stock')),
+            ],
+            options={
+                'unique_together': {('stock', 'start')},
+            },
+        ),
+    ]
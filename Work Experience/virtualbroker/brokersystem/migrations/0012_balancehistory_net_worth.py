@@ -0,0 +1,28 @@
+# Generated by Django 4.2.24 on 2026-10-17 03:55
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brokersystem', '0011_pricechunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='balancehistory',
+            name='net_worth',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.AlterField(
+            model_name='balancehistory',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='balancehistory',
+            index=models.Index(fields=['user', 'timestamp'], name='brokersyste_user_id_47340b_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.24 on 2026-10-17 04:26
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brokersystem', '0013_leaderboardscore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkerLease',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('holder', models.CharField(max_length=100)),
+                ('expires_at', models.DateTimeField()),
+                ('acquired_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
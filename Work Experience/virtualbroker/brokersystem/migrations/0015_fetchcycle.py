@@ -0,0 +1,40 @@
+# Generated by Django 4.2.24 on 2026-10-17 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brokersystem', '0014_workerlease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FetchCycle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(db_index=True)),
+                ('provider', models.CharField(max_length=30)),
+                ('ok', models.BooleanField(default=True)),
+                ('error', models.CharField(blank=True, max_length=500)),
+                ('interval_seconds', models.PositiveIntegerField()),
+                ('symbols', models.PositiveIntegerField(default=0)),
+                ('fetched', models.PositiveIntegerField(default=0)),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('failed_requests', models.PositiveIntegerField(default=0)),
+                ('request_latency', models.JSONField(default=list)),
+                ('request_seconds', models.FloatField(default=0)),
+                ('throttle_seconds', models.FloatField(default=0)),
+                ('prices_written', models.PositiveIntegerField(default=0)),
+                ('positions_updated', models.PositiveIntegerField(default=0)),
+                ('orders_filled', models.PositiveIntegerField(default=0)),
+                ('fetch_seconds', models.FloatField(default=0)),
+                ('write_seconds', models.FloatField(default=0)),
+                ('positions_seconds', models.FloatField(default=0)),
+                ('orders_seconds', models.FloatField(default=0)),
+                ('valuation_seconds', models.FloatField(default=0)),
+                ('total_seconds', models.FloatField(default=0)),
+            ],
+        ),
+    ]
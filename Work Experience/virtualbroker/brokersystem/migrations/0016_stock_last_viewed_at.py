@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-17 04:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brokersystem', '0015_fetchcycle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='last_viewed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
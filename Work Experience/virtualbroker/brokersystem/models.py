@@ -19,20 +19,29 @@ class CustomUser(AbstractUser):
         return self.email
 
 class BalanceHistory(models.Model):
+    # One row per user per price cycle (see scheduler.snapshot_balances)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    balance = models.DecimalField(max_digits=12, decimal_places=2)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    balance = models.DecimalField(max_digits=12, decimal_places=2)  # Cash
+    net_worth = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)  # Cash + holdings at market
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["user", "timestamp"])]
     
     def __str__(self):
         return self.user.username
     
     def save(self, *args, **kwargs):
-        self.balance = self.user.balance
+        # Only look the user up when the caller didn't say
+        if self.balance is None:
+            self.balance = self.user.balance
         super().save(*args, **kwargs)
 
 class Stock(models.Model):
     name = models.CharField(max_length=100)
     symbol = models.CharField(max_length=10, unique=True)
+    # Last time someone picked it on a dashboard (see demand.record_view)
+    last_viewed_at = models.DateTimeField(null=True, blank=True, db_index=True)
     
     def __str__(self):
         return self.name
@@ -52,6 +61,112 @@ class PriceHistory(models.Model):
     def __str__(self):
         return f"{self.stock.symbol} @ {self.price} ({self.timestamp:%Y-%m-%d %H:%M})"
 
+class LatestQuote(models.Model):
+    # Most recent PriceHistory price per stock, maintained by the fetcher so
+    # reads don't need a "latest row" subquery over the whole history
+    stock = models.OneToOneField(Stock, on_delete=models.CASCADE, primary_key=True, related_name="latest_quote")
+    price = models.DecimalField(max_digits=12, decimal_places=2)
+    timestamp = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.stock.symbol} @ {self.price} ({self.timestamp:%Y-%m-%d %H:%M})"
+
+class LeaderboardScore(models.Model):
+    # Net worth per user as of the last fetch cycle or trade, maintained by
+    # leaderboard.py so ranking never re-values every portfolio
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name="score")
+    worth = models.DecimalField(max_digits=14, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["-worth", "user"])]
+
+    def __str__(self):
+        return f"{self.user} {self.worth}"
+
+
+
+class WorkerLease(models.Model):
+    # Which process runs a singleton background job (the price worker) and
+    # until when; the holder keeps renewing it, anyone may take it once expired
+    name = models.CharField(max_length=50, primary_key=True)
+    holder = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
+    acquired_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder} until {self.expires_at}"
+
+
+class FetchCycle(models.Model):
+    # One price fetch run, recorded by metrics.track_cycle and summed into
+    # /metrics: stage timings in seconds, and counters
+    started_at = models.DateTimeField(db_index=True)
+    provider = models.CharField(max_length=30)
+    ok = models.BooleanField(default=True)
+    error = models.CharField(max_length=500, blank=True)
+    interval_seconds = models.PositiveIntegerField()  # the schedule's cycle length
+    symbols = models.PositiveIntegerField(default=0)
+    fetched = models.PositiveIntegerField(default=0)
+    requests = models.PositiveIntegerField(default=0)
+    failed_requests = models.PositiveIntegerField(default=0)
+    # Request counts per metrics.LATENCY_BUCKETS bucket, then their total time
+    request_latency = models.JSONField(default=list)
+    request_seconds = models.FloatField(default=0)
+    throttle_seconds = models.FloatField(default=0)
+    prices_written = models.PositiveIntegerField(default=0)
+    positions_updated = models.PositiveIntegerField(default=0)
+    orders_filled = models.PositiveIntegerField(default=0)
+    fetch_seconds = models.FloatField(default=0)
+    write_seconds = models.FloatField(default=0)
+    positions_seconds = models.FloatField(default=0)
+    orders_seconds = models.FloatField(default=0)
+    valuation_seconds = models.FloatField(default=0)
+    total_seconds = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.started_at:%Y-%m-%d %H:%M} {self.fetched}/{self.symbols} in {self.total_seconds:.1f}s"
+
+class PriceBar(models.Model):
+    # OHLC bar rolled up from older PriceHistory samples by rollups.compact_prices;
+    # `bucket` is the bar's start (UTC)
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
+    bucket = models.DateTimeField()
+    open = models.DecimalField(max_digits=12, decimal_places=2)
+    high = models.DecimalField(max_digits=12, decimal_places=2)
+    low = models.DecimalField(max_digits=12, decimal_places=2)
+    close = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        abstract = True
+        unique_together = ("stock", "bucket")
+
+    def __str__(self):
+        return f"{self.stock.symbol} {self.bucket:%Y-%m-%d %H:%M} O {self.open} H {self.high} L {self.low} C {self.close}"
+
+
+class PriceChunk(models.Model):
+    # A stock's raw samples for one period, packed by series.seal_chunks
+    # (PRICE_STORAGE=chunks): delta-encoded int64 epoch seconds and cents
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
+    start = models.DateTimeField()
+    samples = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        unique_together = ("stock", "start")
+
+    def __str__(self):
+        return f"{self.stock.symbol} from {self.start:%Y-%m-%d} ({self.samples} samples)"
+
+
+class PriceHourly(PriceBar):
+    pass
+
+
+class PriceDaily(PriceBar):
+    pass
+
 
 class Transaction(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -77,4 +192,40 @@ class Position(models.Model):
     
     def __str__(self):
         return f"{self.user.get_full_name()} {self.quantity} {self.stock.symbol}"
-        
+
+class Order(models.Model):
+    # Resting order, executed by the trigger engine (brokersystem/orders.py)
+    # after a fetch cycle moves the price across its trigger
+    SIDES = [('buy', 'Buy'), ('sell', 'Sell')]
+    TYPES = [('limit', 'Limit'), ('stop', 'Stop'), ('stop_limit', 'Stop limit')]
+    STATUSES = [
+        ('open', 'Open'),
+        ('triggered', 'Triggered'),  # stop-limit whose stop was hit, now resting as a limit
+        ('filled', 'Filled'),
+        ('cancelled', 'Cancelled'),
+        ('rejected', 'Rejected'),  # crossed, but balance or holdings were insufficient
+    ]
+    OPEN_STATUSES = ('open', 'triggered')
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
+    side = models.CharField(choices=SIDES, max_length=4)
+    order_type = models.CharField(choices=TYPES, max_length=10)
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    limit_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, validators=[MinValueValidator(Decimal('0.01'))])
+    stop_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, validators=[MinValueValidator(Decimal('0.01'))])
+    status = models.CharField(choices=STATUSES, max_length=10, default='open')
+    # The trigger engine picks up new orders by created_at
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    filled_at = models.DateTimeField(null=True, blank=True)
+    fill_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    # Lets the trigger engine drop cancelled orders from its books
+    cancelled_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "status"]),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.side} {self.quantity} {self.stock.symbol} ({self.get_order_type_display()}, {self.status})"
@@ -0,0 +1,258 @@
+import bisect
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from brokersystem.dbutils import bulk_update_values, chunks
+from brokersystem.fragments import bump_portfolio
+from brokersystem.models import CustomUser, Order, Position
+from brokersystem.trading import PositionBook, money
+
+# Which way the price has to move to reach an order's trigger
+BELOW, ABOVE = "below", "above"
+# New orders and cancellations are looked up from this long before the
+# previous sync, so one committed late or stamped by a host with a slower
+# clock isn't missed
+SYNC_SLACK = timedelta(minutes=5)
+
+
+def trigger_leg(side: str, order_type: str, status: str, limit_price, stop_price) -> Tuple[str, Decimal]:
+    """
+    (direction, trigger price) of the leg an open order is waiting on.
+    Buy limits and sell stops fire when the price falls to the trigger; sell
+    limits and buy stops when it rises to it. A stop-limit waits on its stop,
+    then (status "triggered") rests as a limit.
+    """
+    if order_type == "limit" or status == "triggered":
+        return (BELOW if side == "buy" else ABOVE), limit_price
+    return (ABOVE if side == "buy" else BELOW), stop_price
+
+
+class TriggerBook:
+    """
+    Resting orders of one stock as (trigger, order id) lists sorted by
+    trigger. The orders crossed by a new price are one slice at either end,
+    found with a single bisect.
+    """
+    def __init__(self):
+        self.below: List[Tuple[Decimal, int]] = []  # fire when price <= trigger
+        self.above: List[Tuple[Decimal, int]] = []  # fire when price >= trigger
+
+    def add(self, direction: str, trigger: Decimal, order_id: int):
+        bisect.insort(self.below if direction == BELOW else self.above, (trigger, order_id))
+
+    def extend(self, direction: str, entries: List[Tuple[Decimal, int]]):
+        side = self.below if direction == BELOW else self.above
+        side.extend(entries)
+        side.sort()
+
+    def remove(self, direction: str, trigger: Decimal, order_id: int):
+        side = self.below if direction == BELOW else self.above
+        i = bisect.bisect_left(side, (trigger, order_id))
+        if i < len(side) and side[i] == (trigger, order_id):
+            del side[i]
+
+    def pop_crossed(self, price: Decimal) -> List[int]:
+        i = bisect.bisect_left(self.below, (price, 0))
+        j = bisect.bisect_right(self.above, (price, float("inf")))
+        crossed = [order_id for _, order_id in self.below[i:]] + [order_id for _, order_id in self.above[:j]]
+        del self.below[i:]
+        del self.above[:j]
+        return crossed
+
+    def __len__(self):
+        return len(self.below) + len(self.above)
+
+
+class TriggerEngine:
+    """
+    In-memory trigger books for every stock with open orders. New orders are
+    picked up by created_at and cancelled ones by cancelled_at, both from a
+    little before the last sync, so a cycle never scans the resting book. The books are rebuilt from scratch whenever this process takes the
+    price worker lease, since another process may have filled, triggered or
+    cancelled orders while it held it.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.books: Dict[int, TriggerBook] = defaultdict(TriggerBook)
+        self.stop_limits: Dict[int, Tuple[str, Decimal]] = {}  # id -> (side, limit) while waiting on the stop
+        self.legs: Dict[int, Tuple[int, str, Decimal]] = {}  # id -> (stock, direction, trigger) of its book entry
+        self.synced_at = None
+
+    def rebuild(self):
+        """
+        Drop the books and load every open order again.
+        """
+        with self._lock:
+            self.reset()
+            self.sync()
+
+    def sync(self):
+        """
+        Index orders placed since the last sync and drop those cancelled.
+        Orders already in the books are skipped.
+        """
+        started = timezone.now()
+        rows = Order.objects.filter(status__in=Order.OPEN_STATUSES)
+        if self.synced_at is not None:
+            since = self.synced_at - SYNC_SLACK
+            self.discard(Order.objects.filter(cancelled_at__gte=since).values_list("id", flat=True))
+            rows = rows.filter(created_at__gte=since)
+        self.synced_at = started
+
+        rows = rows.order_by("id").values_list(
+            "id", "stock_id", "side", "order_type", "status", "limit_price", "stop_price"
+        )
+        pending = defaultdict(lambda: {BELOW: [], ABOVE: []})
+        for order_id, stock_id, side, order_type, status, limit_price, stop_price in rows.iterator(chunk_size=5000):
+            if order_id in self.legs:
+                continue
+            direction, trigger = trigger_leg(side, order_type, status, limit_price, stop_price)
+            pending[stock_id][direction].append((trigger, order_id))
+            self.legs[order_id] = (stock_id, direction, trigger)
+            if order_type == "stop_limit" and status == "open":
+                self.stop_limits[order_id] = (side, limit_price)
+        for stock_id, legs in pending.items():
+            book = self.books[stock_id]
+            for direction, entries in legs.items():
+                if entries:
+                    book.extend(direction, entries)
+
+    def discard(self, order_ids: Iterable[int]):
+        """
+        Take orders out of the books; ids not in them are ignored.
+        """
+        for order_id in order_ids:
+            leg = self.legs.pop(order_id, None)
+            if leg is None:
+                continue
+            stock_id, direction, trigger = leg
+            self.books[stock_id].remove(direction, trigger, order_id)
+            self.stop_limits.pop(order_id, None)
+
+    def crossed(self, prices_by_stock_id: Dict[int, Decimal]):
+        """
+        Pop the orders crossed by this cycle's prices.
+        Returns ({order id: fill price}, [ids of stop-limits whose stop was hit]).
+        """
+        fills: Dict[int, Decimal] = {}
+        triggered: List[int] = []
+        for stock_id, price in prices_by_stock_id.items():
+            book = self.books.get(stock_id)
+            if not book:
+                continue
+            hit = book.pop_crossed(price)
+            while hit:
+                promoted = False
+                for order_id in hit:
+                    leg = self.stop_limits.pop(order_id, None)
+                    if leg is None:
+                        self.legs.pop(order_id, None)
+                        fills[order_id] = price
+                        continue
+                    side, limit_price = leg
+                    direction, trigger = trigger_leg(side, "stop_limit", "triggered", limit_price, None)
+                    book.add(direction, trigger, order_id)
+                    self.legs[order_id] = (stock_id, direction, trigger)
+                    triggered.append(order_id)
+                    promoted = True
+                # A stop-limit whose limit is already marketable fills this cycle
+                hit = book.pop_crossed(price) if promoted else []
+        return fills, triggered
+
+    def run(self, prices_by_stock_id: Dict[int, Decimal]) -> int:
+        """
+        Sync, find crossed orders and execute them. Returns the number filled.
+        """
+        with self._lock:
+            self.sync()
+            fills, triggered = self.crossed(prices_by_stock_id)
+            if not fills and not triggered:
+                return 0
+            return execute_orders(fills, triggered)
+
+
+def execute_orders(fills: Dict[int, Decimal], triggered: List[int] = ()) -> int:
+    """
+    Fill crossed orders at their cycle price in one transaction, oldest
+    first: balances, positions and orders are read once, updated in memory
+    and written back with bulk statements. Orders the user can no longer
+    afford (or no longer holds enough to sell) are rejected.
+    """
+    with transaction.atomic():
+        for ids in chunks(triggered):
+            Order.objects.filter(id__in=ids, status="open").update(status="triggered")
+
+        orders = []
+        for ids in chunks(fills):
+            orders.extend(
+                Order.objects.select_for_update()
+                .filter(id__in=ids, status__in=Order.OPEN_STATUSES)
+                .only("id", "user_id", "stock_id", "side", "quantity", "status")
+            )
+        if not orders:
+            return 0
+        orders.sort(key=lambda o: o.id)
+
+        user_ids = {o.user_id for o in orders}
+        stock_ids = {o.stock_id for o in orders}
+        # Same lock order as trade_view and baskets: positions, then users
+        book = PositionBook(
+            pos
+            for ids in chunks(sorted(user_ids))
+            for pos in Position.objects.select_for_update()
+            .filter(user_id__in=ids, stock_id__in=stock_ids)
+            .order_by("user_id", "stock_id")
+        )
+        users = {}
+        for ids in chunks(sorted(user_ids)):
+            users.update(
+                (user.id, user)
+                for user in CustomUser.objects.select_for_update().filter(id__in=ids).order_by("id").only("id", "balance")
+            )
+
+        filled = 0
+        for order in orders:
+            price = money(fills[order.id])
+            notional = money(price * order.quantity)
+            user = users[order.user_id]
+            if order.side == "buy":
+                if user.balance < notional:
+                    order.status = "rejected"
+                    continue
+                user.balance -= notional
+                book.buy(order.user_id, order.stock_id, order.quantity, price)
+            else:
+                if book.held(order.user_id, order.stock_id) < order.quantity:
+                    order.status = "rejected"
+                    continue
+                user.balance += notional
+                book.sell(order.user_id, order.stock_id, order.quantity, price)
+            order.status, order.filled_at, order.fill_price = "filled", book.now, price
+            filled += 1
+
+        book.save()
+        bulk_update_values(users.values(), ["balance"])
+        bulk_update_values(orders, ["status", "filled_at", "fill_price"])
+
+    for user_id in user_ids:
+        bump_portfolio(user_id)
+    return filled
+
+
+engine = TriggerEngine()
+
+
+def process_orders(prices_by_stock_id: Dict[int, Decimal]) -> int:
+    """
+    Run the process-wide trigger engine against one cycle's prices.
+    """
+    return engine.run(prices_by_stock_id)
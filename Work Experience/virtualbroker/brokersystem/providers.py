@@ -0,0 +1,292 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Optional, List, Dict, Iterable
+
+import requests
+
+
+FINNHUB_TOKEN = os.getenv("FINNHUB_API_KEY")
+FINNHUB_BASE = os.getenv("FINNHUB_BASE_URL", "https://finnhub.io/api/v1")
+# Finnhub free tier allows 60 calls/minute. The bucket may burst FINNHUB_BURST
+# calls at once and by default refills at the rest of the quota, so a full
+# bucket plus a minute of refill uses the whole quota and never exceeds it.
+# Set FINNHUB_CALLS_PER_MINUTE lower to leave headroom for other clients.
+QUOTA_PER_MINUTE = int(os.getenv("FINNHUB_QUOTA_PER_MINUTE", "60"))
+BURST = int(os.getenv("FINNHUB_BURST", "5"))
+CALLS_PER_MINUTE = int(os.getenv("FINNHUB_CALLS_PER_MINUTE") or QUOTA_PER_MINUTE - BURST)
+# Requests kept in flight at once (latency is hidden behind the limiter)
+MAX_WORKERS = int(os.getenv("FINNHUB_MAX_WORKERS", "4"))
+# Which provider fetch_prices_job uses: "finnhub" or "yfinance"
+QUOTE_PROVIDER = os.getenv("QUOTE_PROVIDER", "finnhub")
+
+
+class TokenBucket:
+    """
+    Token-bucket limiter shared by all fetch threads.
+    Refills at calls_per_minute and holds up to `burst` tokens. With a
+    `quota`, the burst is capped at quota - calls_per_minute (and the rate
+    below the quota), so a full bucket plus one minute of refill never
+    exceeds it.
+    """
+    def __init__(self, calls_per_minute: int, burst: int = 1, quota: int = None):
+        calls_per_minute, burst = int(calls_per_minute), int(burst)
+        if quota is not None:
+            calls_per_minute = min(calls_per_minute, int(quota) - 1)
+            burst = min(burst, int(quota) - calls_per_minute)
+        self.capacity = float(max(1, burst))
+        self.rate = calls_per_minute / 60.0  # tokens per second
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                delay = (1.0 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+def _to_price(value) -> Optional[Decimal]:
+    if value is None:
+        return None
+    value = float(value)
+    if value != value or value <= 0:  # NaN or non-positive
+        return None
+    return Decimal(str(value))
+
+
+class QuoteProvider:
+    """
+    Source of latest prices. Single-symbol providers implement fetch_quote();
+    batch providers set batch_size and implement fetch_batch().
+    fetch_many() picks the batch path whenever the provider supports it.
+    """
+    name = "base"
+    batch_size: Optional[int] = None  # max symbols per batch request
+    # A metrics.RequestStats, set by the fetch job for the length of a cycle
+    stats = None
+
+    @property
+    def supports_batch(self) -> bool:
+        return bool(self.batch_size)
+
+    def fetch_quote(self, symbol: str) -> Optional[Decimal]:
+        raise NotImplementedError
+
+    def fetch_batch(self, symbols: List[str]) -> Dict[str, Decimal]:
+        raise NotImplementedError
+
+    def fetch_many(self, symbols: Iterable[str]) -> Dict[str, Decimal]:
+        """
+        Fetch all symbols and return {symbol: price} for those that succeeded.
+        """
+        symbols = list(symbols)
+        prices = {}
+        if self.supports_batch:
+            for i in range(0, len(symbols), self.batch_size):
+                prices.update(self.fetch_batch(symbols[i:i + self.batch_size]))
+            return prices
+        for sym in symbols:
+            price = self.fetch_quote(sym)
+            if price is not None:
+                prices[sym] = price
+        return prices
+
+    def estimate_seconds(self, n_symbols: int) -> float:
+        return 0.0
+
+    def budget(self, seconds: float) -> Optional[int]:
+        """
+        How many symbols can be fetched in `seconds` without breaking the
+        rate limit (None = no practical limit).
+        """
+        return None
+
+    def describe(self) -> str:
+        return self.name
+
+    def _record(self, started: float, ok: bool):
+        """
+        Report one request, begun at perf_counter() `started`, to the cycle's stats.
+        """
+        if self.stats is not None:
+            self.stats.request(time.perf_counter() - started, ok)
+
+
+class FinnhubProvider(QuoteProvider):
+    """
+    Finnhub /quote, one symbol per request, with up to `max_workers`
+    requests in flight behind a shared TokenBucket.
+    """
+    name = "finnhub"
+
+    def __init__(self, calls_per_minute: int = None, burst: int = None, max_workers: int = None,
+                 quota_per_minute: int = None):
+        self.limiter = TokenBucket(
+            calls_per_minute or CALLS_PER_MINUTE, burst or BURST, quota=quota_per_minute or QUOTA_PER_MINUTE
+        )
+        self.max_workers = max(1, max_workers or MAX_WORKERS)
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        """
+        One requests.Session per worker thread (keeps connections alive without
+        sharing a Session between threads).
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def fetch_quote(self, symbol: str) -> Optional[Decimal]:
+        """
+        Call Finnhub /quote for a single symbol. Returns Decimal price or None on failure.
+        """
+        if not FINNHUB_TOKEN:
+            raise RuntimeError("FINNHUB_API_KEY environment variable is not set")
+
+        waited = time.perf_counter()
+        self.limiter.wait()
+        started = time.perf_counter()
+        if self.stats is not None:
+            self.stats.throttle(started - waited)
+        try:
+            resp = self._session().get(
+                f"{FINNHUB_BASE}/quote",
+                params={"symbol": symbol, "token": FINNHUB_TOKEN},
+                timeout=10,
+            )
+            resp.raise_for_status()
+            data = resp.json()
+            # Finnhub /quote fields: c=current, h=high, l=low, o=open, pc=prev close, t=timestamp
+            price = _to_price(data.get("c"))
+        except Exception as e:
+            self._record(started, False)
+            print(f"[Finnhub] {symbol} failed: {e}")
+            return None
+        self._record(started, price is not None)
+        return price
+
+    def fetch_many(self, symbols: Iterable[str]) -> Dict[str, Decimal]:
+        symbols = list(symbols)
+        prices = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="finnhub") as pool:
+            for sym, price in zip(symbols, pool.map(self.fetch_quote, symbols)):
+                if price is not None:
+                    prices[sym] = price
+        return prices
+
+    def estimate_seconds(self, n_symbols: int) -> float:
+        return max(0, n_symbols - self.limiter.capacity) / self.limiter.rate
+
+    def budget(self, seconds: float) -> Optional[int]:
+        return int(self.limiter.capacity + self.limiter.rate * seconds)
+
+    def describe(self) -> str:
+        return f"Finnhub, {self.max_workers} workers"
+
+
+class YFinanceProvider(QuoteProvider):
+    """
+    Yahoo Finance via yfinance: one download() call covers a whole batch of tickers.
+    """
+    name = "yfinance"
+    batch_size = int(os.getenv("YFINANCE_BATCH_SIZE", "200"))
+
+    def fetch_batch(self, symbols: List[str]) -> Dict[str, Decimal]:
+        import yfinance as yf
+
+        started = time.perf_counter()
+        try:
+            frame = yf.download(
+                symbols,
+                period="1d",
+                interval="1m",
+                group_by="ticker",
+                auto_adjust=False,
+                progress=False,
+                threads=False,
+            )
+        except Exception as e:
+            self._record(started, False)
+            print(f"[yfinance] batch of {len(symbols)} failed: {e}")
+            return {}
+        self._record(started, True)
+
+        prices = {}
+        for sym in symbols:
+            try:
+                closes = frame[sym]["Close"] if frame.columns.nlevels > 1 else frame["Close"]
+                closes = closes.dropna()
+            except KeyError:
+                continue
+            if len(closes):
+                price = _to_price(closes.iloc[-1])
+                if price is not None:
+                    prices[sym] = price
+        return prices
+
+    def fetch_quote(self, symbol: str) -> Optional[Decimal]:
+        return self.fetch_batch([symbol]).get(symbol)
+
+    def describe(self) -> str:
+        return f"yfinance, batches of {self.batch_size}"
+
+
+class FakeQuoteProvider(QuoteProvider):
+    """
+    In-process provider for tests and offline runs. `prices` maps symbol ->
+    price (or is a callable symbol -> price); `requests` counts simulated calls.
+    """
+    name = "fake"
+
+    def __init__(self, prices=None, batch_size: Optional[int] = 500):
+        self.prices = prices if prices is not None else {}
+        self.batch_size = batch_size
+        self.requests = 0
+
+    def _price(self, symbol):
+        value = self.prices(symbol) if callable(self.prices) else self.prices.get(symbol)
+        return _to_price(value)
+
+    def fetch_quote(self, symbol: str) -> Optional[Decimal]:
+        started = time.perf_counter()
+        self.requests += 1
+        price = self._price(symbol)
+        self._record(started, price is not None)
+        return price
+
+    def fetch_batch(self, symbols: List[str]) -> Dict[str, Decimal]:
+        started = time.perf_counter()
+        self.requests += 1
+        prices = {}
+        for sym in symbols:
+            price = self._price(sym)
+            if price is not None:
+                prices[sym] = price
+        self._record(started, True)
+        return prices
+
+
+PROVIDERS = {
+    FinnhubProvider.name: FinnhubProvider,
+    YFinanceProvider.name: YFinanceProvider,
+    FakeQuoteProvider.name: FakeQuoteProvider,
+}
+
+
+def get_provider(name: str = None) -> QuoteProvider:
+    name = (name or QUOTE_PROVIDER).lower()
+    try:
+        return PROVIDERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown QUOTE_PROVIDER {name!r} (choose from {', '.join(PROVIDERS)})")
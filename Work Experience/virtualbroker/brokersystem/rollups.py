@@ -0,0 +1,210 @@
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from typing import Dict, List, Tuple
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from brokersystem import series
+from brokersystem.dbutils import chunks
+from brokersystem.models import BalanceHistory, CustomUser, PriceChunk, PriceDaily, PriceHistory, PriceHourly, Stock
+
+# Raw samples are kept this long, hourly bars this long, daily bars forever.
+# Older data is rolled into the next tier by compact_prices().
+RAW_RETENTION_DAYS = int(os.getenv("PRICE_RAW_RETENTION_DAYS", "7"))
+HOURLY_RETENTION_DAYS = int(os.getenv("PRICE_HOURLY_RETENTION_DAYS", "90"))
+HOUR, DAY = 3600, 86400
+# Stocks (or users) compacted per transaction
+COMPACT_STOCK_CHUNK = 200
+# BalanceHistory thins out on the same schedule: past RAW_RETENTION_DAYS only
+# each user's last snapshot per hour is kept, past HOURLY_RETENTION_DAYS the
+# last per day. Each run looks this far behind the cutoffs, which covers the
+# days since the last run unless compaction stopped for longer.
+BALANCE_LOOKBACK_DAYS = int(os.getenv("BALANCE_COMPACT_LOOKBACK_DAYS", "3"))
+
+
+def tiers() -> List[Tuple[int, type, timedelta]]:
+    """
+    Rollup tables, coarsest first: (bar seconds, model, age beyond which a
+    window may need it). Data younger than that is still in the finer tier.
+    """
+    return [
+        (DAY, PriceDaily, timedelta(days=HOURLY_RETENTION_DAYS)),
+        (HOUR, PriceHourly, timedelta(days=RAW_RETENTION_DAYS)),
+    ]
+
+
+def rebucket(t: np.ndarray, o: np.ndarray, h: np.ndarray, l: np.ndarray, c: np.ndarray, bucket_seconds: int):
+    """
+    Merge sorted OHLC bars (or samples, with o = h = l = c) into coarser
+    fixed time buckets. Returns (bucket start, open, high, low, close) arrays.
+    """
+    if not len(t):
+        return t, o, h, l, c
+    keys = np.floor_divide(t, bucket_seconds).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(t)]
+    return (
+        (keys[starts] * bucket_seconds).astype(np.float64),
+        o[starts],
+        np.maximum.reduceat(h, starts),
+        np.minimum.reduceat(l, starts),
+        c[ends - 1],
+    )
+
+
+def _floor(moment: datetime, seconds: int) -> datetime:
+    epoch = int(moment.timestamp()) // seconds * seconds
+    return datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+
+
+def _price(value: float) -> Decimal:
+    return Decimal(f"{value:.2f}")
+
+
+def _split(rows) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Rows of (stock id, time, open, high, low, close) as a stock id array and
+    (time, open, high, low, close) arrays.
+    """
+    stock_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    return stock_ids, [
+        np.fromiter((row[i].timestamp() if i == 1 else float(row[i]) for row in rows), dtype=np.float64, count=len(rows))
+        for i in range(1, 6)
+    ]
+
+
+def _roll(stock_ids: np.ndarray, columns: List[np.ndarray], target, bucket_seconds: int) -> int:
+    """
+    Write OHLC bars for samples or bars given as a stock id array and
+    (time, open, high, low, close) arrays, sorted by stock and time, into
+    `target`, merging into bars that already exist there (samples arriving
+    after their bucket was first compacted). Returns the number of bars written.
+    """
+    if not len(stock_ids):
+        return 0
+    bars: Dict[Tuple[int, datetime], list] = {}
+    bounds = np.r_[np.flatnonzero(np.r_[True, stock_ids[1:] != stock_ids[:-1]]), len(stock_ids)]
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        stock_id = int(stock_ids[lo])
+        for bucket, o, h, l, c in zip(*rebucket(*(col[lo:hi] for col in columns), bucket_seconds)):
+            when = datetime.fromtimestamp(bucket, tz=dt_timezone.utc)
+            bars[stock_id, when] = [_price(o), _price(h), _price(l), _price(c)]
+
+    existing = target.objects.filter(
+        stock_id__in={stock_id for stock_id, _ in bars},
+        bucket__gte=min(when for _, when in bars),
+        bucket__lte=max(when for _, when in bars),
+    ).values_list("stock_id", "bucket", "open", "high", "low")
+    for stock_id, when, o, h, l in existing:
+        bar = bars.get((stock_id, when))
+        if bar:
+            # The stored bar holds the bucket's earlier samples
+            bar[0], bar[1], bar[2] = o, max(h, bar[1]), min(l, bar[2])
+
+    target.objects.bulk_create(
+        [
+            target(stock_id=stock_id, bucket=when, open=o, high=h, low=l, close=c)
+            for (stock_id, when), (o, h, l, c) in bars.items()
+        ],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=["stock", "bucket"],
+        update_fields=["open", "high", "low", "close"],
+    )
+    return len(bars)
+
+
+def compact_prices(now: datetime = None) -> Dict[str, int]:
+    """
+    Roll raw PriceHistory samples older than RAW_RETENTION_DAYS into hourly
+    bars, and hourly bars older than HOURLY_RETENTION_DAYS into daily bars,
+    deleting what was rolled up. Cutoffs fall on bar boundaries, so no
+    bucket is ever split between tiers. In "chunks" storage mode, completed
+    periods are first packed into PriceChunk blobs, which roll up whole.
+    Runs one transaction per chunk of stocks; safe to re-run.
+    """
+    now = now or timezone.now()
+    raw_cutoff = _floor(now - timedelta(days=RAW_RETENTION_DAYS), HOUR)
+    hourly_cutoff = _floor(now - timedelta(days=HOURLY_RETENTION_DAYS), DAY)
+    counts = {"sealed": 0, "raw_rolled": 0, "hourly_written": 0, "hourly_rolled": 0, "daily_written": 0}
+
+    for ids in chunks(Stock.objects.order_by("id").values_list("id", flat=True), COMPACT_STOCK_CHUNK):
+        with transaction.atomic():
+            if series.chunked():
+                counts["sealed"] += series.seal_chunks(ids, now)
+                # Packed periods roll up whole, once all of it is past the cutoff
+                sealed = PriceChunk.objects.filter(
+                    stock_id__in=ids, start__lte=raw_cutoff - timedelta(seconds=series.CHUNK_SECONDS)
+                )
+                packed = list(sealed.order_by("stock_id", "start").values_list("stock_id", "samples", "data"))
+                if packed:
+                    decoded = [series.decode(bytes(data), samples) for _, samples, data in packed]
+                    stock_ids = np.repeat([stock_id for stock_id, _, _ in packed], [samples for _, samples, _ in packed])
+                    t = np.concatenate([t for t, _ in decoded]).astype(np.float64)
+                    price = np.concatenate([cents for _, cents in decoded]) / 100.0
+                    counts["hourly_written"] += _roll(stock_ids, [t, price, price, price, price], PriceHourly, HOUR)
+                    counts["raw_rolled"] += len(t)
+                    sealed.delete()
+
+            raw = PriceHistory.objects.filter(stock_id__in=ids, timestamp__lt=raw_cutoff)
+            rows = [
+                (stock_id, ts, price, price, price, price)
+                for stock_id, ts, price in raw.order_by("stock_id", "timestamp").values_list("stock_id", "timestamp", "price")
+            ]
+            if rows:
+                counts["hourly_written"] += _roll(*_split(rows), PriceHourly, HOUR)
+                counts["raw_rolled"] += raw.delete()[0]
+
+            hourly = PriceHourly.objects.filter(stock_id__in=ids, bucket__lt=hourly_cutoff)
+            rows = list(
+                hourly.order_by("stock_id", "bucket").values_list("stock_id", "bucket", "open", "high", "low", "close")
+            )
+            if rows:
+                counts["daily_written"] += _roll(*_split(rows), PriceDaily, DAY)
+                counts["hourly_rolled"] += hourly.delete()[0]
+    return counts
+
+
+def _thin_balances(user_ids: List[int], start: datetime, end: datetime, bucket_seconds: int) -> int:
+    """
+    Delete every BalanceHistory row in [start, end) but each user's last one
+    per bucket. Returns the number of rows deleted.
+    """
+    rows = list(
+        BalanceHistory.objects.filter(user_id__in=user_ids, timestamp__gte=start, timestamp__lt=end)
+        .order_by("user_id", "timestamp", "id")
+        .values_list("id", "user_id", "timestamp")
+    )
+    if not rows:
+        return 0
+    row_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    users = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    buckets = np.fromiter((int(row[2].timestamp()) // bucket_seconds for row in rows), dtype=np.int64, count=len(rows))
+    last = np.r_[(users[1:] != users[:-1]) | (buckets[1:] != buckets[:-1]), True]
+    deleted = 0
+    for ids in chunks(row_ids[~last].tolist()):
+        deleted += BalanceHistory.objects.filter(id__in=ids).delete()[0]
+    return deleted
+
+
+def compact_balances(now: datetime = None) -> int:
+    """
+    Thin BalanceHistory like compact_prices() rolls up prices: to one
+    snapshot per user and hour past RAW_RETENTION_DAYS and one per user and
+    day past HOURLY_RETENTION_DAYS, keeping the last of each. Runs one
+    transaction per chunk of users; safe to re-run. Returns the number of
+    snapshots deleted.
+    """
+    now = now or timezone.now()
+    raw_cutoff = _floor(now - timedelta(days=RAW_RETENTION_DAYS), HOUR)
+    hourly_cutoff = _floor(now - timedelta(days=HOURLY_RETENTION_DAYS), DAY)
+    lookback = timedelta(days=BALANCE_LOOKBACK_DAYS)
+    deleted = 0
+    for ids in chunks(CustomUser.objects.order_by("id").values_list("id", flat=True), COMPACT_STOCK_CHUNK):
+        with transaction.atomic():
+            deleted += _thin_balances(ids, max(raw_cutoff - lookback, hourly_cutoff), raw_cutoff, HOUR)
+            deleted += _thin_balances(ids, hourly_cutoff - lookback, hourly_cutoff, DAY)
+    return deleted
@@ -1,143 +1,403 @@
+import atexit
+import bisect
+import functools
+import math
 import os
+import threading
 import time
+from datetime import timedelta
 from decimal import Decimal
-from typing import Optional, List
+from typing import List, Dict
 
-import requests
 from apscheduler.schedulers.background import BackgroundScheduler
-from django.db import transaction
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.db.models import Case, DecimalField, Max, Value, When
 from django.utils import timezone
 
-from brokersystem.models import Stock, PriceHistory, Position
-import os
-
+from brokersystem.models import BalanceHistory, Stock, PriceHistory, Position, LatestQuote
+from brokersystem.dbutils import MAX_PARAMS, chunks, supports_update_from as _supports_update_from
+from brokersystem.providers import QuoteProvider, get_provider
+from brokersystem.demand import rank_symbols
+from brokersystem.fragments import bump_price_cycle
+from brokersystem.leaderboard import net_worths, refresh_scores
+from brokersystem.lease import LEASE_SECONDS, acquire_lease, holder_id, release_lease
+from brokersystem.live import publish_quotes
+from brokersystem.metrics import track_cycle
+from brokersystem.orders import engine as trigger_engine, process_orders
+from brokersystem.rollups import compact_balances, compact_prices
+from brokersystem.trading import money
 
-FINNHUB_TOKEN = os.getenv("FINNHUB_API_KEY")
-FINNHUB_BASE = "https://finnhub.io/api/v1"
-# 50 calls/minute budget -> ~1.25 seconds between calls
-REQUEST_SPACING_SEC = 1.25
+# "flat": refresh every symbol every FETCH_INTERVAL_MINUTES.
+# "tiered": every HOT_INTERVAL_MINUTES refresh the symbols people hold, trade
+# or view, plus a rotating slice of the rest sized so the cold tail is covered
+# every COLD_INTERVAL_MINUTES.
+SCHEDULE_MODE = os.getenv("PRICE_SCHEDULE_MODE", "flat")
+FETCH_INTERVAL_MINUTES = int(os.getenv("FETCH_INTERVAL_MINUTES", "25"))
+HOT_INTERVAL_MINUTES = int(os.getenv("HOT_INTERVAL_MINUTES", "5"))
+COLD_INTERVAL_MINUTES = int(os.getenv("COLD_INTERVAL_MINUTES", "30"))
+# Cap on the hot tier so it can never starve the cold tail
+HOT_TIER_MAX = int(os.getenv("HOT_TIER_MAX", "150"))
+# Local hour (scheduler timezone) of the daily PriceHistory compaction
+COMPACTION_HOUR = int(os.getenv("PRICE_COMPACTION_HOUR", "3"))
+# Stocks per UPDATE statement, at 2 bind params each
+POSITION_UPDATE_CHUNK = MAX_PARAMS // 2
+# Write a BalanceHistory row per user after the first price cycle in every
+# BALANCE_SNAPSHOT_MINUTES, not after each one (at 100k users and 5-minute
+# cycles that was 28.8M rows a day); compact_balances() thins older ones
+SNAPSHOT_BALANCES = os.getenv("SNAPSHOT_BALANCES", "1") == "1"
+BALANCE_SNAPSHOT_MINUTES = int(os.getenv("BALANCE_SNAPSHOT_MINUTES", "60"))
+SNAPSHOT_BATCH = 1000
 
 
-class RateLimiter:
+def update_position_prices(prices_by_stock_id: Dict[int, Decimal]) -> int:
     """
-    Simple pacing limiter: ensures at least REQUEST_SPACING_SEC passes
-    between successive API calls (process-wide).
+    Set Position.current_price for every position in the given stocks with one
+    set-based UPDATE per chunk of stocks:
+        UPDATE position SET current_price = v.column2
+        FROM (VALUES (stock_id, price), ...) v WHERE position.stock_id = v.column1
+    The join uses the stock_id index, so each row is matched once. Backends
+    without UPDATE ... FROM fall back to a CASE stock_id WHEN ... END update.
+    Returns the number of positions updated.
     """
-    def __init__(self, min_interval_sec: float):
-        self.min_interval = float(min_interval_sec)
-        self._last = 0.0
+    items = list(prices_by_stock_id.items())
+    table = connection.ops.quote_name(Position._meta.db_table)
+    updated = 0
+    with transaction.atomic():
+        for i in range(0, len(items), POSITION_UPDATE_CHUNK):
+            chunk = items[i:i + POSITION_UPDATE_CHUNK]
+            if not _supports_update_from():
+                updated += Position.objects.filter(stock_id__in=[stock_id for stock_id, _ in chunk]).update(
+                    current_price=Case(
+                        *[When(stock_id=stock_id, then=Value(price)) for stock_id, price in chunk],
+                        output_field=DecimalField(max_digits=12, decimal_places=2),
+                    )
+                )
+                continue
+            values = ", ".join(["(%s, %s)"] * len(chunk))
+            params = [p for stock_id, price in chunk for p in (stock_id, price)]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {table} SET current_price = v.column2 "
+                    f"FROM (VALUES {values}) AS v WHERE {table}.stock_id = v.column1",
+                    params,
+                )
+                updated += cursor.rowcount
+    return updated
 
-    def wait(self):
-        now = time.monotonic()
-        delta = now - self._last
-        if delta < self.min_interval:
-            time.sleep(self.min_interval - delta)
-        self._last = time.monotonic()
+
+def snapshot_balances(now=None, worths=None) -> int:
+    """
+    Record every user's cash and net worth at `now`: `worths` from
+    leaderboard.net_worths() (one aggregate query if not given), written
+    with one bulk INSERT. Returns the number of snapshots written.
+    """
+    now = now or timezone.now()
+    worths = net_worths() if worths is None else worths
+    BalanceHistory.objects.bulk_create(
+        [BalanceHistory(user_id=user_id, balance=balance, net_worth=worth, timestamp=now) for user_id, balance, worth in worths],
+        batch_size=SNAPSHOT_BATCH,
+    )
+    return len(worths)
 
 
-def _fetch_quote(symbol: str, session: requests.Session, limiter: RateLimiter) -> Optional[Decimal]:
+def snapshot_due(now) -> bool:
     """
-    Call Finnhub /quote for a single symbol. Returns Decimal price or None on failure.
+    Whether BALANCE_SNAPSHOT_MINUTES have passed since the last snapshot.
     """
-    if not FINNHUB_TOKEN:
-        raise RuntimeError("FINNHUB_API_KEY environment variable is not set")
+    last = BalanceHistory.objects.order_by("-id").values_list("timestamp", flat=True).first()
+    return last is None or now - last >= timedelta(minutes=BALANCE_SNAPSHOT_MINUTES)
+
 
-    limiter.wait()
-    try:
-        resp = session.get(
-            f"{FINNHUB_BASE}/quote",
-            params={"symbol": symbol, "token": FINNHUB_TOKEN},
-            timeout=10,
+def _write_prices(records: List[PriceHistory]):
+    """
+    Append the cycle's PriceHistory rows and upsert the matching LatestQuote rows.
+    """
+    with transaction.atomic():
+        PriceHistory.objects.bulk_create(records, batch_size=500, ignore_conflicts=True)
+        LatestQuote.objects.bulk_create(
+            [LatestQuote(stock_id=r.stock_id, price=r.price, timestamp=r.timestamp) for r in records],
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=["stock"],
+            update_fields=["price", "timestamp"],
         )
-        resp.raise_for_status()
-        data = resp.json()
-        # Finnhub /quote fields: c=current, h=high, l=low, o=open, pc=prev close, t=timestamp
-        price = data.get("c")
-        if price is None or float(price) <= 0:
-            return None
-        return Decimal(str(float(price)))
-    except Exception as e:
-        print(f"[Finnhub] {symbol} failed: {e}")
-        return None
 
 
-def fetch_prices_job():
+def _latest_prices(stock_ids: List[int]) -> Dict[int, Decimal]:
+    prices = {}
+    for ids in chunks(stock_ids):
+        prices.update(LatestQuote.objects.filter(stock_id__in=ids).values_list("stock_id", "price"))
+    return prices
+
+
+def fetch_prices_job(provider: QuoteProvider = None, symbols: List[str] = None):
     """
-    Fetch latest prices from Finnhub and store in PriceHistory.
-    Respects 50 req/min by pacing each /quote call with ~1.25s spacing.
+    Fetch latest prices from the configured QuoteProvider and store in PriceHistory.
+    Batch providers cover many symbols per request; single-symbol providers
+    (Finnhub) run concurrently behind a rate limiter.
+    Refreshes every Stock unless `symbols` is given.
     """
-    symbols = list(Stock.objects.values_list("symbol", flat=True))
+    ids = dict(Stock.objects.values_list("symbol", "id"))
+    if symbols is None:
+        symbols = list(ids)
     if not symbols:
         print("No symbols to fetch.")
         return
 
-    session = requests.Session()
-    limiter = RateLimiter(REQUEST_SPACING_SEC)
+    provider = provider or get_provider()
     now = timezone.now()
 
-    est_seconds = len(symbols) * REQUEST_SPACING_SEC
-    print(f"[{now:%H:%M:%S}] Fetching {len(symbols)} symbols via Finnhub (~{int(est_seconds)}s)…")
-
-    ids = dict(Stock.objects.filter(symbol__in=symbols).values_list("symbol", "id"))
-    batch_records: List[PriceHistory] = []
-    successful_prices = {}  # Track successful prices for position updates
-
-    for sym in symbols:
-        price = _fetch_quote(sym, session, limiter)
-        if price is None:
-            continue
-        
-        successful_prices[sym] = price  # Track successful price
-        batch_records.append(
-            PriceHistory(
-                stock_id=ids.get(sym),
-                price=price,
-                timestamp=now,  # one logical "cycle time"
-            )
-        )
+    est_seconds = provider.estimate_seconds(len(symbols))
+    print(f"[{now:%H:%M:%S}] Fetching {len(symbols)} symbols via {provider.describe()} (~{int(est_seconds)}s)…")
 
-        if len(batch_records) >= 500:
+    with track_cycle(provider, len(symbols), cycle_interval_minutes() * 60) as tracker:
+        cycle = tracker.cycle
+        # Track successful prices for position updates
+        with tracker.stage("fetch"):
+            successful_prices = {sym: price for sym, price in provider.fetch_many(symbols).items() if sym in ids}
+        cycle.fetched = len(successful_prices)
+        # Quotes that moved this cycle, pushed to open dashboards once written
+        previous = _latest_prices([ids[sym] for sym in successful_prices])
+        changed = {sym: money(price) for sym, price in successful_prices.items() if previous.get(ids[sym]) != money(price)}
+        records = [
+            PriceHistory(stock_id=ids[sym], price=price, timestamp=now)  # one logical "cycle time"
+            for sym, price in successful_prices.items()
+        ]
+
+        if successful_prices:
+            # The cycle's prices, latest quotes and position prices go in one write
+            # transaction, with every read done beforehand: the write lock is held
+            # only for the writes, and readers see the whole cycle or none of it
+            started = time.perf_counter()
             with transaction.atomic():
-                PriceHistory.objects.bulk_create(batch_records, ignore_conflicts=True)
-            batch_records.clear()
+                with tracker.stage("write"):
+                    _write_prices(records)
+                with tracker.stage("positions"):
+                    updated = update_position_prices({ids[sym]: price for sym, price in successful_prices.items()})
+            cycle.prices_written, cycle.positions_updated = len(records), updated
+            print(f"Wrote {len(records)} prices and updated {updated} positions in {(time.perf_counter() - started) * 1000:.0f}ms.")
+
+            # Resting limit/stop orders crossed by the new prices
+            with tracker.stage("orders"):
+                filled = cycle.orders_filled = process_orders({ids[sym]: price for sym, price in successful_prices.items()})
+            if filled:
+                print(f"Filled {filled} resting orders in {cycle.orders_seconds * 1000:.0f}ms.")
 
-    if batch_records:
-        with transaction.atomic():
-            PriceHistory.objects.bulk_create(batch_records, ignore_conflicts=True)
+            # New prices: cached dashboard tiles are stale
+            bump_price_cycle()
+            # Net worth history and leaderboard, from one valuation of every user
+            with tracker.stage("valuation"):
+                worths = net_worths()
+                if SNAPSHOT_BALANCES and snapshot_due(now):
+                    snapshot_balances(now, worths)
+                rescored = refresh_scores(worths)
+            print(f"Valued {len(worths)} portfolios ({rescored} scores changed) in {cycle.valuation_seconds * 1000:.0f}ms.")
+        publish_quotes(changed, now)
+
+    elapsed = (timezone.now() - now).total_seconds()
+    print(
+        f"[{timezone.now():%H:%M:%S}] Price fetch cycle complete: {len(successful_prices)}/{len(symbols)} symbols in {elapsed:.1f}s "
+        f"({cycle.total_seconds / cycle.interval_seconds:.0%} of the interval, {cycle.failed_requests} failed requests)."
+    )
 
-    # Update current prices in positions (run regardless of batch_records)
-    if successful_prices:
-        with transaction.atomic():
-            for symbol, price in successful_prices.items():
-                if price is not None:
-                    Position.objects.filter(stock__symbol=symbol).update(current_price=price)
 
-    print(f"[{timezone.now():%H:%M:%S}] Price fetch cycle complete.")
+def compact_prices_job():
+    """
+    Roll old PriceHistory samples into hourly/daily bars and thin old
+    BalanceHistory snapshots (see rollups.py).
+    """
+    started = time.perf_counter()
+    counts = compact_prices()
+    thinned = compact_balances()
+    if counts["sealed"]:
+        print(f"Packed {counts['sealed']} samples into price chunks.")
+    print(
+        f"Compacted {counts['raw_rolled']} samples into {counts['hourly_written']} hourly bars and "
+        f"{counts['hourly_rolled']} hourly bars into {counts['daily_written']} daily bars, "
+        f"and dropped {thinned} balance snapshots, in {time.perf_counter() - started:.1f}s."
+    )
+
+
+# The last cold symbol fetched. The next run continues with the first cold
+# symbol after it, so hot symbols going cold (or cold ones going hot) never
+# shift the rotation past symbols it hasn't reached yet
+_cold_last = None
+
+def plan_tiered_cycle(symbols: List[str], budget: int = None):
+    """
+    Pick the symbols for one tiered run: the hot tier (by demand) first, then
+    the next slice of the cold tail. Returns (hot, cold).
+    """
+    global _cold_last
+    hot = rank_symbols(symbols)[:HOT_TIER_MAX]
+    hot_set = set(hot)
+    tail = sorted(sym for sym in symbols if sym not in hot_set)
+
+    runs_per_cold_cycle = max(1, COLD_INTERVAL_MINUTES // HOT_INTERVAL_MINUTES)
+    n_cold = math.ceil(len(tail) / runs_per_cold_cycle)
+    if budget is not None:
+        hot = hot[:budget]
+        n_cold = min(n_cold, budget - len(hot))
+    n_cold = max(0, min(n_cold, len(tail)))
+
+    if not tail:
+        return hot, []
+    start = bisect.bisect_right(tail, _cold_last) if _cold_last is not None else 0
+    cold = (tail[start:] + tail[:start])[:n_cold]
+    if cold:
+        _cold_last = cold[-1]
+    return hot, cold
+
+
+def fetch_tiered_job(provider: QuoteProvider = None):
+    """
+    One tiered run: refresh the hot tier and a slice of the cold tail within
+    the provider's budget for HOT_INTERVAL_MINUTES.
+    """
+    provider = provider or get_provider()
+    symbols = list(Stock.objects.values_list("symbol", flat=True))
+    # Leave 10% headroom so a run finishes before the next one is due
+    hot, cold = plan_tiered_cycle(symbols, provider.budget(HOT_INTERVAL_MINUTES * 60 * 0.9))
+    print(f"[{timezone.now():%H:%M:%S}] Tiered refresh: {len(hot)} hot + {len(cold)} cold symbols.")
+    fetch_prices_job(provider, hot + cold)
 
 
 # ---- APScheduler wiring ----
 scheduler = None
+# Any number of worker processes may run; the one holding this lease fetches
+PRICE_WORKER_LEASE = "price_worker"
+SCHEDULER_TIMEZONE = "Europe/London"
+
+def cycle_interval_minutes() -> int:
+    """
+    How often a symbol can expect fresh prices in the configured mode.
+    """
+    return HOT_INTERVAL_MINUTES if SCHEDULE_MODE == "tiered" else FETCH_INTERVAL_MINUTES
+
+def next_cycle_due(now=None):
+    """
+    When the next fetch cycle is due, going by the newest stored quote, so a
+    worker taking over keeps the previous leader's rhythm instead of
+    fetching again at once.
+    """
+    now = now or timezone.now()
+    last = LatestQuote.objects.aggregate(last=Max("timestamp"))["last"]
+    if last is None:
+        return now
+    return max(now, last + timedelta(minutes=cycle_interval_minutes()))
+
+
+class PriceWorker:
+    """
+    Runs the fetch and compaction jobs on an APScheduler scheduler while this
+    process holds the price-worker lease, renewed every third of its length
+    from the scheduler's own thread pool, so it stays held through long
+    cycles. Standbys keep trying for it; the one that takes over an expired
+    lease resumes fetching when the next cycle is due. Each job re-checks
+    the lease before it starts.
+    """
+    def __init__(self, sched, holder: str = None):
+        self.scheduler = sched
+        self.holder = holder or holder_id()
+        self.leader = False
+        self._lock = threading.Lock()
+
+    def install(self):
+        job = fetch_tiered_job if SCHEDULE_MODE == "tiered" else fetch_prices_job
+        self.scheduler.add_job(
+            self.renew,
+            "interval",
+            seconds=max(1, LEASE_SECONDS // 3),
+            id="price_worker_lease",
+            next_run_time=timezone.now(),
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+        )
+        self.scheduler.add_job(
+            self.guarded(job),
+            "interval",
+            minutes=cycle_interval_minutes(),  # adjust if you have lots of symbols
+            id="fetch_prices",
+            next_run_time=None,            # paused until the lease is ours
+            replace_existing=True,
+            coalesce=True,                 # collapse missed runs into one
+            max_instances=1,               # prevent overlapping runs
+            misfire_grace_time=60,
+        )
+        self.scheduler.add_job(
+            self.guarded(compact_prices_job),
+            "cron",
+            hour=COMPACTION_HOUR,
+            id="compact_prices",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+            misfire_grace_time=3600,
+        )
+
+    def renew(self) -> bool:
+        """
+        Take or renew the lease; start fetching on taking it over and pause
+        on losing it. Returns whether this process holds it.
+        """
+        with self._lock:
+            try:
+                held = acquire_lease(PRICE_WORKER_LEASE, self.holder)
+                if held and not self.leader:
+                    # Another process may have filled or cancelled orders meanwhile
+                    trigger_engine.rebuild()
+                    due = next_cycle_due()
+                    print(f"[{timezone.now():%H:%M:%S}] {self.holder} holds the price worker lease; next fetch at {due:%H:%M:%S}.")
+                    self.scheduler.modify_job("fetch_prices", next_run_time=due)
+            except DatabaseError as e:
+                print(f"[{timezone.now():%H:%M:%S}] Price worker lease check failed: {e}")
+                held = False
+            finally:
+                close_old_connections()
+            if self.leader and not held:
+                print(f"[{timezone.now():%H:%M:%S}] {self.holder} lost the price worker lease; fetching paused.")
+                self.scheduler.pause_job("fetch_prices")
+            self.leader = held
+            return held
+
+    def guarded(self, job):
+        """
+        `job`, run only while this process holds the lease.
+        """
+        @functools.wraps(job)
+        def run():
+            if not self.renew():
+                return
+            try:
+                job()
+            finally:
+                close_old_connections()
+        return run
+
+    def release(self):
+        """
+        Hand the lease to a standby now rather than when it expires.
+        """
+        with self._lock:
+            if self.leader:
+                release_lease(PRICE_WORKER_LEASE, self.holder)
+                self.leader = False
+
 
 def start_scheduler():
     """
-    Start the background scheduler (only once).
-    We also set coalesce/max_instances so jobs won't overlap if a cycle runs long.
+    Start the background scheduler in this process (only once). It fetches
+    only while it holds the price-worker lease, so it can run alongside
+    run_price_worker processes.
     """
     global scheduler
     if scheduler and scheduler.running:
         return
 
-    scheduler = BackgroundScheduler(timezone="Europe/London")
-    scheduler.add_job(
-        fetch_prices_job,
-        "interval",
-        minutes=25,                 # adjust if you have lots of symbols
-        id="fetch_prices",
-        next_run_time=timezone.now(),  # fire once at startup
-        replace_existing=True,
-        coalesce=True,             # collapse missed runs into one
-        max_instances=1,           # prevent overlapping runs
-        misfire_grace_time=60,
-    )
+    scheduler = BackgroundScheduler(timezone=SCHEDULER_TIMEZONE)
+    worker = PriceWorker(scheduler)
+    worker.install()
     scheduler.start()
-    print("APScheduler started (Finnhub).")
+    atexit.register(worker.release)
+    print(f"APScheduler started ({SCHEDULE_MODE} mode, every {cycle_interval_minutes()} min).")
@@ -0,0 +1,133 @@
+import os
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, List, Tuple
+
+import numpy as np
+from django.db import transaction
+
+from brokersystem.models import PriceChunk, PriceHistory
+
+# "rows": every sample stays a PriceHistory row (until rolled up).
+# "chunks": samples of completed periods are packed into one PriceChunk per
+# stock and period; PriceHistory only holds the period being written.
+PRICE_STORAGE = os.getenv("PRICE_STORAGE", "rows")
+CHUNK_DAYS = int(os.getenv("PRICE_CHUNK_DAYS", "7"))
+CHUNK_SECONDS = CHUNK_DAYS * 86400
+
+
+def chunked() -> bool:
+    return PRICE_STORAGE == "chunks"
+
+
+def chunk_start(epoch: int) -> int:
+    return epoch // CHUNK_SECONDS * CHUNK_SECONDS
+
+
+def encode(t: np.ndarray, cents: np.ndarray) -> bytes:
+    """
+    Pack sorted epoch seconds and integer-cent prices: both delta-encoded
+    as little-endian int64 (the first value against zero), then deflated.
+    Regular sampling makes the time deltas repeat, and prices move by a few
+    cents, so the stream compresses to a couple of bytes per sample.
+    """
+    deltas = np.concatenate([np.diff(t, prepend=0), np.diff(cents, prepend=0)]).astype("<i8")
+    return zlib.compress(deltas.tobytes(), 6)
+
+
+def decode(blob: bytes, samples: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (epoch seconds, integer cents) int64 arrays of one chunk.
+    """
+    deltas = np.frombuffer(zlib.decompress(blob), dtype="<i8")
+    return np.cumsum(deltas[:samples]), np.cumsum(deltas[samples:])
+
+
+def load_raw(stock_id: int, start: datetime = None, end: datetime = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Raw samples for one stock as (epoch seconds, prices) float arrays,
+    oldest first, from PriceChunk blobs (in "chunks" mode) and PriceHistory
+    rows. Chunks decode straight to arrays; no row per sample is read.
+    """
+    parts = []
+    since = start
+    if chunked():
+        qs = PriceChunk.objects.filter(stock_id=stock_id)
+        if start is not None:
+            qs = qs.filter(start__gt=start - timedelta(seconds=CHUNK_SECONDS))
+        if end is not None:
+            qs = qs.filter(start__lte=end)
+        chunks = list(qs.order_by("start").values_list("start", "samples", "data"))
+        for _, samples, data in chunks:
+            t, cents = decode(bytes(data), samples)
+            parts.append((t, cents))
+        if chunks:
+            # Rows only hold samples after the last sealed period
+            sealed = chunks[-1][0] + timedelta(seconds=CHUNK_SECONDS)
+            since = sealed if since is None else max(since, sealed)
+
+    qs = PriceHistory.objects.filter(stock_id=stock_id)
+    if since is not None:
+        qs = qs.filter(timestamp__gte=since)
+    if end is not None:
+        qs = qs.filter(timestamp__lte=end)
+    rows = list(qs.order_by("timestamp").values_list("timestamp", "price"))
+    x = np.fromiter((ts.timestamp() for ts, _ in rows), dtype=np.float64, count=len(rows))
+    y = np.fromiter((float(price) for _, price in rows), dtype=np.float64, count=len(rows))
+    if not parts:
+        return x, y
+
+    t = np.concatenate([t for t, _ in parts]).astype(np.float64)
+    y_chunks = np.concatenate([cents for _, cents in parts]) / 100.0
+    keep = np.ones(len(t), dtype=bool)
+    if start is not None:
+        keep &= t >= start.timestamp()
+    if end is not None:
+        keep &= t <= end.timestamp()
+    return np.concatenate([t[keep], x]), np.concatenate([y_chunks[keep], y])
+
+
+def seal_chunks(stock_ids: List[int], before: datetime) -> int:
+    """
+    Pack the PriceHistory rows of completed periods (older than the period
+    containing `before`) into PriceChunk blobs and delete the rows. Rows that
+    arrive for an already sealed period are merged into its chunk.
+    Returns the number of rows packed.
+    """
+    cutoff = datetime.fromtimestamp(chunk_start(int(before.timestamp())), tz=dt_timezone.utc)
+    rows = PriceHistory.objects.filter(stock_id__in=stock_ids, timestamp__lt=cutoff)
+    samples: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+    for stock_id, ts, price in rows.values_list("stock_id", "timestamp", "price").iterator(chunk_size=5000):
+        epoch = int(ts.timestamp())
+        samples.setdefault((stock_id, chunk_start(epoch)), []).append((epoch, int(price * 100)))
+    if not samples:
+        return 0
+
+    starts = {key: datetime.fromtimestamp(key[1], tz=dt_timezone.utc) for key in samples}
+    existing = PriceChunk.objects.filter(
+        stock_id__in={stock_id for stock_id, _ in samples},
+        start__in=set(starts.values()),
+    ).values_list("stock_id", "start", "samples", "data")
+    for stock_id, start, count, data in existing:
+        key = (stock_id, int(start.timestamp()))
+        if key in samples:
+            t, cents = decode(bytes(data), count)
+            samples[key] = list(zip(t.tolist(), cents.tolist())) + samples[key]
+
+    packed = []
+    for key, points in samples.items():
+        # One sample per second; a re-sent row replaces the stored one
+        by_time = dict(points)
+        t = np.array(sorted(by_time), dtype=np.int64)
+        cents = np.array([by_time[epoch] for epoch in t.tolist()], dtype=np.int64)
+        packed.append(PriceChunk(stock_id=key[0], start=starts[key], samples=len(t), data=encode(t, cents)))
+
+    with transaction.atomic():
+        PriceChunk.objects.bulk_create(
+            packed,
+            batch_size=200,
+            update_conflicts=True,
+            unique_fields=["stock", "start"],
+            update_fields=["samples", "data"],
+        )
+        return rows.delete()[0]
@@ -0,0 +1,71 @@
+import os
+
+from django.db.backends.sqlite3 import base
+
+# Web views and the price fetcher share one SQLite file. The journal mode is
+# stored in the file itself, so it is set after migrate, not per connection.
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+JOURNAL_MODE = "wal" if SQLITE_WAL else "delete"
+# How long a writer waits for the write lock before "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+SQLITE_CACHE_KIB = int(os.getenv("SQLITE_CACHE_KIB", "65536"))
+# Take the write lock when an atomic block starts, not at its first write
+SQLITE_IMMEDIATE = os.getenv("SQLITE_IMMEDIATE_TRANSACTIONS", "1") == "1"
+
+
+def pragmas():
+    """
+    Statements run on every new connection; none of them write the file.
+    """
+    return [
+        f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size = {SQLITE_MMAP_BYTES}",
+        f"PRAGMA cache_size = -{SQLITE_CACHE_KIB}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+
+
+def set_journal_mode(connection) -> bool:
+    """
+    Switch a file database to JOURNAL_MODE unless it is in that mode
+    already. Returns whether the mode changed.
+    """
+    if connection.vendor != "sqlite" or connection.is_in_memory_db():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode")
+        if cursor.fetchone()[0].lower() == JOURNAL_MODE:
+            return False
+        cursor.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+    return True
+
+
+def journal_mode_after_migrate(sender, using, **kwargs):
+    from django.db import connections
+    if set_journal_mode(connections[using]):
+        print(f"Switched the {using} database to journal_mode={JOURNAL_MODE}.")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Django's SQLite backend set up for concurrent readers and one writer.
+    In WAL mode readers never wait for the fetcher's writes (or it for
+    them), and synchronous=NORMAL is still crash-safe there: a power loss
+    can drop the last commits, never corrupt the file. busy_timeout makes
+    competing writers queue instead of failing.
+    Atomic blocks start with BEGIN IMMEDIATE: a deferred transaction that
+    reads, then writes after another writer has committed, fails at once
+    with "database is locked" (its snapshot is stale), however long
+    busy_timeout is.
+    """
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for statement in pragmas():
+            conn.execute(statement)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE" if SQLITE_IMMEDIATE else "BEGIN")
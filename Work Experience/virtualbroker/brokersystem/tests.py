@@ -1,3 +1,1885 @@
-from django.test import TestCase
+import importlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import numpy as np
+from apscheduler.schedulers.background import BackgroundScheduler
+from asgiref.sync import async_to_sync
+from django.conf import settings as django_settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import NoReverseMatch, clear_url_caches, resolve, reverse
+from django.utils import timezone
+
+from brokersystem import analytics, backtest, charts, demand, fragments, leaderboard, lease, live, metrics, orders, providers, rollups, scheduler, search, series, universe, urls, views
+from brokersystem.models import BalanceHistory, CustomUser, Stock, PriceHistory, Position, Transaction, LatestQuote, LeaderboardScore, Order, PriceHourly, PriceDaily, PriceChunk, WorkerLease, FetchCycle
+from brokersystem.providers import FakeQuoteProvider, FinnhubProvider, TokenBucket
+from brokersystem.sqlite import base as sqlite_backend
+
+# Benchmarks are slow and print timings; run them with RUN_BENCHMARKS=1
+RUN_BENCHMARKS = os.environ.get("RUN_BENCHMARKS") == "1"
+
+
+class FakeFinnhubHandler(BaseHTTPRequestHandler):
+    """Stand-in for Finnhub /quote with a fixed per-request latency."""
+    latency = 0.05
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        query = parse_qs(urlparse(self.path).query)
+        symbol = query.get("symbol", [""])[0]
+        body = json.dumps({"c": 100 + len(symbol), "t": int(time.time())}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeFinnhubMixin:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeFinnhubHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        cls.patches = [
+            mock.patch.object(providers, "FINNHUB_BASE", base),
+            mock.patch.object(providers, "FINNHUB_TOKEN", "test"),
+        ]
+        for p in cls.patches:
+            p.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        for p in cls.patches:
+            p.stop()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+
+class TokenBucketTests(TestCase):
+    def test_burst_then_refill(self):
+        bucket = TokenBucket(calls_per_minute=6000, burst=10)
+        start = time.monotonic()
+        for _ in range(10):
+            bucket.wait()
+        self.assertLess(time.monotonic() - start, 0.05)  # burst is immediate
+
+        start = time.monotonic()
+        for _ in range(20):
+            bucket.wait()
+        # 20 more tokens at 6000 / 60 per second
+        self.assertGreaterEqual(time.monotonic() - start, 20 / (6000 / 60) * 0.9)
+
+    def test_never_exceeds_quota_in_a_window(self):
+        # Sustained rate as configured, burst trimmed to the quota's headroom
+        bucket = TokenBucket(calls_per_minute=50, burst=20, quota=60)
+        self.assertEqual((bucket.rate * 60, bucket.capacity), (50, 10))
+        bucket = TokenBucket(calls_per_minute=60, burst=5, quota=60)
+        self.assertLessEqual(bucket.capacity + bucket.rate * 60, 60)
+        # The defaults use the whole quota: a burst of 5, then 55/minute
+        limiter = FinnhubProvider().limiter
+        self.assertEqual((limiter.rate * 60, limiter.capacity), (55, 5))
+
+    def test_default_cycle_time(self):
+        # 957 symbols: the burst, then the rest at quota - burst per minute
+        expected = (957 - providers.BURST) * 60 / (providers.QUOTA_PER_MINUTE - providers.BURST)
+        self.assertAlmostEqual(FinnhubProvider().estimate_seconds(957), expected)
+        self.assertLess(expected, 1040)  # ~17.3 minutes, down from ~19 at 50/minute
+
+
+class FinnhubProviderTests(FakeFinnhubMixin, TestCase):
+    def test_cycle_writes_price_history(self):
+        Stock.objects.bulk_create([Stock(name=s, symbol=s) for s in ("AAA", "BBBB", "CC")])
+        scheduler.fetch_prices_job(FinnhubProvider(calls_per_minute=6000, quota_per_minute=6010))
+        prices = dict(PriceHistory.objects.values_list("stock__symbol", "price"))
+        self.assertEqual(prices, {"AAA": 103, "BBBB": 104, "CC": 102})
+        cycle = FetchCycle.objects.get()
+        self.assertEqual((cycle.provider, cycle.requests, cycle.failed_requests), ("finnhub", 3, 0))
+        self.assertGreaterEqual(cycle.request_seconds, 3 * FakeFinnhubHandler.latency)
+
+
+class QuoteProviderTests(TestCase):
+    def setUp(self):
+        Stock.objects.bulk_create([Stock(name=f"Stock {i}", symbol=f"S{i:04d}") for i in range(957)])
+
+    def test_batch_provider_covers_universe_in_few_requests(self):
+        provider = FakeQuoteProvider(lambda sym: 10 + int(sym[1:]), batch_size=200)
+        scheduler.fetch_prices_job(provider)
+        self.assertEqual(provider.requests, 5)
+        self.assertEqual(PriceHistory.objects.count(), 957)
+        self.assertEqual(PriceHistory.objects.get(stock__symbol="S0042").price, 52)
+
+    def test_single_symbol_provider_skips_failures(self):
+        provider = FakeQuoteProvider({"S0001": 5, "S0002": 0}, batch_size=None)
+        scheduler.fetch_prices_job(provider)
+        self.assertEqual(provider.requests, 957)
+        self.assertEqual(list(PriceHistory.objects.values_list("stock__symbol", flat=True)), ["S0001"])
+
+
+def make_user(email="trader@example.com", balance=10000):
+    return CustomUser.objects.create_user(email, email=email, password="pw", balance=balance)
+
+
+class TieredScheduleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        demand._written.clear()
+        self.stocks = Stock.objects.bulk_create([Stock(name=f"Stock {i}", symbol=f"S{i:02d}") for i in range(60)])
+        self.user = make_user()
+
+    def test_rank_by_holdings_trades_and_views(self):
+        Position.objects.create(user=self.user, stock=self.stocks[5], quantity=1, price=1)
+        Transaction.objects.create(user=self.user, stock=self.stocks[7], quantity=1, price=1, side="buy")
+        demand.record_view("S09")
+        self.assertEqual(demand.rank_symbols(s.symbol for s in self.stocks), ["S05", "S09", "S07"])
+
+    def test_dashboard_records_picked_symbols_only(self):
+        Position.objects.create(user=self.user, stock=self.stocks[1], quantity=1, price=1)
+        self.client.force_login(self.user)
+        viewed = lambda: list(Stock.objects.filter(last_viewed_at__isnull=False).values_list("symbol", flat=True))
+        self.client.get(reverse("dashboard"))  # first rows are auto-selected
+        self.assertEqual(viewed(), [])
+        self.client.get(reverse("dashboard"), {"stock_symbol": "S09"})
+        self.assertEqual(viewed(), ["S09"])
+        self.assertEqual(demand.rank_symbols(s.symbol for s in self.stocks), ["S01", "S09"])
+
+        # Seen again within VIEW_WRITE_SECONDS: not written again
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("dashboard"), {"stock_symbol": "S09"})
+        self.assertFalse([q for q in queries.captured_queries if q["sql"].startswith("UPDATE")])
+
+    def test_hot_tier_every_run_and_cold_tail_rotates(self):
+        Position.objects.create(user=self.user, stock=self.stocks[3], quantity=1, price=1)
+        symbols = [s.symbol for s in self.stocks]
+        scheduler._cold_last = None
+        seen = set()
+        runs = scheduler.COLD_INTERVAL_MINUTES // scheduler.HOT_INTERVAL_MINUTES
+        for _ in range(runs):
+            hot, cold = scheduler.plan_tiered_cycle(symbols)
+            self.assertEqual(hot, ["S03"])
+            seen.update(cold)
+        self.assertEqual(seen, set(symbols) - {"S03"})
+
+    def test_cold_rotation_survives_hot_tier_changes(self):
+        symbols = [s.symbol for s in self.stocks]
+        scheduler._cold_last = None
+        _, first = scheduler.plan_tiered_cycle(symbols, budget=3)
+        self.assertEqual(first, ["S00", "S01", "S02"])
+        # S00 and S01, already fetched, turn hot: the cold list shrinks
+        # ahead of the rotation, which still carries on from S03
+        Position.objects.bulk_create([Position(user=self.user, stock=s, quantity=1, price=1) for s in self.stocks[:2]])
+        hot, cold = scheduler.plan_tiered_cycle(symbols, budget=5)
+        self.assertEqual((sorted(hot), cold), (["S00", "S01"], ["S03", "S04", "S05"]))
+
+    def test_budget_limits_cold_slice_first(self):
+        Position.objects.create(user=self.user, stock=self.stocks[3], quantity=1, price=1)
+        hot, cold = scheduler.plan_tiered_cycle([s.symbol for s in self.stocks], budget=4)
+        self.assertEqual((len(hot), len(cold)), (1, 3))
+
+    def test_tiered_job_fetches_planned_symbols(self):
+        provider = FakeQuoteProvider(lambda sym: 1, batch_size=None)
+        with mock.patch.object(scheduler, "plan_tiered_cycle", return_value=(["S01"], ["S02", "S03"])):
+            scheduler.fetch_tiered_job(provider)
+        self.assertEqual(provider.requests, 3)
+        self.assertEqual(PriceHistory.objects.count(), 3)
+
+
+class PositionPriceUpdateTests(TestCase):
+    def test_set_based_update_in_chunks(self):
+        stocks = Stock.objects.bulk_create([Stock(name=f"Stock {i}", symbol=f"S{i:03d}") for i in range(400)])
+        users = [make_user(f"u{i}@example.com") for i in range(3)]
+        Position.objects.bulk_create(
+            [Position(user=u, stock=s, quantity=1, price=1) for u in users for s in stocks[:350]]
+        )
+        prices = {s.id: Decimal(s.symbol[1:]) + Decimal("0.25") for s in stocks}
+        with self.assertNumQueries(2 + 1):  # savepoint pair + one UPDATE (400 stocks fit one chunk)
+            updated = scheduler.update_position_prices(prices)
+        self.assertEqual(updated, 3 * 350)
+        self.assertEqual(Position.objects.filter(stock__symbol="S123").first().current_price, Decimal("123.25"))
+
+        with mock.patch.object(scheduler, "_supports_update_from", return_value=False):
+            scheduler.update_position_prices({s.id: Decimal("7.00") for s in stocks})
+        self.assertEqual(set(Position.objects.values_list("current_price", flat=True)), {Decimal("7.00")})
+
+
+class BalanceSnapshotTests(TestCase):
+    def test_one_query_and_one_insert_for_all_users(self):
+        stocks = Stock.objects.bulk_create([Stock(name=f"Stock {i}", symbol=f"S{i}") for i in range(3)])
+        users = [make_user(f"u{i}@example.com", balance=1000 + i) for i in range(4)]
+        Position.objects.create(user=users[0], stock=stocks[0], quantity=2, price=10, current_price=Decimal("12.50"))
+        Position.objects.create(user=users[0], stock=stocks[1], quantity=1, price=7)  # not priced yet: at cost
+        Position.objects.create(user=users[1], stock=stocks[2], quantity=3, price=5, current_price=4)
+        now = timezone.now()
+        with self.assertNumQueries(2):
+            written = scheduler.snapshot_balances(now)
+        self.assertEqual(written, 4)
+        snapshots = {s.user_id: s for s in BalanceHistory.objects.all()}
+        self.assertEqual(snapshots[users[0].id].net_worth, Decimal("1032.00"))
+        self.assertEqual(snapshots[users[1].id].net_worth, Decimal("1013.00"))
+        self.assertEqual(snapshots[users[3].id].net_worth, snapshots[users[3].id].balance)
+        self.assertEqual({s.timestamp for s in snapshots.values()}, {now})
+
+    def test_fetch_cycle_snapshots(self):
+        stock = Stock.objects.create(name="Acme", symbol="ACME")
+        user = make_user(balance=500)
+        Position.objects.create(user=user, stock=stock, quantity=10, price=10)
+        scheduler.fetch_prices_job(FakeQuoteProvider({"ACME": 11}))
+        self.assertEqual(BalanceHistory.objects.get(user=user).net_worth, Decimal("610.00"))
+
+        # The next cycles within BALANCE_SNAPSHOT_MINUTES don't snapshot again
+        scheduler.fetch_prices_job(FakeQuoteProvider({"ACME": 12}))
+        self.assertEqual(BalanceHistory.objects.count(), 1)
+        BalanceHistory.objects.update(timestamp=timezone.now() - timedelta(minutes=scheduler.BALANCE_SNAPSHOT_MINUTES))
+        scheduler.fetch_prices_job(FakeQuoteProvider({"ACME": 12}))
+        self.assertEqual(BalanceHistory.objects.count(), 2)
+
+    def test_compaction_thins_old_snapshots(self):
+        users = [make_user(f"u{i}@example.com") for i in range(2)]
+        now = timezone.now().replace(minute=0, second=0, microsecond=0)
+        # A snapshot every 20 minutes for the last 100 days
+        BalanceHistory.objects.bulk_create(
+            [
+                BalanceHistory(user=user, balance=i, timestamp=now - timedelta(minutes=20 * i))
+                for user in users for i in range(100 * 72)
+            ],
+            batch_size=2000,
+        )
+        with mock.patch.object(rollups, "BALANCE_LOOKBACK_DAYS", 100):
+            rollups.compact_balances(now)
+            self.assertEqual(rollups.compact_balances(now), 0)
+
+        def per_user(start, end):
+            return BalanceHistory.objects.filter(user=users[0], timestamp__gte=start, timestamp__lt=end).count()
+
+        raw_cutoff = now - timedelta(days=rollups.RAW_RETENTION_DAYS)
+        hourly_cutoff = rollups._floor(now - timedelta(days=rollups.HOURLY_RETENTION_DAYS), rollups.DAY)
+        self.assertEqual(per_user(raw_cutoff, now), rollups.RAW_RETENTION_DAYS * 72)
+        self.assertEqual(per_user(hourly_cutoff, raw_cutoff), (raw_cutoff - hourly_cutoff) // timedelta(hours=1))
+        daily = BalanceHistory.objects.filter(user=users[0], timestamp__lt=hourly_cutoff).values_list("timestamp", flat=True)
+        self.assertEqual(len(daily), len({when.date() for when in daily}))
+        self.assertGreaterEqual(len(daily), 100 - rollups.HOURLY_RETENTION_DAYS - 1)
+        # The last snapshot of each hour and day is the one kept
+        kept = BalanceHistory.objects.filter(user=users[0], timestamp__lt=raw_cutoff).order_by("-timestamp")
+        self.assertEqual(kept[0].timestamp, raw_cutoff - timedelta(minutes=20))
+        self.assertEqual(kept.filter(timestamp__lt=hourly_cutoff)[0].timestamp, hourly_cutoff - timedelta(minutes=20))
+
+    def test_save_keeps_given_balance(self):
+        user = make_user(balance=500)
+        with self.assertNumQueries(1):
+            BalanceHistory(user_id=user.id, balance=400).save()
+        BalanceHistory(user=user).save()
+        self.assertEqual(sorted(BalanceHistory.objects.values_list("balance", flat=True)), [400, 500])
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stock = Stock.objects.create(name="Acme", symbol="ACME")
+        LatestQuote.objects.create(stock=self.stock, price=10, timestamp=timezone.now())
+        self.users = [make_user(f"u{i}@example.com", balance=b) for i, b in enumerate([500, 1000, 1000, 1500])]
+        # 1500 in cash + 50 shares at 10: the richest
+        Position.objects.create(user=self.users[3], stock=self.stock, quantity=50, price=10, current_price=10)
+        leaderboard.refresh_scores()
+
+    def test_top_and_rank_share_ties(self):
+        board = leaderboard.get_board()
+        ids = [u.id for u in self.users]
+        self.assertEqual(board.top(3), [(1, ids[3], 2000), (2, ids[1], 1000), (2, ids[2], 1000)])
+        self.assertEqual([board.rank(i) for i in ids], [4, 2, 2, 1])
+
+    def test_cycle_rewrites_only_changed_scores(self):
+        self.assertEqual(leaderboard.refresh_scores(), 0)
+        scheduler.fetch_prices_job(FakeQuoteProvider({"ACME": 5}))
+        self.assertEqual(LeaderboardScore.objects.get(user=self.users[3]).worth, 1750)
+        self.assertEqual(leaderboard.get_board().rank(self.users[3].id), 1)
+
+    def test_trade_applies_delta_without_rebuild(self):
+        board = leaderboard.get_board()
+        self.client.force_login(self.users[0])
+        self.client.post(reverse("trade"), {"buy": "ACME", "quantity": 10})
+        with self.assertNumQueries(0):
+            self.assertIs(leaderboard.get_board(), board)
+        # Bought at 10 and marked at 10: same worth, same rank
+        self.assertEqual(board.rank(self.users[0].id), 4)
+
+        self.users[0].balance = 5000
+        self.users[0].save(update_fields=["balance"])
+        leaderboard.record_trade(self.users[0].id)
+        self.assertEqual(leaderboard.get_board().rank(self.users[0].id), 1)
+        self.assertEqual(LeaderboardScore.objects.get(user=self.users[0]).worth, 5100)
+
+    def test_missing_delta_rebuilds(self):
+        board = leaderboard.get_board()
+        leaderboard.record_trade(self.users[0].id)
+        cache.delete(leaderboard.DELTA_KEY.format(cache.get(leaderboard.SEQ_KEY)))
+        with self.assertNumQueries(1):
+            self.assertIsNot(leaderboard.get_board(), board)
+
+    def test_api(self):
+        self.client.force_login(self.users[1])
+        data = self.client.get(reverse("leaderboard_api"), {"n": 2}).json()
+        self.assertEqual(data["users"], 4)
+        self.assertEqual([row["rank"] for row in data["top"]], [1, 2])
+        self.assertEqual(data["me"], {"rank": 2, "worth": 1000.0})
+        self.assertNotIn("u3@example.com", json.dumps(data))
+
+
+class BacktestTests(TestCase):
+    def setUp(self):
+        self.end = datetime(2026, 6, 1, tzinfo=dt_timezone.utc)
+        self.acme = Stock.objects.create(name="Acme", symbol="ACME")
+        self.beta = Stock.objects.create(name="Beta", symbol="BETA")
+
+    def test_load_matrix_stitches_tiers_on_one_grid(self):
+        day = lambda n, hour=12: self.end - timedelta(days=n) + timedelta(hours=hour - 24)
+        PriceDaily.objects.create(stock=self.acme, bucket=day(200, 0), open=1, high=1, low=1, close=10)
+        PriceHourly.objects.create(stock=self.acme, bucket=day(30, 9), open=1, high=1, low=1, close=11)
+        PriceHourly.objects.create(stock=self.acme, bucket=day(30, 15), open=1, high=1, low=1, close=12)
+        PriceHistory.objects.create(stock=self.acme, price=13, timestamp=day(2))
+        PriceHistory.objects.create(stock=self.beta, price=5, timestamp=day(10))
+        with mock.patch.object(timezone, "now", return_value=self.end):
+            with self.assertNumQueries(1 + 3):  # stocks, then daily, hourly and raw for all of them
+                symbols, times, prices = backtest.load_matrix(step=backtest.DAY)
+        self.assertEqual(symbols, ["ACME", "BETA"])
+        self.assertEqual(prices.shape, (len(times), 2))
+        at = lambda moment: int((moment.timestamp() - times[0]) // backtest.DAY)
+        self.assertTrue(np.isnan(prices[at(day(201)), 0]))
+        self.assertEqual(prices[at(day(200)), 0], 10)
+        self.assertEqual(prices[at(day(100)), 0], 10)  # carried forward
+        self.assertEqual(prices[at(day(30)), 0], 12)  # last sample of the day
+        self.assertEqual(prices[-1].tolist(), [13, 5])
+        self.assertTrue(np.isnan(prices[at(day(11)), 1]))
+
+        # Other backends read every row and pick the last per bar in NumPy
+        with mock.patch.object(timezone, "now", return_value=self.end), mock.patch.object(charts, "_group_in_sql", return_value=False):
+            self.assertTrue(np.array_equal(backtest.load_matrix(step=backtest.DAY)[2], prices, equal_nan=True))
+
+    def test_run_fills_at_close_without_commission(self):
+        prices = np.array([[10.0, 20.0], [11.0, 20.0], [12.0, 10.0]])
+        result = backtest.run(prices, np.array([[0.5, 0.5], [0.5, 0.5], [0.0, 0.0]]), capital=1000)
+        self.assertEqual(result["equity"].round(2).tolist(), [1000, 1050, round(1050 * (1 + 0.5 / 11 - 0.25), 2)])
+        self.assertEqual(result["symbol_returns"].round(4).tolist(), [0.2, -0.5])
+
+    def test_strategies(self):
+        rising, falling = np.linspace(10, 20, 60), np.linspace(20, 10, 60)
+        prices = np.c_[rising, falling]
+        weights = backtest.sma_crossover(prices, fast=5, slow=20)
+        self.assertEqual(weights[:19].sum(), 0)  # not enough history yet
+        self.assertTrue((weights[19:, 0] == 0.5).all() and (weights[:, 1] == 0).all())
+
+        weights = backtest.momentum(prices, lookback=10, top=1)
+        self.assertTrue((weights[10:, 0] == 1).all() and (weights[:, 1] == 0).all())
+
+        weights = backtest.rebalance(np.array([[10.0, 10.0], [20.0, 10.0], [20.0, 10.0]]), every=2)
+        self.assertEqual(weights.round(4).tolist(), [[0.5, 0.5], [0.6667, 0.3333], [0.5, 0.5]])
+
+    def test_command(self):
+        PriceHistory.objects.bulk_create(
+            [PriceHistory(stock=self.acme, price=10 + i, timestamp=timezone.now() - timedelta(days=30 - i)) for i in range(30)]
+        )
+        out = StringIO()
+        call_command("backtest", "rebalance", "--symbols", "acme", "--days", "40", stdout=out)
+        self.assertIn("over 1 symbols", out.getvalue())
+        self.assertIn("Best: ACME", out.getvalue())
+
+
+class LoadStocksTests(TestCase):
+    def write(self, name, text):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_seed_file_loads(self):
+        path = django_settings.BASE_DIR.parent / "stocks_public_name_symbol (1).csv"
+        out, err = StringIO(), StringIO()
+        call_command("load_stocks", str(path), stdout=out, stderr=err)
+        self.assertIn("958 added, 0 changed, 0 removed, 0 skipped", out.getvalue())
+        self.assertIn("keep their old stock search index", err.getvalue())
+        self.assertEqual(Stock.objects.get(symbol="WMT").name, "Walmart")
+
+    def test_upsert_reports_and_keeps_stocks_in_use(self):
+        Stock.objects.bulk_create([
+            Stock(name="Acme", symbol="ACME"), Stock(name="Old Name", symbol="BETA"),
+            Stock(name="Gone", symbol="GONE"), Stock(name="Held", symbol="HELD"),
+        ])
+        Position.objects.create(user=make_user(), stock=Stock.objects.get(symbol="HELD"), quantity=1, price=1)
+        self.assertEqual(search.get_index().search("new"), [])
+        path = self.write("stocks.csv", "name,symbol,is_public\nAcme,ACME,True\nNew Name,beta,True\nNewco,NEW,True\nPrivate,PRIV,False\n,NONAME,True\nNewco,NEW,True\n")
+
+        # Missing symbols stay unless asked for
+        report = universe.load_universe(universe.read_rows(path), dry_run=True)
+        self.assertEqual((report["removed"], report["missing"]), ([], ["GONE", "HELD"]))
+
+        report = universe.load_universe(universe.read_rows(path), remove_missing=True)
+        self.assertEqual(report, {
+            "added": ["NEW"], "changed": ["BETA"], "removed": ["GONE"], "kept": ["HELD"], "missing": [],
+            "skipped": ["PRIV", "NONAME", "NEW"],
+        })
+        self.assertEqual(dict(Stock.objects.values_list("symbol", "name")), {"ACME": "Acme", "BETA": "New Name", "NEW": "Newco", "HELD": "Held"})
+        ids = dict(Stock.objects.values_list("symbol", "id"))
+        self.assertEqual(search.get_index().search("new"), [ids["NEW"], ids["BETA"]])
+
+        # Loading the same file again writes nothing
+        with self.assertNumQueries(1 + 2 + 3):  # stocks, savepoint pair, in-use checks for HELD
+            report = universe.load_universe(universe.read_rows(path), remove_missing=True)
+        self.assertEqual(report["added"] + report["changed"] + report["removed"], [])
+
+    def test_json_lines_and_dry_run(self):
+        Stock.objects.bulk_create([Stock(name="Acme", symbol="ACME"), Stock(name="Gone", symbol="GONE")])
+        path = self.write("stocks.jsonl", '{"name": "Acme Corp", "symbol": "ACME"}\n\n{"name": "Beta", "symbol": "BETA"}\n')
+        out = StringIO()
+        call_command("load_stocks", path, "--dry-run", stdout=out)
+        self.assertIn("Would load", out.getvalue())
+        self.assertEqual(list(Stock.objects.values_list("name", flat=True)), ["Acme", "Gone"])
+        call_command("load_stocks", path, stdout=out)
+        self.assertIn("Left 1 symbols missing from the file in place", out.getvalue())
+        self.assertEqual(dict(Stock.objects.values_list("symbol", "name")), {"ACME": "Acme Corp", "BETA": "Beta", "GONE": "Gone"})
+        call_command("load_stocks", path, "--remove-missing", stdout=out)
+        self.assertEqual(set(Stock.objects.values_list("symbol", flat=True)), {"ACME", "BETA"})
+
+
+class FetchMetricsTests(TestCase):
+    def setUp(self):
+        Stock.objects.bulk_create([Stock(name=s, symbol=s) for s in ("ACME", "BETA", "GONE")])
+        Position.objects.create(user=make_user(), stock=Stock.objects.get(symbol="ACME"), quantity=2, price=10)
+        patcher = mock.patch.object(metrics, "_totals", metrics.Totals())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self):
+        scheduler.fetch_prices_job(FakeQuoteProvider({"ACME": 11, "BETA": 20}, batch_size=None))
+
+    def test_cycle_is_recorded(self):
+        self.fetch()
+        cycle = FetchCycle.objects.get()
+        self.assertTrue(cycle.ok)
+        self.assertEqual(
+            (cycle.provider, cycle.symbols, cycle.fetched, cycle.requests, cycle.failed_requests),
+            ("fake", 3, 2, 3, 1),
+        )
+        self.assertEqual((cycle.prices_written, cycle.positions_updated, cycle.orders_filled), (2, 1, 0))
+        self.assertEqual(sum(cycle.request_latency), 3)
+        self.assertEqual(cycle.interval_seconds, scheduler.cycle_interval_minutes() * 60)
+        self.assertGreaterEqual(cycle.total_seconds, cycle.fetch_seconds + cycle.write_seconds + cycle.positions_seconds)
+
+    def test_failed_cycle_is_recorded(self):
+        provider = FakeQuoteProvider()
+        provider.fetch_many = mock.Mock(side_effect=RuntimeError("quota exceeded"))
+        with self.assertRaises(RuntimeError):
+            scheduler.fetch_prices_job(provider)
+        cycle = FetchCycle.objects.get()
+        self.assertFalse(cycle.ok)
+        self.assertEqual(cycle.error, "RuntimeError: quota exceeded")
+        self.assertIsNone(provider.stats)
+
+    def test_metrics_endpoint(self):
+        self.fetch()
+        self.fetch()
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        for line in (
+            'broker_fetch_cycles_total{outcome="ok"} 2',
+            'broker_fetch_symbols_total{result="missing"} 2',
+            'broker_quote_requests_total{result="failed"} 2',
+            'broker_quote_request_duration_seconds_bucket{le="+Inf"} 6',
+            'broker_fetch_stage_duration_seconds_count{stage="total"} 2',
+            "broker_prices_written_total 4",
+        ):
+            self.assertIn(line + "\n", body)
+        self.assertIn("broker_fetch_interval_utilization ", body)
+
+        # Later scrapes only read the cycles added since
+        self.fetch()
+        with self.assertNumQueries(1):
+            body = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn('broker_fetch_cycles_total{outcome="ok"} 3\n', body)
+
+    def test_token(self):
+        with mock.patch.object(metrics, "METRICS_TOKEN", "s3cret"):
+            self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+            response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("broker_fetch_last_cycle_timestamp_seconds", response.content.decode())
+
+class WorkerLeaseTests(TestCase):
+    def test_one_holder_at_a_time(self):
+        now = timezone.now()
+        self.assertTrue(lease.acquire_lease("job", "a", seconds=60, now=now))
+        self.assertFalse(lease.acquire_lease("job", "b", seconds=60, now=now))
+        self.assertTrue(lease.acquire_lease("job", "a", seconds=60, now=now + timedelta(seconds=30)))
+        self.assertFalse(lease.acquire_lease("job", "b", seconds=60, now=now + timedelta(seconds=60)))
+
+        # a stopped renewing: b takes over and a can't take it back
+        later = now + timedelta(seconds=91)
+        self.assertTrue(lease.acquire_lease("job", "b", seconds=60, now=later))
+        self.assertFalse(lease.acquire_lease("job", "a", seconds=60, now=later))
+        self.assertEqual(WorkerLease.objects.get(name="job").acquired_at, later)
+
+        self.assertFalse(lease.release_lease("job", "a"))
+        self.assertTrue(lease.release_lease("job", "b"))
+        self.assertTrue(lease.acquire_lease("job", "a"))
+
+
+class PriceWorkerTests(TransactionTestCase):
+    def setUp(self):
+        self.schedulers = [BackgroundScheduler(timezone=scheduler.SCHEDULER_TIMEZONE) for _ in range(2)]
+        self.workers = [scheduler.PriceWorker(sched, holder=name) for sched, name in zip(self.schedulers, "ab")]
+        for worker in self.workers:
+            worker.install()
+
+    def test_only_the_lease_holder_fetches(self):
+        a, b = self.workers
+        self.assertIsNone(self.schedulers[0].get_job("fetch_prices").next_run_time)
+        last = timezone.now() - timedelta(minutes=5)
+        LatestQuote.objects.create(stock=Stock.objects.create(name="Acme", symbol="ACME"), price=1, timestamp=last)
+
+        self.assertTrue(a.renew())
+        self.assertFalse(b.renew())
+        # The new leader picks up the cycle where the stored quotes left off
+        due = self.schedulers[0].get_job("fetch_prices").next_run_time
+        self.assertEqual(due, last + timedelta(minutes=scheduler.cycle_interval_minutes()))
+        self.assertIsNone(self.schedulers[1].get_job("fetch_prices").next_run_time)
+
+        job = mock.Mock()
+        a.guarded(job)()
+        b.guarded(job)()
+        self.assertEqual(job.call_count, 1)
+
+        # a goes away; b takes over without waiting for the lease to expire
+        a.release()
+        self.assertTrue(b.renew())
+        self.assertFalse(a.renew())
+        b.guarded(job)()
+        self.assertEqual(job.call_count, 2)
+
+    def test_worker_needs_a_shared_cache(self):
+        with self.assertRaisesMessage(CommandError, "Set CACHE_LOCATION"):
+            call_command("run_price_worker")
+
+        with tempfile.TemporaryDirectory() as tmp, override_settings(CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": tmp}
+        }), mock.patch("brokersystem.management.commands.run_price_worker.BlockingScheduler") as blocking, \
+                mock.patch("signal.signal"):
+            out = StringIO()
+            call_command("run_price_worker", stdout=out)
+        blocking.return_value.start.assert_called_once()
+        self.assertIn("stopped", out.getvalue())
+
+    def test_runserver_fetches_unless_a_worker_can(self):
+        from brokersystem.apps import fetch_in_web
+        with override_settings(PRICE_SCHEDULER_IN_WEB=""):
+            # Per-process memory by default: nothing else could fetch
+            self.assertTrue(fetch_in_web())
+            with tempfile.TemporaryDirectory() as tmp, override_settings(CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": tmp}
+            }):
+                self.assertFalse(fetch_in_web())
+        with override_settings(PRICE_SCHEDULER_IN_WEB="0"):
+            self.assertFalse(fetch_in_web())
+
+    def test_new_leader_rebuilds_trigger_books(self):
+        stock = Stock.objects.create(name="Acme", symbol="ACME")
+        order = Order.objects.create(user=make_user(), stock=stock, side="buy", order_type="limit", quantity=1, limit_price=50)
+        self.addCleanup(orders.engine.reset)
+        orders.engine.reset()
+        orders.engine.sync()
+        # Filled by the process that held the lease before
+        Order.objects.filter(pk=order.pk).update(status="filled")
+        self.assertIn(order.id, orders.engine.legs)
+
+        self.assertTrue(self.workers[0].renew())
+        self.assertEqual(orders.engine.legs, {})
+        self.assertFalse(orders.engine.books.get(stock.id))
+
+    def test_losing_the_lease_pauses_fetching(self):
+        a, _ = self.workers
+        self.assertTrue(a.renew())
+        WorkerLease.objects.filter(name=scheduler.PRICE_WORKER_LEASE).update(holder="c")
+        self.assertFalse(a.renew())
+        self.assertIsNone(self.schedulers[0].get_job("fetch_prices").next_run_time)
+
+class LatestQuoteTests(TestCase):
+    def setUp(self):
+        self.stock = Stock.objects.create(name="Apple", symbol="AAPL")
+        self.user = make_user()
+        self.client.force_login(self.user)
+
+    def test_fetch_cycle_upserts_latest_quote(self):
+        scheduler.fetch_prices_job(FakeQuoteProvider({"AAPL": 100}))
+        scheduler.fetch_prices_job(FakeQuoteProvider({"AAPL": 105}))
+        self.assertEqual(PriceHistory.objects.count(), 2)
+        self.assertEqual(LatestQuote.objects.get(stock=self.stock).price, 105)
+
+    def test_dashboard_and_trade_read_latest_quote(self):
+        scheduler.fetch_prices_job(FakeQuoteProvider({"AAPL": 105}))
+        resp = self.client.get(reverse("dashboard"))
+        self.assertEqual(resp.context["stocks"][0].latest_price, 105)
+
+        self.client.post(reverse("trade"), {"buy": "AAPL", "quantity": "2"})
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 10000 - 210)
+        self.assertEqual(Transaction.objects.get().price, 105)
+
+
+class ChartDownsamplingTests(TestCase):
+    def test_lttb_caps_points_and_keeps_extremes(self):
+        x = np.arange(10_000, dtype=np.float64)
+        y = np.sin(x / 500)
+        y[4321] = 50  # spike must survive
+        dx, dy = charts.lttb(x, y, 300)
+        self.assertEqual(len(dx), 300)
+        self.assertEqual((dx[0], dx[-1]), (0, 9999))
+        self.assertIn(50, dy)
+        self.assertTrue(np.all(np.diff(dx) > 0))
+
+    def test_ohlc_buckets(self):
+        x = np.array([0, 10, 20, 3600, 3700], dtype=np.float64)
+        y = np.array([5, 9, 7, 1, 2], dtype=np.float64)
+        t, o, h, l, c = charts.ohlc_buckets(x, y, 3600)
+        self.assertEqual(t.tolist(), [0, 3600])
+        self.assertEqual((o.tolist(), h.tolist(), l.tolist(), c.tolist()), ([5, 1], [9, 2], [5, 1], [7, 2]))
+
+    def test_dashboard_chart_uses_selected_period(self):
+        stock = Stock.objects.create(name="Apple", symbol="AAPL")
+        latest = timezone.now().replace(microsecond=0)
+        PriceHistory.objects.bulk_create(
+            [PriceHistory(stock=stock, price=100 + i % 7, timestamp=latest - timedelta(minutes=25 * i)) for i in range(21_000)]
+        )
+        LatestQuote.objects.create(stock=stock, price=100, timestamp=latest)
+        self.client.force_login(make_user())
+
+        day = self.client.get(reverse("dashboard"), {"stock_symbol": "AAPL"}).context["stock_graph_data"]
+        self.assertEqual(len(day["datasets"][0]["data"]), 58)  # raw samples over the last 24h
+        year = self.client.get(reverse("dashboard"), {"stock_symbol": "AAPL", "stock_period": "1Y"}).context
+        points = year["stock_graph_data"]["datasets"][0]["data"]
+        self.assertLessEqual(len(points), charts.CHART_MAX_POINTS)
+        self.assertEqual(points[-1]["x"], int(latest.timestamp()) // 86400 * 86400 * 1000)
+        self.assertEqual([p["active"] for p in year["stock_periods"]], [False, False, False, False, True])
+
+
+class PriceHistoryApiTests(TestCase):
+    def setUp(self):
+        self.stock = Stock.objects.create(name="Apple", symbol="AAPL")
+        self.latest = timezone.now().replace(minute=0, second=0, microsecond=0)
+        PriceHistory.objects.bulk_create(
+            [PriceHistory(stock=self.stock, price=100 + i, timestamp=self.latest - timedelta(minutes=30 * i)) for i in range(10)]
+        )
+        LatestQuote.objects.create(stock=self.stock, price=100, timestamp=self.latest)
+        self.url = reverse("price_history_api", args=["AAPL"])
+
+    def get_json(self, resp):
+        return json.loads(b"".join(resp.streaming_content))
+
+    def test_raw_and_bucketed_columns(self):
+        data = self.get_json(self.client.get(self.url, {"period": "1D"}))
+        self.assertEqual(data["resolution"], "raw")
+        self.assertEqual(len(data["t"]), 10)
+        self.assertEqual(data["c"][-1], 100.0)
+        self.assertNotIn("o", data)
+
+        start = int((self.latest - timedelta(hours=5)).timestamp())
+        data = self.get_json(self.client.get(self.url, {"from": start, "resolution": "1h"}))
+        self.assertEqual(data["t"][-1], int(self.latest.timestamp()))
+        self.assertEqual((data["o"][-2], data["h"][-2], data["l"][-2], data["c"][-2]), (102.0, 102.0, 101.0, 101.0))
+
+    def test_conditional_get_until_next_cycle(self):
+        resp = self.client.get(self.url, {"period": "1W"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("public", resp["Cache-Control"])
+        etag = resp["ETag"]
+        self.assertEqual(self.client.get(self.url, {"period": "1W"}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        LatestQuote.objects.filter(stock=self.stock).update(timestamp=self.latest + timedelta(minutes=25))
+        self.assertEqual(self.client.get(self.url, {"period": "1W"}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_errors(self):
+        self.assertEqual(self.client.get(reverse("price_history_api", args=["NOPE"])).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {"resolution": "5m"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"from": "yesterday"}).status_code, 400)
+        # Beyond what datetime (or the platform's time_t) can represent
+        self.assertEqual(self.client.get(self.url, {"from": "9" * 20}).status_code, 400)
+
+    def test_points_are_capped(self):
+        PriceHistory.objects.bulk_create(
+            [PriceHistory(stock=self.stock, price=50 + i % 17, timestamp=self.latest - timedelta(minutes=30 * i)) for i in range(10, 1000)]
+        )
+        for params in ({"from": 0, "resolution": "raw"}, {"from": 0, "resolution": "1h"}):
+            with mock.patch.object(charts, "CHART_MAX_POINTS", 100):
+                data = self.get_json(self.client.get(self.url, params))
+            self.assertEqual(len(data["t"]), 100)
+            self.assertEqual(len(data["c"]), 100)
+            self.assertEqual(data["t"][-1], int(self.latest.timestamp()))
+        # Each kept bar keeps its own OHLC
+        self.assertTrue(all(lo <= c <= hi for lo, c, hi in zip(data["l"], data["c"], data["h"])))
+
+
+class StockSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Stock.objects.bulk_create([
+            Stock(name="Apple Inc", symbol="AAPL"),
+            Stock(name="Applied Materials", symbol="AMAT"),
+            Stock(name="American Airlines", symbol="AAL"),
+            Stock(name="Alphabet Class A", symbol="GOOGL"),
+            Stock(name="Meta Platforms", symbol="META"),
+        ] + [Stock(name=f"Filler {i}", symbol=f"Z{i:03d}") for i in range(120)])
+        search.invalidate()  # bulk_create skips the post_save signal
+
+    def test_prefix_search_ranks_symbol_matches_first(self):
+        index = search.get_index()
+        symbols = lambda q: [index.symbols[i] for i in index.search(q)]
+        self.assertEqual(symbols("aa"), ["AAL", "AAPL"])
+        self.assertEqual(symbols("app"), ["AAPL", "AMAT"])
+        self.assertEqual(symbols("meta"), ["META"])
+        self.assertEqual(symbols("a class"), ["GOOGL"])
+        self.assertEqual(len(index.search("")), 125)
+
+    def test_index_rebuilds_when_stocks_change(self):
+        self.assertEqual(search.get_index().search("nvd"), [])
+        Stock.objects.create(name="Nvidia", symbol="NVDA")
+        self.assertEqual(len(search.get_index().search("nvd")), 1)
+
+    def test_dashboard_paginates_stocks(self):
+        self.client.force_login(make_user())
+        ctx = self.client.get(reverse("dashboard")).context
+        self.assertEqual(len(ctx["stocks"]), 50)
+        self.assertEqual(ctx["stocks"][0].symbol, "AAL")
+        self.assertIn("stock_page=2", ctx["stock_pager"]["next"])
+        ctx = self.client.get(reverse("dashboard"), {"stock_page": 3, "stock_search": "z"}).context
+        self.assertEqual([s.symbol for s in ctx["stocks"]][:2], ["Z100", "Z101"])
+        self.assertEqual(ctx["stock_page"].paginator.num_pages, 3)
+
+
+class DashboardQueryPlanTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        fragments.fragments.clear()
+        now = timezone.now()
+        self.stocks = [Stock.objects.create(name=f"Stock {i}", symbol=f"S{i:03d}") for i in range(80)]
+        LatestQuote.objects.bulk_create([LatestQuote(stock=s, price=10, timestamp=now) for s in self.stocks])
+        PriceHistory.objects.bulk_create([PriceHistory(stock=s, price=10, timestamp=now) for s in self.stocks])
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.client.get(reverse("dashboard"))  # warm the search index
+        # Charted symbols were already recorded as viewed this window
+        demand._written.update(dict.fromkeys((s.symbol for s in self.stocks), time.time()))
+        self.addCleanup(demand._written.clear)
+
+    def hold(self, n):
+        Position.objects.bulk_create(
+            [Position(user=self.user, stock=s, quantity=2, price=5, current_price=10) for s in self.stocks[:n]]
+        )
+
+    def test_query_count_is_independent_of_portfolio_size(self):
+        # session, user, positions, stock page, two chart series, open orders
+        self.hold(1)
+        with self.assertNumQueries(7):
+            resp = self.client.get(reverse("dashboard"), {"stock_symbol": "S040"})
+        self.assertEqual(resp.context["portfolio_amount"], 20)
+
+        Position.objects.all().delete()
+        self.hold(60)
+        with self.assertNumQueries(7):
+            resp = self.client.get(reverse("dashboard"), {"stock_symbol": "S040", "position_page": 2})
+        self.assertEqual(resp.context["portfolio_amount"], 60 * 20)
+        self.assertEqual(len(resp.context["positions"]), 25)
+
+    def test_query_count_is_independent_of_trade_history(self):
+        # ... plus the ledger and one price read for every traded stock
+        for n in (1, 10, 40):
+            Transaction.objects.all().delete()
+            Position.objects.all().delete()
+            self.hold(n)
+            Transaction.objects.bulk_create(
+                [Transaction(user=self.user, stock=s, quantity=2, price=5, side="buy") for s in self.stocks[:n]]
+            )
+            Transaction.objects.update(executed_at=timezone.now() - timedelta(days=3))
+            fragments.bump_portfolio(self.user.id)
+            with self.assertNumQueries(9):
+                resp = self.client.get(reverse("dashboard"), {"stock_symbol": "S040"})
+            self.assertEqual(resp.context["portfolio_amount"], n * 20)
+
+    def test_selection_off_both_tables_costs_one_query(self):
+        self.hold(1)
+        with self.assertNumQueries(8):
+            resp = self.client.get(reverse("dashboard"), {"stock_symbol": "S079", "symbol": "S078"})
+        self.assertEqual(resp.context["stock_graph_data"]["title"], "S079")
+        self.assertEqual(len(resp.context["position_graph_data"]["datasets"][0]["data"]), 1)
+
+
+class DashboardFragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        fragments.fragments.clear()
+        now = timezone.now()
+        self.stocks = [Stock.objects.create(name=f"Stock {i}", symbol=f"S{i:03d}") for i in range(3)]
+        LatestQuote.objects.bulk_create([LatestQuote(stock=s, price=10, timestamp=now) for s in self.stocks])
+        PriceHistory.objects.bulk_create([PriceHistory(stock=s, price=10, timestamp=now) for s in self.stocks])
+        self.user = make_user()
+        self.client.force_login(self.user)
+
+    def test_repeat_load_between_cycles_is_served_from_cache(self):
+        first = self.client.get(reverse("dashboard"), {"stock_symbol": "S001"})
+        # session and user only
+        with self.assertNumQueries(2):
+            second = self.client.get(reverse("dashboard"), {"stock_symbol": "S001"})
+        for tile in ("positions_tile", "stocks_tile"):
+            self.assertEqual(first.context[tile], second.context[tile])
+
+    def test_trade_invalidates_only_that_users_tiles(self):
+        other = make_user("other@example.com")
+        self.client.get(reverse("dashboard"))
+        self.client.force_login(other)
+        self.client.get(reverse("dashboard"))
+
+        self.client.force_login(self.user)
+        self.client.post(reverse("trade"), {"buy": "S002", "quantity": 3})
+        self.client.get(reverse("dashboard"), {"from": "stocks"})  # shows the trade message
+        resp = self.client.get(reverse("dashboard"))
+        self.assertEqual(resp.context["portfolio_amount"], 30)
+        self.assertContains(resp, "Stock 2 (S002)")
+
+        self.client.force_login(other)
+        with self.assertNumQueries(2):
+            self.client.get(reverse("dashboard"))
+
+    def test_fetch_cycle_invalidates_tiles(self):
+        self.client.get(reverse("dashboard"))
+        scheduler.fetch_prices_job(FakeQuoteProvider({"S000": 12.5}))
+        resp = self.client.get(reverse("dashboard"))
+        self.assertContains(resp, "$12.50")
+
+    def test_lru_evicts_least_recently_used(self):
+        lru = fragments.LRUCache(2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual((lru.get("a"), lru.get("c"), len(lru)), (1, 3, 2))
+
+
+class OrderTriggerTests(TestCase):
+    def setUp(self):
+        orders.engine.reset()
+        self.stock = Stock.objects.create(name="Acme", symbol="ACME")
+        self.user = make_user(balance=1000)
+
+    def order(self, side, order_type, limit=None, stop=None, quantity=1, user=None):
+        return Order.objects.create(
+            user=user or self.user, stock=self.stock, side=side, order_type=order_type,
+            quantity=quantity, limit_price=limit, stop_price=stop,
+        )
+
+    def cycle(self, price):
+        return orders.process_orders({self.stock.id: Decimal(str(price))})
+
+    def test_limit_orders_fill_when_price_crosses(self):
+        buy = self.order("buy", "limit", limit=Decimal("95"), quantity=2)
+        sell = self.order("sell", "limit", limit=Decimal("110"), quantity=1)
+        self.assertEqual(self.cycle(100), 0)
+        self.assertEqual(self.cycle(94), 1)
+        buy.refresh_from_db()
+        self.assertEqual((buy.status, buy.fill_price), ("filled", Decimal("94.00")))
+        self.assertEqual(Position.objects.get(user=self.user).quantity, 2)
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).balance, Decimal("812.00"))
+
+        self.assertEqual(self.cycle(110), 1)
+        sell.refresh_from_db()
+        self.assertEqual(sell.status, "filled")
+        self.assertEqual(Position.objects.get(user=self.user).quantity, 1)
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).balance, Decimal("922.00"))
+
+    def test_fills_without_update_from(self):
+        self.order("buy", "limit", limit=Decimal("95"))
+        with mock.patch("brokersystem.dbutils.supports_update_from", return_value=False):
+            self.assertEqual(self.cycle(90), 1)
+        self.assertEqual(Order.objects.get().status, "filled")
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).balance, Decimal("910.00"))
+
+    def test_stop_and_stop_limit(self):
+        Position.objects.create(user=self.user, stock=self.stock, quantity=3, price=100)
+        stop = self.order("sell", "stop", stop=Decimal("90"))
+        # Stop hit at 90 but the limit (92) is not reachable until the price recovers
+        stop_limit = self.order("sell", "stop_limit", stop=Decimal("91"), limit=Decimal("92"))
+        self.assertEqual(self.cycle(90), 1)
+        stop.refresh_from_db()
+        stop_limit.refresh_from_db()
+        self.assertEqual((stop.status, stop_limit.status), ("filled", "triggered"))
+        self.assertEqual(self.cycle(92.5), 1)
+        stop_limit.refresh_from_db()
+        self.assertEqual((stop_limit.status, stop_limit.fill_price), ("filled", Decimal("92.50")))
+
+    def test_cancelled_and_unaffordable_orders_do_not_fill(self):
+        cancelled = self.order("buy", "limit", limit=Decimal("50"))
+        poor = self.order("buy", "limit", limit=Decimal("50"), quantity=100)
+        Order.objects.filter(pk=cancelled.pk).update(status="cancelled")
+        self.assertEqual(self.cycle(40), 0)
+        poor.refresh_from_db()
+        self.assertEqual(poor.status, "rejected")
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_cancelled_orders_leave_the_books(self):
+        keep = self.order("buy", "limit", limit=Decimal("50"))
+        gone = self.order("sell", "stop_limit", stop=Decimal("40"), limit=Decimal("39"))
+        self.cycle(100)
+        self.assertEqual(len(orders.engine.books[self.stock.id]), 2)
+
+        self.client.force_login(self.user)
+        self.client.post(reverse("cancel_order", args=[gone.id]))
+        self.cycle(100)
+        self.assertEqual(orders.engine.books[self.stock.id].below, [(Decimal("50"), keep.id)])
+        self.assertNotIn(gone.id, orders.engine.stop_limits)
+        self.assertNotIn(gone.id, orders.engine.legs)
+
+    def test_orders_committed_out_of_id_order_are_synced_once(self):
+        fields = {"user": self.user, "stock": self.stock, "side": "buy", "order_type": "limit", "quantity": 1}
+        later = Order.objects.create(id=100, limit_price=Decimal("50"), **fields)
+        self.cycle(100)
+        # Given a lower id, but committed after the sync that saw `later`
+        late = Order.objects.create(id=50, limit_price=Decimal("60"), **fields)
+        self.cycle(100)
+        self.cycle(100)
+        self.assertEqual(
+            orders.engine.books[self.stock.id].below, [(Decimal("50"), later.id), (Decimal("60"), late.id)]
+        )
+
+    def test_fetch_cycle_runs_engine_and_engine_resyncs(self):
+        self.cycle(100)  # engine has synced
+        order = self.order("buy", "limit", limit=Decimal("99"))
+        scheduler.fetch_prices_job(FakeQuoteProvider({"ACME": 98}))
+        order.refresh_from_db()
+        self.assertEqual(order.status, "filled")
+
+    def test_place_and_cancel_views(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse("place_order"), {"symbol": "acme", "side": "buy", "order_type": "stop", "quantity": 2, "stop_price": "120"})
+        order = Order.objects.get()
+        self.assertEqual((order.stock, order.order_type, order.stop_price, order.limit_price), (self.stock, "stop", 120, None))
+
+        resp = self.client.post(reverse("place_order"), {"symbol": "ACME", "side": "buy", "order_type": "limit", "quantity": 1}, follow=True)
+        self.assertContains(resp, "A limit price is required")
+        self.assertEqual(Order.objects.count(), 1)
+
+        self.client.post(reverse("cancel_order", args=[order.id]))
+        order.refresh_from_db()
+        self.assertEqual(order.status, "cancelled")
+
+
+class BasketOrderTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.stocks = [Stock.objects.create(name=f"Stock {i}", symbol=f"S{i:03d}") for i in range(30)]
+        LatestQuote.objects.bulk_create([LatestQuote(stock=s, price=10, timestamp=now) for s in self.stocks])
+        self.user = make_user(balance=1000)
+        self.client.force_login(self.user)
+
+    def basket(self, *legs):
+        return self.client.post(
+            reverse("basket_order"),
+            json.dumps({"legs": [{"symbol": sym, "side": side, "quantity": qty} for sym, side, qty in legs]}),
+            content_type="application/json",
+        )
+
+    def test_rebalance_in_one_request(self):
+        Position.objects.create(user=self.user, stock=self.stocks[0], quantity=10, price=8)
+        resp = self.basket(("S000", "sell", 10), ("S001", "buy", 5), ("s002", "buy", 3), ("S001", "buy", 5))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(Decimal(resp.json()["balance"]), Decimal("970.00"))
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).balance, Decimal("970.00"))
+        self.assertEqual(
+            dict(Position.objects.filter(user=self.user).values_list("stock__symbol", "quantity")),
+            {"S001": 10, "S002": 3},
+        )
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 4)
+
+    def test_basket_opens_new_positions(self):
+        resp = self.basket(("S003", "buy", 4), ("S004", "buy", 2), ("S004", "sell", 2))
+        self.assertEqual(resp.status_code, 200)
+        # S004 was opened and closed again: no empty row is left behind
+        self.assertEqual(
+            list(Position.objects.filter(user=self.user).values_list("stock__symbol", "quantity", "price")),
+            [("S003", 4, Decimal("10.00"))],
+        )
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).balance, Decimal("960.00"))
+
+    def test_query_count_is_independent_of_leg_count(self):
+        def count(legs):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.basket(*legs).status_code, 200)
+            return len(ctx.captured_queries)
+        Position.objects.create(user=self.user, stock=self.stocks[0], quantity=1, price=10)
+        Position.objects.create(user=self.user, stock=self.stocks[1], quantity=1, price=10)
+        few = count([("S000", "buy", 1), ("S001", "sell", 1)])
+        many = count([(f"S{i:03d}", "buy", 1) for i in range(2, 22)] + [("S000", "sell", 2)])
+        self.assertEqual(few, many)
+
+    def test_all_or_nothing(self):
+        Position.objects.create(user=self.user, stock=self.stocks[0], quantity=1, price=10)
+        for legs, error in (
+            ([("S000", "sell", 1), ("S001", "buy", 200)], "Insufficient balance"),
+            ([("S001", "buy", 1), ("S000", "sell", 2)], "Insufficient holdings"),
+            ([("S001", "buy", 1), ("NOPE", "buy", 1)], "Unknown symbol: NOPE"),
+            ([("S001", "hold", 1)], "side must be buy or sell"),
+        ):
+            resp = self.basket(*legs)
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn(error, resp.json()["error"])
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).balance, 1000)
+        self.assertEqual(list(Position.objects.values_list("quantity", flat=True)), [1])
+
+
+class ConcurrentTradeTests(TransactionTestCase):
+    """Many threads buying for one account that can afford only half of the buys."""
+    threads, trades_per_thread = 8, 6
+
+    def setUp(self):
+        self.stock = Stock.objects.create(name="Acme", symbol="ACME")
+        LatestQuote.objects.create(stock=self.stock, price=10, timestamp=timezone.now())
+        self.affordable = self.threads * self.trades_per_thread // 2
+        self.user = make_user(balance=10 * self.affordable)
+
+    def hammer(self):
+        errors = []
+
+        def retry(call, *args, **kwargs):
+            while True:
+                try:
+                    return call(*args, **kwargs)
+                except OperationalError:
+                    # The in-memory test database reports "locked" instead of waiting
+                    time.sleep(0.001)
+
+        def buy():
+            # The view itself, without session middleware writing to the
+            # database; the user is loaded per request, as the auth middleware does
+            request = RequestFactory().post(reverse("trade"), {"buy": "ACME", "quantity": 1})
+            request.user = CustomUser.objects.get(pk=self.user.pk)
+            request._messages = CookieStorage(request)
+            return views.trade_view(request)
+
+        def worker():
+            try:
+                for _ in range(self.trades_per_thread):
+                    retry(buy)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        self.assertEqual(errors, [])
+        return time.perf_counter() - start
+
+    def test_concurrent_buys_never_overdraw(self):
+        self.hammer()
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).balance, 0)
+        self.assertEqual(Transaction.objects.count(), self.affordable)
+        self.assertEqual(Position.objects.get().quantity, self.affordable)
+
+    def test_rejected_buy_stops_at_the_debit(self):
+        Position.objects.create(user=self.user, stock=self.stock, quantity=1, price=10)
+        CustomUser.objects.filter(pk=self.user.pk).update(balance=5)
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse("trade"), {"buy": "ACME", "quantity": 1})
+        tables = (Transaction._meta.db_table, Position._meta.db_table)
+        writes = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith(("INSERT", "UPDATE")) and any(t in q["sql"] for t in tables)]
+        self.assertEqual(writes, [])
+        self.assertEqual(Position.objects.get().quantity, 1)
+
+    def test_rejected_buy_leaves_nothing_behind(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse("trade"), {"buy": "ACME", "quantity": self.affordable + 1}, follow=True)
+        self.assertContains(resp, "Insufficient balance")
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(Position.objects.exists())
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).balance, 10 * self.affordable)
+
+
+class PriceRollupTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.stock = Stock.objects.create(name="Acme", symbol="ACME")
+        start = self.now.replace(minute=0, second=0, microsecond=0)
+        # A sample every 30 minutes for the last 120 days
+        PriceHistory.objects.bulk_create(
+            [
+                PriceHistory(stock=self.stock, price=100 + (i * 7) % 13, timestamp=start - timedelta(minutes=30 * i))
+                for i in range(120 * 48)
+            ],
+            batch_size=2000,
+        )
+
+    def bars(self, bucket_seconds, days):
+        # On an hour boundary, so the first hour isn't cut short before compaction
+        start = (self.now - timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+        return rollups.rebucket(*charts.load_bars(self.stock.id, start=start), bucket_seconds)
+
+    def test_compaction_keeps_bars_and_recent_samples(self):
+        # Hourly bars only go back as far as they are kept
+        daily, hourly = self.bars(rollups.DAY, 365), self.bars(rollups.HOUR, 80)
+        counts = rollups.compact_prices(self.now)
+
+        self.assertGreater(counts["hourly_rolled"], 0)
+        self.assertEqual(PriceHistory.objects.filter(timestamp__lt=self.now - timedelta(days=8)).count(), 0)
+        self.assertFalse(PriceHourly.objects.filter(bucket__lt=self.now - timedelta(days=91)).exists())
+        self.assertTrue(PriceDaily.objects.exists())
+        # Charts read the same OHLC bars from the rollups as from raw samples
+        for before, after in zip(daily + hourly, self.bars(rollups.DAY, 365) + self.bars(rollups.HOUR, 80)):
+            np.testing.assert_allclose(before, after)
+
+        self.assertEqual(rollups.compact_prices(self.now), dict.fromkeys(counts, 0))
+
+    def test_late_sample_merges_into_existing_bar(self):
+        rollups.compact_prices(self.now)
+        bar = PriceHourly.objects.order_by("-bucket").first()
+        PriceHistory.objects.create(stock=self.stock, price=500, timestamp=bar.bucket + timedelta(minutes=59))
+        rollups.compact_prices(self.now)
+        merged = PriceHourly.objects.get(pk=bar.pk)
+        self.assertEqual((merged.open, merged.high, merged.close), (bar.open, 500, 500))
+
+    def test_recent_window_reads_raw_samples_only(self):
+        rollups.compact_prices(self.now)
+        start = self.now - timedelta(days=1)
+        with self.assertNumQueries(1):
+            x, _ = charts.load_series(self.stock.id, start=start)
+        self.assertEqual(len(x), PriceHistory.objects.filter(timestamp__gte=start).count())
+
+
+class ChunkedPriceRollupTests(PriceRollupTests):
+    """The rollup tests again, with completed periods packed into PriceChunk blobs."""
+    def setUp(self):
+        patcher = mock.patch.object(series, "PRICE_STORAGE", "chunks")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def test_recent_window_reads_raw_samples_only(self):
+        start = self.now - timedelta(days=3)
+        before = charts.load_series(self.stock.id, start=start)
+        rollups.compact_prices(self.now)
+        self.assertTrue(PriceChunk.objects.exists())
+        # Packed chunks, then the rows of the current period
+        with self.assertNumQueries(2):
+            after = charts.load_series(self.stock.id, start=start)
+        np.testing.assert_array_equal(before, after)
+
+
+class PriceChunkTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(series, "PRICE_STORAGE", "chunks")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.stock = Stock.objects.create(name="Acme", symbol="ACME")
+        # Chunks keep whole seconds
+        self.now = timezone.now().replace(microsecond=0)
+
+    def test_encode_round_trip(self):
+        t = np.array([1_700_000_000, 1_700_001_500, 1_700_003_000], dtype=np.int64)
+        cents = np.array([12_345, 12_301, 99_999_999], dtype=np.int64)
+        decoded = series.decode(series.encode(t, cents), 3)
+        np.testing.assert_array_equal(decoded[0], t)
+        np.testing.assert_array_equal(decoded[1], cents)
+
+    def test_seal_packs_completed_periods_and_merges_late_rows(self):
+        PriceHistory.objects.bulk_create(
+            [
+                PriceHistory(stock=self.stock, price=Decimal("100.25") + i, timestamp=self.now - timedelta(hours=6 * i))
+                for i in range(60)
+            ]
+        )
+        before = series.load_raw(self.stock.id)
+        packed = series.seal_chunks([self.stock.id], self.now)
+        current = datetime.fromtimestamp(series.chunk_start(int(self.now.timestamp())), tz=dt_timezone.utc)
+        self.assertEqual(PriceHistory.objects.count(), 60 - packed)
+        self.assertFalse(PriceHistory.objects.filter(timestamp__lt=current).exists())
+        np.testing.assert_array_equal(before, series.load_raw(self.stock.id))
+
+        # A late row for a sealed period, and a re-sent sample with a new price
+        first = PriceChunk.objects.order_by("start").first()
+        late = first.start + timedelta(seconds=1)
+        resent = datetime.fromtimestamp(int(series.decode(bytes(first.data), first.samples)[0][0]), tz=dt_timezone.utc)
+        PriceHistory.objects.create(stock=self.stock, price=1, timestamp=late)
+        PriceHistory.objects.create(stock=self.stock, price=2, timestamp=resent)
+        series.seal_chunks([self.stock.id], self.now)
+        chunk = PriceChunk.objects.get(pk=first.pk)
+        t, cents = series.decode(bytes(chunk.data), chunk.samples)
+        self.assertEqual(chunk.samples, first.samples + 1)
+        self.assertEqual(list(t), sorted(t))
+        self.assertEqual(cents[list(t).index(int(late.timestamp()))], 100)
+        self.assertEqual(cents[list(t).index(int(resent.timestamp()))], 200)
+
+
+class PortfolioAnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        fragments.fragments.clear()
+        self.today = analytics._today()
+        self.stock = Stock.objects.create(name="Acme", symbol="ACME")
+        noon = lambda day: datetime.fromtimestamp(day * analytics.DAY + 43200, tz=dt_timezone.utc)
+        # Bought 10 at 10 three days ago; closes 10, 12, 9, then 11 today
+        PriceHistory.objects.bulk_create(
+            [PriceHistory(stock=self.stock, price=p, timestamp=noon(self.today - 3 + i)) for i, p in enumerate([10, 12, 9, 11])]
+        )
+        LatestQuote.objects.create(stock=self.stock, price=11, timestamp=noon(self.today))
+        self.user = make_user(balance=9900)
+        Transaction.objects.create(user=self.user, stock=self.stock, quantity=10, price=10, side="buy")
+        Transaction.objects.update(executed_at=noon(self.today - 3))
+        Position.objects.create(user=self.user, stock=self.stock, quantity=10, price=10, current_price=11)
+
+    def test_replay_and_stats(self):
+        state = analytics.history(self.user.id, self.user.balance)
+        self.assertEqual(state["worth"], [10000, 10020, 9990])
+        stats = analytics.summarize(state, Decimal("10010"))
+        self.assertAlmostEqual(stats["change_pct"], (10010 / 9990 - 1) * 100)
+        self.assertAlmostEqual(stats["max_drawdown"], 9990 / 10020 - 1)
+        returns = np.array([10020 / 10000, 9990 / 10020, 10010 / 9990]) - 1
+        self.assertAlmostEqual(stats["volatility"], returns.std(ddof=1) * np.sqrt(365))
+        self.assertAlmostEqual(stats["sharpe"], returns.mean() / returns.std(ddof=1) * np.sqrt(365))
+
+    def test_new_day_extends_cached_history(self):
+        analytics.history(self.user.id, self.user.balance)
+        with mock.patch.object(analytics, "_today", return_value=self.today + 1):
+            # Only today's prices for the one stock held; the ledger isn't read again
+            with self.assertNumQueries(1):
+                state = analytics.history(self.user.id, self.user.balance)
+        self.assertEqual(state["worth"], [10000, 10020, 9990, 10010])
+
+    def test_trade_replays_ledger(self):
+        analytics.history(self.user.id, self.user.balance)
+        self.client.force_login(self.user)
+        self.client.post(reverse("trade"), {"sell": "ACME", "quantity": 10})
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 10010)
+        state = analytics.history(self.user.id, self.user.balance)
+        self.assertEqual(state["holdings"], {self.stock.id: 0})
+        self.assertEqual(state["worth"], [10000, 10020, 9990])
+
+    def test_dashboard_shows_daily_change(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse("dashboard"))
+        self.assertContains(resp, "Your portfolio grew 0.2% today!")
+        data = self.client.get(reverse("portfolio_analytics_api")).json()
+        self.assertEqual(data["worth"], [10000, 10020, 9990, 10010])
+
+
+class LiveQuoteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.stocks = [Stock.objects.create(name=f"Stock {i}", symbol=f"S{i:03d}") for i in range(3)]
+        LatestQuote.objects.bulk_create([LatestQuote(stock=s, price=10, timestamp=now) for s in self.stocks])
+
+    def events(self, stream):
+        return [chunk for chunk in stream if chunk.startswith("id:")]
+
+    def test_fetch_cycle_publishes_changed_quotes_only(self):
+        scheduler.fetch_prices_job(FakeQuoteProvider({"S000": 10, "S001": 12.5}))
+        seq, diffs = live.pending(0)
+        self.assertEqual(seq, 1)
+        self.assertEqual(diffs[0][1]["q"], {"S001": 12.5})
+
+        scheduler.fetch_prices_job(FakeQuoteProvider({"S000": 10, "S001": 12.5}))
+        self.assertEqual(live.current_seq(), 1)
+
+    def test_reconnect_replays_missed_diffs(self):
+        now = timezone.now()
+        live.publish_quotes({"S000": Decimal("11")}, now)
+        live.publish_quotes({"S001": Decimal("12")}, now)
+        events = self.events(live.QuoteStream("0", duration=0))
+        self.assertEqual(len(events), 1)  # both diffs in one chunk
+        self.assertIn("id: 1\nevent: quotes\ndata: {", events[0])
+        self.assertIn('"q":{"S001":12.0}', events[0])
+
+        # A new client starts from the current diff
+        self.assertEqual(self.events(live.QuoteStream(duration=0)), [])
+
+        # Diffs that have expired can't be replayed: reload instead
+        cache.delete(live.DIFF_KEY.format(1))
+        self.assertIn("event: reload", self.events(live.QuoteStream("0", duration=0))[0])
+
+    def test_poll_view(self):
+        url = reverse("price_updates")
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(make_user())
+        live.publish_quotes({"S002": Decimal("9.5")}, timezone.now())
+
+        self.assertEqual(self.client.get(url).json(), {"seq": 1, "quotes": []})
+        data = self.client.get(url, {"after": 0}).json()
+        self.assertEqual(data["seq"], 1)
+        self.assertEqual(data["quotes"][0]["q"], {"S002": 9.5})
+        self.assertEqual(self.client.get(url, {"after": 1}).json()["quotes"], [])
+        self.assertEqual(self.client.get(url, {"after": "x"}).status_code, 400)
+
+        cache.delete(live.DIFF_KEY.format(1))
+        self.assertTrue(self.client.get(url, {"after": 0}).json()["reload"])
+
+    def test_stream_view(self):
+        use_async_views(self)
+        live.publish_quotes({"S002": Decimal("9.5")}, timezone.now())
+
+        async def get():
+            return await self.async_client.get(reverse("price_stream"), headers={"Last-Event-ID": "0"})
+
+        self.assertEqual(async_to_sync(get)().status_code, 302)
+        self.async_client.force_login(make_user())
+        with mock.patch.object(live, "STREAM_SECONDS", 0):
+            resp = async_to_sync(get)()
+            self.assertEqual(resp["Content-Type"], "text/event-stream")
+            body = b"".join(resp.streaming_content).decode()
+        self.assertIn('id: 1\nevent: quotes\ndata: {"t":', body)
+
+    def test_async_stream(self):
+        live.publish_quotes({"S002": Decimal("9.5")}, timezone.now())
+
+        async def collect():
+            return [chunk async for chunk in live.QuoteStream("0", duration=0)]
+
+        self.assertIn('"q":{"S002":9.5}', "".join(async_to_sync(collect)()))
+
+
+def use_async_views(test):
+    """Serve the ASGI views for the rest of the test, as asgi.py does."""
+    def load_urls():
+        # The root URLconf keeps the included patterns, so it is reloaded too
+        importlib.reload(urls)
+        importlib.reload(importlib.import_module(django_settings.ROOT_URLCONF))
+        clear_url_caches()
+
+    settings = override_settings(ASYNC_VIEWS=True)
+    settings.enable()
+    test.addCleanup(load_urls)
+    test.addCleanup(settings.disable)
+    load_urls()
+
+
+class AsyncViewTests(TransactionTestCase):
+    """The ASGI dashboard and trade views; worker threads need real connections."""
+    def setUp(self):
+        cache.clear()
+        fragments.fragments.clear()
+        now = timezone.now()
+        self.stocks = [Stock.objects.create(name=f"Stock {i}", symbol=f"S{i:03d}") for i in range(60)]
+        LatestQuote.objects.bulk_create([LatestQuote(stock=s, price=10, timestamp=now) for s in self.stocks])
+        PriceHistory.objects.bulk_create([PriceHistory(stock=s, price=10, timestamp=now) for s in self.stocks])
+        self.user = make_user()
+        Position.objects.bulk_create(
+            [Position(user=self.user, stock=s, quantity=2, price=5, current_price=10) for s in self.stocks[:30]]
+        )
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+
+    def run_async(self, method, *args, **kwargs):
+        async def call():
+            return await getattr(self.async_client, method)(*args, **kwargs)
+        return async_to_sync(call)()
+
+    def get_async(self, *args, **kwargs):
+        return self.run_async("get", *args, **kwargs)
+
+    def test_urls_pick_async_views(self):
+        self.assertIs(resolve(reverse("dashboard")).func, views.dashboard_view)
+        use_async_views(self)
+        self.assertIs(resolve(reverse("dashboard")).func, views.dashboard_view_async)
+        self.assertIs(resolve(reverse("trade")).func, views.trade_view_async)
+
+    def test_async_dashboard_renders_same_tiles(self):
+        params = {"stock_symbol": "S050", "symbol": "S005", "position_page": 2}
+        sync = self.client.get(reverse("dashboard"), params)
+        fragments.fragments.clear()
+        use_async_views(self)
+        resp = self.get_async(reverse("dashboard"), params)
+        self.assertEqual(resp.status_code, 200)
+        for name in ("positions_tile", "stocks_tile", "orders_tile", "portfolio_amount", "total_worth"):
+            self.assertEqual(resp.context[name], sync.context[name])
+
+    def test_dashboard_streams_only_under_asgi(self):
+        self.assertNotContains(self.client.get(reverse("dashboard")), "data-stream=")
+        with self.assertRaises(NoReverseMatch):
+            reverse("price_stream")
+        use_async_views(self)
+        self.assertContains(self.get_async(reverse("dashboard")), 'data-stream="/api/prices/stream/"')
+
+    def test_loader_threads_keep_their_connections(self):
+        def load():
+            Stock.objects.count()
+            return threading.current_thread().name, connection.connection
+
+        async def run():
+            return [await views._off_thread(load) for _ in range(2 * views.LOADER_THREADS)]
+
+        with mock.patch.object(sqlite_backend.DatabaseWrapper, "close", autospec=True) as close:
+            seen = async_to_sync(run)()
+        close.assert_not_called()
+        # One connection per loader thread, reused across loads
+        threads = {name for name, _ in seen}
+        self.assertEqual(len(set(seen)), len(threads))
+        self.assertTrue(all(name.startswith("dashboard-loader") for name in threads))
+
+    def test_async_views_require_login(self):
+        use_async_views(self)
+        self.async_client.logout()
+        resp = self.get_async(reverse("dashboard"))
+        self.assertRedirects(resp, f"/login/?next={reverse('dashboard')}", fetch_redirect_response=False)
+
+    def test_async_trade(self):
+        use_async_views(self)
+        resp = self.run_async("post", reverse("trade"), {"buy": "S040", "quantity": 5})
+        self.assertRedirects(resp, f"{reverse('dashboard')}?from=stocks", fetch_redirect_response=False)
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).balance, 10000 - 50)
+        self.assertEqual(Position.objects.get(user=self.user, stock=self.stocks[40]).quantity, 5)
+
+        self.run_async("post", reverse("trade"), {"sell": "NOPE", "quantity": 1})
+        resp = self.get_async(reverse("dashboard"), {"from": "stocks"})
+        self.assertContains(resp, "Unknown symbol: NOPE")
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, "set RUN_BENCHMARKS=1 to run benchmarks")
+class StockSearchBenchmark(TestCase):
+    def test_query_latency_at_50k_symbols(self):
+        words = ["global", "holdings", "energy", "bio", "tech", "capital", "systems", "group", "pharma", "retail"]
+        rows = [(i, f"{chr(65 + i % 26)}{chr(65 + i // 26 % 26)}{i:05d}", f"{words[i % 10]} {words[i // 10 % 10]} Corp {i}") for i in range(50_000)]
+        start = time.perf_counter()
+        index = search.StockSearchIndex(rows)
+        build = time.perf_counter() - start
+
+        queries = ["a", "ab", "abc", "ab001", "glo", "tech sys", "pharma group", "zz", "retail"]
+        timings = []
+        for q in queries * 20:
+            start = time.perf_counter()
+            index.search(q)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print(f"\n[bench] 50k symbols: build {build * 1000:.0f}ms, "
+              f"query p50 {timings[len(timings) // 2] * 1e6:.0f}us, p90 {timings[int(len(timings) * 0.9)] * 1e6:.0f}us")
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, "set RUN_BENCHMARKS=1 to run benchmarks")
+class PositionUpdateBenchmark(TestCase):
+    """Regression benchmark: 10k users x 50 positions over 957 stocks."""
+
+    @classmethod
+    def setUpTestData(cls):
+        n_stocks, n_users, per_user = 957, 10_000, 50
+        stocks = Stock.objects.bulk_create([Stock(name=f"Stock {i}", symbol=f"S{i:04d}") for i in range(n_stocks)])
+        users = CustomUser.objects.bulk_create(
+            [CustomUser(email=f"u{i}@example.com", username=f"u{i}") for i in range(n_users)], batch_size=2000
+        )
+        Position.objects.bulk_create(
+            [
+                Position(user=u, stock=stocks[(i * 7 + j * 19) % n_stocks], quantity=1, price=1)
+                for i, u in enumerate(users) for j in range(per_user)
+            ],
+            batch_size=5000,
+        )
+        cls.prices = {s.symbol: Decimal("101.50") for s in stocks}
+        cls.ids = {s.symbol: s.id for s in stocks}
+
+    def test_update_positions(self):
+        start = time.perf_counter()
+        for symbol, price in self.prices.items():
+            Position.objects.filter(stock__symbol=symbol).update(current_price=price)
+        per_symbol = time.perf_counter() - start
+
+        start = time.perf_counter()
+        updated = scheduler.update_position_prices({self.ids[sym]: p for sym, p in self.prices.items()})
+        set_based = time.perf_counter() - start
+
+        self.assertEqual(updated, 500_000)
+        print(f"\n[bench] 500k positions: per-symbol loop {per_symbol:.2f}s, set-based {set_based:.2f}s")
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, "set RUN_BENCHMARKS=1 to run benchmarks")
+class OrderTriggerBenchmark(TestCase):
+    """100k resting orders over 500 stocks; each cycle crosses about 1% of them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        n_stocks, n_users, n_orders = 500, 1000, 100_000
+        cls.stocks = Stock.objects.bulk_create([Stock(name=f"Stock {i}", symbol=f"S{i:04d}") for i in range(n_stocks)])
+        users = CustomUser.objects.bulk_create(
+            [CustomUser(email=f"u{i}@example.com", username=f"u{i}", balance=10**9) for i in range(n_users)]
+        )
+        rng = np.random.default_rng(7)
+        limits = rng.uniform(50, 99.9, n_orders).round(2)
+        Order.objects.bulk_create(
+            [
+                Order(user=users[i % n_users], stock=cls.stocks[i % n_stocks], side="buy", order_type="limit",
+                      quantity=1, limit_price=Decimal(str(limits[i])))
+                for i in range(n_orders)
+            ],
+            batch_size=5000,
+        )
+        # Resting: placed well before the sync window
+        Order.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+    def test_cycle_time(self):
+        engine = orders.TriggerEngine()
+        start = time.perf_counter()
+        engine.sync()
+        sync = time.perf_counter() - start
+        for price in ("99.50", "99.00"):
+            start = time.perf_counter()
+            filled = engine.run({s.id: Decimal(price) for s in self.stocks})
+            print(f"\n[bench] 100k orders: initial sync {sync * 1000:.0f}ms, "
+                  f"cycle at {price} filled {filled} in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, "set RUN_BENCHMARKS=1 to run benchmarks")
+class FetchBenchmark(FakeFinnhubMixin, TestCase):
+    def test_cycle_wall_clock(self):
+        symbols = [f"S{i:04d}" for i in range(957)]
+        # Quota high enough that latency, not the limiter, dominates
+        limiter_args = {"calls_per_minute": 60000, "burst": 50, "quota_per_minute": 60050}
+        print(f"\n[bench] at the default quota a cycle needs ~{FinnhubProvider().estimate_seconds(len(symbols)):.0f}s")
+        for workers in (1, 4, 16):
+            start = time.perf_counter()
+            provider = FinnhubProvider(**limiter_args, max_workers=workers)
+            prices = provider.fetch_many(symbols)
+            elapsed = time.perf_counter() - start
+            self.assertEqual(len(prices), len(symbols))
+            print(f"\n[bench] fetch {len(symbols)} symbols, {workers:>2} workers: {elapsed:.2f}s")
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, "set RUN_BENCHMARKS=1 to run benchmarks")
+class AsyncDashboardBenchmark(TransactionTestCase):
+    """Uncached dashboard latency, WSGI view vs ASGI view: 300 positions, two 1Y charts."""
+    requests = 50
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        stocks = Stock.objects.bulk_create([Stock(name=f"Stock {i}", symbol=f"S{i:04d}") for i in range(1000)])
+        LatestQuote.objects.bulk_create([LatestQuote(stock=s, price=10, timestamp=now) for s in stocks])
+        PriceHistory.objects.bulk_create(
+            [
+                PriceHistory(stock=s, price=10 + i % 7, timestamp=now - timedelta(minutes=30 * i))
+                for s in stocks[:2] for i in range(17_000)
+            ],
+            batch_size=5000,
+        )
+        user = make_user()
+        Position.objects.bulk_create([Position(user=user, stock=s, quantity=1, price=1) for s in stocks[:300]])
+        self.params = {"symbol": "S0000", "stock_symbol": "S0001", "position_period": "1Y", "stock_period": "1Y"}
+        self.client.force_login(user)
+        self.async_client.force_login(user)
+
+    def timings(self, get):
+        times = []
+        for _ in range(self.requests):
+            fragments.fragments.clear()
+            start = time.perf_counter()
+            self.assertEqual(get(reverse("dashboard"), self.params).status_code, 200)
+            times.append(time.perf_counter() - start)
+        return np.percentile(times, [50, 99]) * 1000
+
+    def test_dashboard_latency(self):
+        wsgi = self.timings(self.client.get)
+        use_async_views(self)
+
+        async def get_async(*args):
+            return await self.async_client.get(*args)
+
+        asgi = self.timings(lambda *args: async_to_sync(get_async)(*args))
+        print(f"\n[bench] dashboard p50/p99: WSGI {wsgi[0]:.1f}/{wsgi[1]:.1f}ms, ASGI {asgi[0]:.1f}/{asgi[1]:.1f}ms")
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, "set RUN_BENCHMARKS=1 to run benchmarks")
+class PriceChunkBenchmark(TestCase):
+    """A year of 25-minute samples for 20 stocks, as rows and as weekly chunks."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.now = timezone.now()
+        stocks = Stock.objects.bulk_create([Stock(name=f"Stock {i}", symbol=f"S{i:02d}") for i in range(20)])
+        rng = np.random.default_rng(0)
+        for stock in stocks:
+            prices = np.round(100 + np.cumsum(rng.normal(0, 0.2, 21_024)), 2)
+            PriceHistory.objects.bulk_create(
+                [
+                    PriceHistory(stock=stock, price=Decimal(f"{p:.2f}"), timestamp=cls.now - timedelta(minutes=25 * i))
+                    for i, p in enumerate(prices)
+                ],
+                batch_size=5000,
+            )
+        cls.stock_id = stocks[0].id
+
+    def table_bytes(self, model):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT SUM(pgsize) FROM dbstat JOIN sqlite_master m ON dbstat.name = m.name WHERE m.tbl_name = %s",
+                [model._meta.db_table],
+            )
+            return cursor.fetchone()[0] or 0
+
+    def read_ms(self, start):
+        times = []
+        for _ in range(20):
+            started = time.perf_counter()
+            series.load_raw(self.stock_id, start=start)
+            times.append(time.perf_counter() - started)
+        return np.median(times) * 1000
+
+    def test_storage_and_read(self):
+        year_ago = self.now - timedelta(days=365)
+        samples = PriceHistory.objects.count()
+        row_bytes, row_ms = self.table_bytes(PriceHistory), self.read_ms(year_ago)
+        with mock.patch.object(series, "PRICE_STORAGE", "chunks"):
+            series.seal_chunks(list(Stock.objects.values_list("id", flat=True)), self.now)
+            chunk_bytes = self.table_bytes(PriceChunk) + self.table_bytes(PriceHistory)
+            chunk_ms = self.read_ms(year_ago)
+        print(
+            f"\n[bench] {samples} samples: rows {row_bytes / samples:.1f} B/sample, 1Y read {row_ms:.1f}ms; "
+            f"chunks {chunk_bytes / samples:.1f} B/sample, 1Y read {chunk_ms:.1f}ms"
+        )
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, "set RUN_BENCHMARKS=1 to run benchmarks")
+class LeaderboardBenchmark(TestCase):
+    """100k scores: rebuilding the ranking, rank lookups and moving one user."""
+
+    def test_rank_lookups(self):
+        rng = np.random.default_rng(0)
+        worths = np.round(rng.lognormal(9, 1, 100_000), 2)
+        board = leaderboard.Leaderboard((i, Decimal(f"{w:.2f}")) for i, w in enumerate(worths))
+        started = time.perf_counter()
+        board = leaderboard.Leaderboard((i, Decimal(f"{w:.2f}")) for i, w in enumerate(worths))
+        build_ms = (time.perf_counter() - started) * 1000
+
+        users = rng.integers(0, len(worths), 10_000).tolist()
+        started = time.perf_counter()
+        for user_id in users:
+            board.rank(user_id)
+        rank_us = (time.perf_counter() - started) / len(users) * 1e6
+        started = time.perf_counter()
+        for user_id in users:
+            board.set(user_id, Decimal("12345.67"))
+        set_us = (time.perf_counter() - started) / len(users) * 1e6
+        print(f"\n[bench] 100k users: build {build_ms:.0f}ms, rank {rank_us:.1f}us, move {set_us:.1f}us")
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, "set RUN_BENCHMARKS=1 to run benchmarks")
+class BacktestBenchmark(TestCase):
+    """1000 symbols x 1 year, stored as compaction leaves it: daily bars, then hourly bars, then 25-minute samples."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.now = timezone.now()
+        stocks = Stock.objects.bulk_create([Stock(name=f"Stock {i}", symbol=f"S{i:04d}") for i in range(1000)])
+        rng = np.random.default_rng(0)
+        hour_cut = rollups._floor(cls.now - timedelta(days=rollups.RAW_RETENTION_DAYS), rollups.HOUR)
+        day_cut = rollups._floor(cls.now - timedelta(days=rollups.HOURLY_RETENTION_DAYS), rollups.DAY)
+        days = [day_cut - timedelta(days=i) for i in range(1, 366 - rollups.HOURLY_RETENTION_DAYS)]
+        hours = [hour_cut - timedelta(hours=i) for i in range(1, int((hour_cut - day_cut).total_seconds()) // 3600 + 1)]
+        samples = [cls.now - timedelta(minutes=25 * i) for i in range(int((cls.now - hour_cut).total_seconds()) // 1500)]
+        for stock in stocks:
+            p = lambda n: np.round(100 + np.cumsum(rng.normal(0, 0.5, n)), 2)
+            bar = lambda model, when, price: model(stock=stock, bucket=when, open=price, high=price, low=price, close=price)
+            PriceDaily.objects.bulk_create([bar(PriceDaily, when, x) for when, x in zip(days, p(len(days)))])
+            PriceHourly.objects.bulk_create([bar(PriceHourly, when, x) for when, x in zip(hours, p(len(hours)))], batch_size=5000)
+            PriceHistory.objects.bulk_create(
+                [PriceHistory(stock=stock, price=x, timestamp=when) for when, x in zip(samples, p(len(samples)))]
+            )
+
+    def test_sweep(self):
+        started = time.perf_counter()
+        symbols, times, prices = backtest.load_matrix(end=self.now)
+        load_s = time.perf_counter() - started
+        timings = []
+        for name, strategy in backtest.STRATEGIES.items():
+            started = time.perf_counter()
+            backtest.run(prices, strategy(prices))
+            timings.append(f"{name} {(time.perf_counter() - started) * 1000:.0f}ms")
+        rows = PriceDaily.objects.count() + PriceHourly.objects.count() + PriceHistory.objects.count()
+        print(f"\n[bench] {len(symbols)} symbols x {len(times)} days ({rows} stored rows): load {load_s:.2f}s, {', '.join(timings)}")
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, "set RUN_BENCHMARKS=1 to run benchmarks")
+class LoadStocksBenchmark(TestCase):
+    """A 50k-symbol universe: the first load, then a reload with 10% renamed and 5% delisted."""
+
+    def test_load_and_reload(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "universe.csv")
+        symbols = [f"X{i:05d}" for i in range(50_000)]
+
+        def load(names):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("name,symbol,is_public\n")
+                f.writelines(f"{name},{symbol},True\n" for symbol, name in names.items() if name)
+            started = time.perf_counter()
+            report = universe.load_universe(universe.read_rows(path), remove_missing=True)
+            return time.perf_counter() - started, {key: len(value) for key, value in report.items()}
+
+        names = {symbol: f"Company {symbol}" for symbol in symbols}
+        first = load(names)
+        names.update({symbol: f"Renamed {symbol}" for symbol in symbols[::10]})
+        names.update({symbol: None for symbol in symbols[1::20]})
+        second = load(names)
+        print(f"\n[bench] 50k symbols: first load {first[0]:.2f}s {first[1]}, reload {second[0]:.2f}s {second[1]}")
+
+
+class SQLiteJournalModeTests(SimpleTestCase):
+    def test_journal_mode_is_set_once_not_per_connection(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            settings = {**connection.settings_dict, "NAME": os.path.join(tmp, "db.sqlite3")}
+            db = sqlite_backend.DatabaseWrapper(settings, alias="journal_mode_test")
+            db.ensure_connection()
+            mode = lambda: db.connection.execute("PRAGMA journal_mode").fetchone()[0]
+            try:
+                self.assertEqual(mode(), "delete")
+                self.assertTrue(sqlite_backend.set_journal_mode(db))
+                self.assertEqual(mode(), sqlite_backend.JOURNAL_MODE)
+                self.assertFalse(sqlite_backend.set_journal_mode(db))
+            finally:
+                db.close()
+
+    def test_in_memory_databases_are_left_alone(self):
+        self.assertFalse(sqlite_backend.set_journal_mode(connection))
+
+
+def _sqlite_connect(path, statements):
+    conn = sqlite3.connect(path, isolation_level=None, timeout=5)
+    for statement in statements:
+        conn.execute(statement)
+    return conn
+
+
+def _cycle_writer(path, statements, stocks, stop, results):
+    """
+    Fetch cycles back to back, as the scheduler writes them: the cycle's
+    price rows and a position UPDATE ... FROM in one transaction.
+    """
+    db = _sqlite_connect(path, statements)
+    cycles, n = [], 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        prices = [(i, 10 + n % 7 + i / 1000) for i in range(stocks)]
+        db.execute("BEGIN IMMEDIATE")
+        db.executemany("INSERT INTO pricehistory (stock_id, price, timestamp) VALUES (?, ?, ?)", [(i, p, f"cycle {n}") for i, p in prices])
+        for i in range(0, stocks, 400):
+            part = prices[i:i + 400]
+            db.execute(
+                f"UPDATE position SET current_price = v.column2 FROM (VALUES {', '.join(['(?, ?)'] * len(part))}) AS v "
+                "WHERE position.stock_id = v.column1",
+                [x for row in part for x in row],
+            )
+        db.execute("COMMIT")
+        cycles.append(time.perf_counter() - started)
+        n += 1
+    results.put(cycles)
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, "set RUN_BENCHMARKS=1 to run benchmarks")
+class SQLiteConcurrencyBenchmark(SimpleTestCase):
+    """
+    Dashboard position reads from 4 threads while another process runs
+    fetch cycles back to back (1000 prices, 100k positions), on a file
+    database: rollback journal vs the backend's pragmas.
+    """
+    stocks, users, per_user = 1000, 10_000, 10
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def run_mode(self, name, statements, seconds=4.0):
+        path = os.path.join(self.tmp.name, f"{name}.sqlite3")
+        conn = _sqlite_connect(path, statements)
+        conn.executescript("""
+            CREATE TABLE stock (id INTEGER PRIMARY KEY, symbol TEXT);
+            CREATE TABLE pricehistory (id INTEGER PRIMARY KEY, stock_id INTEGER, price REAL, timestamp TEXT);
+            CREATE INDEX ph_stock ON pricehistory (stock_id, timestamp);
+            CREATE TABLE position (id INTEGER PRIMARY KEY, user_id INTEGER, stock_id INTEGER, quantity INTEGER, price REAL, current_price REAL);
+            CREATE INDEX pos_user ON position (user_id);
+            CREATE INDEX pos_stock ON position (stock_id);
+        """)
+        rng = np.random.default_rng(0)
+        conn.execute("BEGIN")
+        conn.executemany("INSERT INTO stock VALUES (?, ?)", [(i, f"S{i}") for i in range(self.stocks)])
+        conn.executemany(
+            "INSERT INTO position (user_id, stock_id, quantity, price, current_price) VALUES (?, ?, 1, 10, 10)",
+            [(u, int(s)) for u in range(self.users) for s in rng.choice(self.stocks, self.per_user, replace=False)],
+        )
+        conn.execute("COMMIT")
+        conn.close()
+
+        stop, results = multiprocessing.Event(), multiprocessing.Queue()
+        writer = multiprocessing.Process(target=_cycle_writer, args=(path, statements, self.stocks, stop, results))
+        writer.start()
+        done, latencies, errors = threading.Event(), [], []
+
+        def reader(seed):
+            db = _sqlite_connect(path, statements)
+            pick = np.random.default_rng(seed)
+            while not done.is_set():
+                started = time.perf_counter()
+                try:
+                    db.execute(
+                        "SELECT s.symbol, p.quantity, p.quantity * COALESCE(p.current_price, p.price) FROM position p "
+                        "JOIN stock s ON s.id = p.stock_id WHERE p.user_id = ? ORDER BY s.symbol",
+                        [int(pick.integers(self.users))],
+                    ).fetchall()
+                    latencies.append(time.perf_counter() - started)
+                except sqlite3.OperationalError:
+                    errors.append(1)
+            db.close()
+
+        readers = [threading.Thread(target=reader, args=(i,)) for i in range(4)]
+        time.sleep(0.5)  # let the writer get going
+        for t in readers:
+            t.start()
+        time.sleep(seconds)
+        done.set()
+        for t in readers:
+            t.join()
+        stop.set()
+        cycles = results.get()
+        writer.join()
+        ms = np.array(latencies) * 1000
+        return (
+            f"{name}: reads p50 {np.percentile(ms, 50):.2f}ms p99 {np.percentile(ms, 99):.2f}ms max {ms.max():.0f}ms "
+            f"({len(ms)} ok, {len(errors)} locked), write cycles {np.median(cycles) * 1000:.0f}ms"
+        )
+
+    def test_reader_latency_during_writes(self):
+        rollback = self.run_mode("rollback", ["PRAGMA journal_mode = DELETE", "PRAGMA synchronous = FULL"])
+        tuned = self.run_mode("wal", ["PRAGMA journal_mode = WAL", *sqlite_backend.pragmas()])
+        print(f"\n[bench] {rollback}\n[bench] {tuned}")
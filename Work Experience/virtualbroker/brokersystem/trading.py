@@ -0,0 +1,185 @@
+import os
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from brokersystem.dbutils import bulk_update_values, chunks
+from brokersystem.fragments import bump_portfolio
+from brokersystem.models import CustomUser, Position, Stock, Transaction
+
+TWO_DP = Decimal("0.01")
+MAX_BASKET_LEGS = int(os.getenv("MAX_BASKET_LEGS", "100"))
+
+
+class TradeError(Exception):
+    """
+    A trade that cannot go ahead. Raised before anything is written (or
+    inside the transaction, which then rolls back).
+    """
+
+
+def money(value: Decimal) -> Decimal:
+    return value.quantize(TWO_DP, rounding=ROUND_HALF_UP)
+
+
+class PositionBook:
+    """
+    Fills applied in memory to already-locked Position rows, then written
+    back in bulk: one INSERT for new positions, one UPDATE per chunk of
+    changed ones, one DELETE for closed ones and one INSERT for the
+    Transaction rows.
+    """
+    def __init__(self, positions: Iterable[Position]):
+        self.positions: Dict[Tuple[int, int], Position] = {(p.user_id, p.stock_id): p for p in positions}
+        self.created: Dict[Tuple[int, int], Position] = {}
+        self.changed: Dict[Tuple[int, int], Position] = {}
+        self.deleted: List[int] = []
+        self.trades: List[Transaction] = []
+        self.now = timezone.now()
+
+    def held(self, user_id: int, stock_id: int) -> int:
+        pos = self.positions.get((user_id, stock_id))
+        return pos.quantity if pos else 0
+
+    def buy(self, user_id: int, stock_id: int, quantity: int, price: Decimal):
+        key = (user_id, stock_id)
+        pos = self.positions.get(key)
+        if pos is None:
+            pos = self.positions[key] = self.created[key] = Position(
+                user_id=user_id, stock_id=stock_id, quantity=0, price=price
+            )
+        # Weighted average cost update
+        new_qty = pos.quantity + quantity
+        pos.price = money((pos.price * pos.quantity + price * quantity) / new_qty)
+        pos.quantity = new_qty
+        self._touched(key, pos)
+        self._trade(user_id, stock_id, quantity, price, "buy")
+
+    def sell(self, user_id: int, stock_id: int, quantity: int, price: Decimal):
+        """
+        Callers check held() first; avg cost is unchanged on sell.
+        """
+        key = (user_id, stock_id)
+        pos = self.positions[key]
+        pos.quantity -= quantity
+        if pos.quantity == 0:
+            del self.positions[key]
+            self.changed.pop(key, None)
+            if self.created.pop(key, None) is None:
+                self.deleted.append(pos.id)
+        else:
+            self._touched(key, pos)
+        self._trade(user_id, stock_id, quantity, price, "sell")
+
+    def _touched(self, key, pos: Position):
+        pos.last_updated = self.now
+        if key not in self.created:
+            self.changed[key] = pos
+
+    def _trade(self, user_id, stock_id, quantity, price, side):
+        self.trades.append(Transaction(
+            user_id=user_id, stock_id=stock_id, quantity=quantity, price=price, side=side, executed_at=self.now,
+        ))
+
+    def save(self):
+        Transaction.objects.bulk_create(self.trades, batch_size=500)
+        # Closed positions go first: the same user and stock may be bought back in this batch
+        for ids in chunks(self.deleted):
+            Position.objects.filter(id__in=ids).delete()
+        Position.objects.bulk_create(self.created.values(), batch_size=500)
+        bulk_update_values(self.changed.values(), ["quantity", "price", "last_updated"])
+
+
+def parse_legs(raw) -> List[Tuple[str, str, int]]:
+    """
+    Validate basket legs given as [{"symbol", "side", "quantity"}, ...].
+    """
+    if not isinstance(raw, list) or not raw:
+        raise TradeError("legs must be a non-empty list.")
+    if len(raw) > MAX_BASKET_LEGS:
+        raise TradeError(f"A basket can have at most {MAX_BASKET_LEGS} legs.")
+    legs = []
+    for i, leg in enumerate(raw, 1):
+        try:
+            symbol = str(leg["symbol"]).strip().upper()
+            side = str(leg["side"]).strip().lower()
+            quantity = int(str(leg["quantity"]))
+        except (KeyError, TypeError, ValueError):
+            raise TradeError(f"Leg {i} needs a symbol, a side and an integer quantity.")
+        if side not in ("buy", "sell"):
+            raise TradeError(f"Leg {i}: side must be buy or sell.")
+        if quantity <= 0:
+            raise TradeError(f"Leg {i}: quantity must be a positive integer.")
+        legs.append((symbol, side, quantity))
+    return legs
+
+
+def execute_basket(user_id: int, legs: List[Tuple[str, str, int]]) -> dict:
+    """
+    Execute market legs at the latest prices, all or nothing: one query
+    resolves every stock with its latest quote, the affected positions are
+    locked together, the Transaction rows are bulk-inserted and the balance
+    is adjusted once, by a conditional UPDATE of the net cash flow.
+    Legs run in the order given, so a rebalance can sell before it buys.
+    """
+    symbols = {symbol for symbol, _, _ in legs}
+    quotes = {
+        symbol: (stock_id, price)
+        for stock_id, symbol, price in Stock.objects.filter(symbol__in=symbols).values_list(
+            "id", "symbol", "latest_quote__price"
+        )
+    }
+    for symbol in sorted(symbols):
+        if symbol not in quotes:
+            raise TradeError(f"Unknown symbol: {symbol}")
+        if quotes[symbol][1] is None:
+            raise TradeError(f"No price available for {symbol}.")
+
+    with transaction.atomic():
+        # Insert empty rows for the stocks bought first, as trade_view does,
+        # so concurrent first buys queue on the same lock instead of one
+        # failing on the unique constraint. Every one is bought below, or
+        # the basket rolls back.
+        bought = {quotes[symbol] for symbol, side, _ in legs if side == "buy"}
+        Position.objects.bulk_create(
+            [Position(user_id=user_id, stock_id=stock_id, quantity=0, price=money(price)) for stock_id, price in bought],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+        # Positions are locked first, in stock order, and the user row last:
+        # the same order as trade_view and the trigger engine
+        book = PositionBook(
+            Position.objects.select_for_update()
+            .filter(user_id=user_id, stock_id__in=[stock_id for stock_id, _ in quotes.values()])
+            .order_by("stock_id")
+        )
+
+        cash = Decimal("0.00")
+        fills = []
+        for symbol, side, quantity in legs:
+            stock_id, price = quotes[symbol]
+            price = money(price)
+            notional = money(price * quantity)
+            if side == "buy":
+                book.buy(user_id, stock_id, quantity, price)
+                cash -= notional
+            else:
+                if book.held(user_id, stock_id) < quantity:
+                    raise TradeError(f"Insufficient holdings to sell {quantity} {symbol}.")
+                book.sell(user_id, stock_id, quantity, price)
+                cash += notional
+            fills.append({"symbol": symbol, "side": side, "quantity": quantity, "price": price, "notional": notional})
+
+        # One conditional UPDATE: applied only if the balance covers the net cost
+        if not CustomUser.objects.filter(pk=user_id, balance__gte=-cash).update(balance=F("balance") + cash):
+            balance = CustomUser.objects.values_list("balance", flat=True).get(pk=user_id)
+            raise TradeError(f"Insufficient balance. The basket costs ${-cash} net but you only have ${balance}.")
+        book.save()
+        balance = CustomUser.objects.values_list("balance", flat=True).get(pk=user_id)
+
+    bump_portfolio(user_id)
+    return {"fills": fills, "cash": cash, "balance": balance}
+
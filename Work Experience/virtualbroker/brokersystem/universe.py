@@ -0,0 +1,122 @@
+import csv
+import json
+import os
+from typing import Dict, Iterator, List, Tuple
+
+from django.db import transaction
+
+from brokersystem import search
+from brokersystem.dbutils import chunks
+from brokersystem.models import Order, Position, Stock, Transaction
+
+# Stocks upserted per INSERT ... ON CONFLICT statement
+LOAD_BATCH = 500
+SYMBOL_MAX_LENGTH = Stock._meta.get_field("symbol").max_length
+NAME_MAX_LENGTH = Stock._meta.get_field("name").max_length
+_FALSE = {"false", "0", "no", "n", "f"}
+
+
+def read_rows(path: str) -> Iterator[dict]:
+    """
+    Stream {"name", "symbol", ...} records from a CSV file with a header
+    row, a JSON Lines file (.jsonl/.ndjson), or a JSON array (.json).
+    """
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if ext in (".jsonl", ".ndjson"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        elif ext == ".json":
+            yield from json.load(f)
+        else:
+            yield from csv.DictReader(f)
+
+
+def clean(row: dict):
+    """
+    (symbol, name) from one record, or None when the record is unusable or
+    marked as not public.
+    """
+    symbol = str(row.get("symbol") or "").strip().upper()
+    name = str(row.get("name") or "").strip()
+    if str(row.get("is_public", "true")).strip().lower() in _FALSE:
+        return None
+    if not symbol or not name or len(symbol) > SYMBOL_MAX_LENGTH:
+        return None
+    return symbol, name[:NAME_MAX_LENGTH]
+
+
+def _in_use(stock_ids: List[int]) -> set:
+    """
+    Ids among `stock_ids` that someone holds, has traded or has an order in;
+    deleting those would cascade into users' positions and ledgers.
+    """
+    used = set()
+    for ids in chunks(stock_ids):
+        for model in (Position, Transaction, Order):
+            used.update(model.objects.filter(stock_id__in=ids).values_list("stock_id", flat=True).distinct())
+    return used
+
+
+def load_universe(rows, remove_missing: bool = False, dry_run: bool = False) -> Dict[str, list]:
+    """
+    Make the Stock table match `rows` (records as from read_rows): new
+    symbols are inserted and renamed ones updated with batched upserts.
+    Symbols absent from `rows` are left alone unless remove_missing, which
+    deletes them (and their price history) unless still in use. One
+    transaction; only new or changed stocks are written.
+    Returns {"added", "changed", "removed", "kept", "missing", "skipped"}
+    symbol lists ("kept": missing but in use; "missing": absent but not
+    removed; "skipped": unusable or duplicate records).
+    """
+    report = {"added": [], "changed": [], "removed": [], "kept": [], "missing": [], "skipped": []}
+    existing: Dict[str, Tuple[int, str]] = {
+        symbol: (stock_id, name) for stock_id, symbol, name in Stock.objects.values_list("id", "symbol", "name")
+    }
+    seen = set()
+    batch: List[Stock] = []
+
+    def flush():
+        if batch and not dry_run:
+            Stock.objects.bulk_create(
+                batch, batch_size=LOAD_BATCH, update_conflicts=True, unique_fields=["symbol"], update_fields=["name"]
+            )
+        batch.clear()
+
+    with transaction.atomic():
+        for row in rows:
+            cleaned = clean(row)
+            if cleaned is None or cleaned[0] in seen:
+                report["skipped"].append(str(row.get("symbol") or "").strip())
+                continue
+            symbol, name = cleaned
+            seen.add(symbol)
+            current = existing.get(symbol)
+            if current is None:
+                report["added"].append(symbol)
+            elif current[1] != name:
+                report["changed"].append(symbol)
+            else:
+                continue
+            batch.append(Stock(symbol=symbol, name=name))
+            if len(batch) >= LOAD_BATCH:
+                flush()
+        flush()
+
+        missing = {stock_id: symbol for symbol, (stock_id, _) in existing.items() if symbol not in seen}
+        if not remove_missing:
+            report["missing"] = sorted(missing.values())
+        else:
+            used = _in_use(list(missing))
+            report["kept"] = sorted(missing[stock_id] for stock_id in used)
+            doomed = [stock_id for stock_id in missing if stock_id not in used]
+            report["removed"] = sorted(missing[stock_id] for stock_id in doomed)
+            if not dry_run:
+                for ids in chunks(doomed):
+                    Stock.objects.filter(id__in=ids).delete()
+
+    # bulk_create skips the signals that keep the search index current
+    if not dry_run and (report["added"] or report["changed"] or report["removed"]):
+        search.invalidate()
+    return report
@@ -1,14 +1,33 @@
+from django.conf import settings
 from django.urls import path
 from brokersystem import views
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 
+if settings.ASYNC_VIEWS:
+    dashboard_view, trade_view = views.dashboard_view_async, views.trade_view_async
+    # A sync event stream would hold a WSGI worker thread per open tab, so
+    # dashboards served under WSGI poll price_updates instead
+    stream_urls = [path("api/prices/stream/", views.price_stream_async, name="price_stream")]
+else:
+    dashboard_view, trade_view = views.dashboard_view, views.trade_view
+    stream_urls = []
+
 urlpatterns = [
     path("", views.home, name="home"),
     path("signup/", views.SignUp.as_view(), name="signup"),
     path("login/", views.login_view, name="login"),
     path("logout/", views.logout_view, name="logout"),
-    path("dashboard/", views.dashboard_view, name="dashboard"),
-    path("trade/", views.trade_view, name="trade")
+    path("dashboard/", dashboard_view, name="dashboard"),
+    path("trade/", trade_view, name="trade"),
+    path("trade/basket/", views.basket_order_view, name="basket_order"),
+    path("orders/", views.place_order_view, name="place_order"),
+    path("orders/<int:order_id>/cancel/", views.cancel_order_view, name="cancel_order"),
+    path("api/prices/updates/", views.price_updates, name="price_updates"),
+    *stream_urls,
+    path("api/portfolio/analytics/", views.portfolio_analytics_api, name="portfolio_analytics_api"),
+    path("api/leaderboard/", views.leaderboard_api, name="leaderboard_api"),
+    path("api/prices/<str:symbol>/", views.price_history_api, name="price_history_api"),
+    path("metrics", views.metrics_view, name="metrics"),
 ]
 
 urlpatterns += staticfiles_urlpatterns()
\ No newline at end of file
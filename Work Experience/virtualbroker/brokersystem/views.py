@@ -1,20 +1,47 @@
 import email
+from django.conf import settings
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.urls import reverse_lazy
 from django.views.generic import CreateView
-from .models import CustomUser, Position, Stock, PriceHistory, Transaction
-from .forms import CustomUserCreationForm
+from .models import CustomUser, Position, Stock, Transaction, LatestQuote, Order
+from .forms import CustomUserCreationForm, OrderForm
 from django.contrib.auth import authenticate, login, logout, get_user_model
 from django.shortcuts import redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponseRedirect
+from django.urls import reverse
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition, require_GET, require_POST
+from django.utils.dateparse import parse_datetime, parse_date
 from django.contrib import messages
 from django.utils.http import url_has_allowed_host_and_scheme
-from django.db.models import Sum, F, DecimalField, Value, ExpressionWrapper, Subquery, OuterRef, Q
+from django.db.models import F, DecimalField, Value, ExpressionWrapper
 from django.db.models.functions import Coalesce, Cast
 from decimal import Decimal, ROUND_HALF_UP
 from django.utils import timezone
-from django.db import transaction
+from django.db import close_old_connections, transaction
+from asgiref.sync import sync_to_async
+from .analytics import history, summarize
+from .demand import record_view
+from .charts import PERIODS, RESOLUTIONS, parse_period, chart_points, auto_resolution, stream_columns
+from .scheduler import cycle_interval_minutes
+from .search import get_index
+from .fragments import fragments, dashboard_key, bump_portfolio
+from .leaderboard import LEADERBOARD_SIZE, get_board, record_trade
+from .live import CLIENT_POLL_SECONDS, QuoteStream, current_seq, pending
+from . import metrics
+from .trading import TradeError, parse_legs, execute_basket
+from django.template.loader import render_to_string
+from django.core.paginator import Paginator
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import datetime as dt
+import functools
+import hashlib
+import hmac
+import json
 
 # Create your views here.
 def home(request):
@@ -68,8 +95,54 @@ def logout_view(request):
     messages.success(request, "You have been logged out successfully.")
     return redirect("home")
 
-@login_required
-def dashboard_view(request):
+STOCKS_PER_PAGE = 50
+POSITIONS_PER_PAGE = 25
+OPEN_ORDERS_SHOWN = 50
+
+def _page_links(request, param, page):
+    """
+    Query strings for a table's previous/next page links, keeping the rest of the dashboard state.
+    """
+    links = {}
+    for name, has, number in (
+        ("prev", page.has_previous, lambda: page.previous_page_number()),
+        ("next", page.has_next, lambda: page.next_page_number()),
+    ):
+        if has():
+            query = request.GET.copy()
+            query[param] = number()
+            query.pop("from", None)
+            links[name] = query.urlencode()
+    return links
+
+def _period_links(request, param, current):
+    """
+    Query strings for a chart's period buttons, keeping the rest of the dashboard state.
+    """
+    links = []
+    for label in PERIODS:
+        query = request.GET.copy()
+        query[param] = label
+        query.pop("from", None)
+        links.append({"label": label, "query": query.urlencode(), "active": label == current})
+    return links
+
+def _graph_data(symbol, chart_data, rgb):
+    return {
+        "title": symbol,
+        "datasets": [{
+            "label": symbol,
+            "data": chart_data,
+            "borderColor": f"rgb({rgb})",
+            "backgroundColor": f"rgba({rgb}, 0.1)",
+            "tension": 0.1
+        }]
+    }
+
+def _user_positions(user_id):
+    """
+    All of the user's positions in one query (symbol/total/qty/price).
+    """
     qty_dec = Cast(F("quantity"), output_field=DecimalField(max_digits=12, decimal_places=2))
 
     # Use current_price if available, otherwise fall back to average cost price
@@ -77,196 +150,347 @@ def dashboard_view(request):
         qty_dec * Coalesce(F("current_price"), F("price")),
         output_field=DecimalField(max_digits=24, decimal_places=2),
     )
+    return list(
+        Position.objects.filter(user_id=user_id)
+        .annotate(total=line_value)
+        .values(
+            "stock_id", "stock__symbol", "stock__name", "quantity", "price", "current_price", "total",
+            "stock__latest_quote__timestamp",
+        )
+        .order_by("stock__symbol")
+    )
 
-    total = (
-        Position.objects.filter(user=request.user)
-        .aggregate(total=Coalesce(Sum(line_value), Value(Decimal("0.00"))))["total"]
-        or Decimal("0.00")
+def _stock_page(stock_search, page_number):
+    """
+    Stocks matching the search (in-memory prefix index), one page at a time,
+    with latest price joined from LatestQuote (one row per stock).
+    """
+    stock_page = Paginator(get_index().search(stock_search), STOCKS_PER_PAGE).get_page(page_number)
+    page_ids = list(stock_page.object_list)
+    stocks_by_id = Stock.objects.filter(id__in=page_ids).annotate(
+        latest_price=Coalesce(
+            F("latest_quote__price"),
+            Value(Decimal("0.00")),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+        latest_timestamp=F("latest_quote__timestamp"),
+    ).in_bulk()
+    return stock_page, [stocks_by_id[i] for i in page_ids if i in stocks_by_id]
+
+def _open_orders(user_id):
+    """
+    Resting limit/stop orders, newest first.
+    """
+    return list(
+        Order.objects.filter(user_id=user_id, status__in=Order.OPEN_STATUSES)
+        .select_related("stock")
+        .order_by("-created_at")[:OPEN_ORDERS_SHOWN]
     )
 
+def _resolve_symbols(symbols):
+    return {
+        symbol: (stock_id, latest)
+        for stock_id, symbol, latest in Stock.objects.filter(symbol__in=symbols).values_list(
+            "id", "symbol", "latest_quote__timestamp"
+        )
+    }
+
+def _dashboard_plan(request):
+    """
+    The dashboard's queries as a generator. Each `yield` hands the driver a
+    dict of independent loaders and receives their results: first positions,
+    the stock page, open orders and the (cached) net-worth history, then
+    (only for selections on neither table) one lookup, then one price
+    history read per distinct chart. The finished context is the
+    generator's return value.
+    Fixed query plan, whatever the portfolio size.
+    """
+    user_id = request.user.id
+    balance = request.user.balance
+
     # Search parameters
     position_search = request.GET.get("position_search", "").strip()
     stock_search = request.GET.get("stock_search", "").strip()
     
     # Check if messages should be shown in specific tile
     from_tile = request.GET.get("from", "")
-    # Positions list for the tile (symbol/total/qty/price)
-    positions_qs = Position.objects.filter(user=request.user)
+
+    loaded = yield {
+        "positions": lambda: _user_positions(user_id),
+        "stocks": lambda: _stock_page(stock_search, request.GET.get("stock_page")),
+        "orders": lambda: _open_orders(user_id),
+        "history": lambda: history(user_id, balance),
+    }
+    all_positions = loaded["positions"]
+    stock_page, stocks = loaded["stocks"]
+    open_orders = loaded["orders"]
+
+    # Portfolio total summed from the position rows
+    total = sum((p["total"] for p in all_positions), Decimal("0.00"))
     
     # Apply position search filter
+    positions = all_positions
     if position_search:
-        positions_qs = positions_qs.filter(
-            Q(stock__symbol__icontains=position_search) | 
-            Q(stock__name__icontains=position_search)
-        )
-    
-    positions = (
-        positions_qs
-        .annotate(total=line_value)
-        .values("stock__symbol", "stock__name", "quantity", "price", "current_price", "total")
-        .order_by("stock__symbol")
-    )
+        needle = position_search.lower()
+        positions = [
+            p for p in all_positions
+            if needle in p["stock__symbol"].lower() or needle in p["stock__name"].lower()
+        ]
+    position_page = Paginator(positions, POSITIONS_PER_PAGE).get_page(request.GET.get("position_page"))
+    positions = position_page.object_list
 
     # Selected rows via query parameters (no JavaScript)
     selected_symbol = request.GET.get("symbol")  # positions table
     selected_stock_symbol = request.GET.get("stock_symbol")  # stocks table
     
-    
-
-    # Stocks with latest price annotated from PriceHistory
-    latest_price_subquery = (
-        PriceHistory.objects
-        .filter(stock=OuterRef("pk"))
-        .order_by("-timestamp")
-        .values("price")[:1]
-    )
-
-    stocks_qs = Stock.objects
-    
-    # Apply stock search filter
-    if stock_search:
-        stocks_qs = stocks_qs.filter(
-            Q(symbol__icontains=stock_search) | 
-            Q(name__icontains=stock_search)
-        )
-    
-    stocks = stocks_qs.annotate(
-        latest_price=Coalesce(
-            Subquery(latest_price_subquery),
-            Value(Decimal("0.00")),
-            output_field=DecimalField(max_digits=12, decimal_places=2),
-        )
-    )
-    
     # Auto-select first row if no selection made
-    if not selected_symbol and positions.exists():
-        first_position = positions.first()
-        selected_symbol = first_position["stock__symbol"]
+    if not selected_symbol and positions:
+        selected_symbol = positions[0]["stock__symbol"]
     
-    if not selected_stock_symbol and stocks.exists():
-        first_stock = stocks.first()
-        selected_stock_symbol = first_stock.symbol
+    if not selected_stock_symbol and stocks:
+        selected_stock_symbol = stocks[0].symbol
+
+    # Resolve selections to (stock id, latest quote time) from rows already
+    # loaded; only symbols on neither table cost a query
+    known = {p["stock__symbol"]: (p["stock_id"], p["stock__latest_quote__timestamp"]) for p in all_positions}
+    known.update({s.symbol: (s.id, s.latest_timestamp) for s in stocks})
+    missing = {sym for sym in (selected_symbol, selected_stock_symbol) if sym and sym not in known}
+    if missing:
+        known.update((yield {"missing": lambda: _resolve_symbols(missing)})["missing"])
+
+    # Chart windows (1D/1W/1M/3M/1Y), downsampled server-side
+    position_period = parse_period(request.GET.get("position_period"))
+    stock_period = parse_period(request.GET.get("stock_period"))
+
+    wanted = {
+        (symbol, period): known[symbol]
+        for symbol, period in ((selected_symbol, position_period), (selected_stock_symbol, stock_period))
+        if symbol in known
+    }
+    charts = yield {
+        key: functools.partial(chart_points, stock_id, key[1], latest) if latest else list
+        for key, (stock_id, latest) in wanted.items()
+    }
     
     # Position graph data
     position_graph_data = None
-    if selected_symbol:
-        try:
-            selected_stock_obj = Stock.objects.get(symbol=selected_symbol)
-            position_price_history = PriceHistory.objects.filter(stock=selected_stock_obj).order_by('timestamp')
-            
-            chart_data = []
-            for item in position_price_history:
-                chart_data.append({
-                    'x': item.timestamp.isoformat(),
-                    'y': float(item.price)
-                })
-            
-            position_graph_data = {
-                "title": selected_symbol,
-                "datasets": [{
-                    "label": selected_symbol,
-                    "data": chart_data,
-                    "borderColor": "rgb(34, 197, 94)",
-                    "backgroundColor": "rgba(34, 197, 94, 0.1)",
-                    "tension": 0.1
-                }]
-            }
-        except Stock.DoesNotExist:
-            position_graph_data = None
+    if (selected_symbol, position_period) in charts:
+        position_graph_data = _graph_data(selected_symbol, charts[selected_symbol, position_period], "34, 197, 94")
 
     # Stock graph data
     stock_graph_data = None
-    if selected_stock_symbol:
-        try:
-            selected_stock_obj = Stock.objects.get(symbol=selected_stock_symbol)
-            stock_price_history = PriceHistory.objects.filter(stock=selected_stock_obj).order_by('timestamp')
-            
-            chart_data = []
-            for item in stock_price_history:
-                chart_data.append({
-                    'x': item.timestamp.isoformat(),
-                    'y': float(item.price)
-                })
-            
-            stock_graph_data = {
-                "title": selected_stock_symbol,
-                "datasets": [{
-                    "label": selected_stock_symbol,
-                    "data": chart_data,
-                    "borderColor": "rgb(20, 184, 166)",
-                    "backgroundColor": "rgba(20, 184, 166, 0.1)",
-                    "tension": 0.1
-                }]
-            }
-        except Stock.DoesNotExist:
-            stock_graph_data = None
+    if (selected_stock_symbol, stock_period) in charts:
+        stock_graph_data = _graph_data(selected_stock_symbol, charts[selected_stock_symbol, stock_period], "20, 184, 166")
+
+    # Net-worth history replayed from the ledger, with today's live point
+    portfolio_stats = summarize(loaded["history"], balance + total)
+    portfolio_change = portfolio_stats["change_pct"] if portfolio_stats else None
+
 
-    # Calculate total worth (balance + portfolio)
-    total_worth = request.user.balance + total
-    
-    # Calculate portfolio change (placeholder for now - would need historical data)
-    portfolio_change = None  # TODO: Calculate actual daily change when we have historical portfolio values
-    
     ctx = {
         "portfolio_amount": total,
-        "total_worth": total_worth,
         "portfolio_change": portfolio_change,
+        "portfolio_stats": portfolio_stats,
         "positions": positions,
         "stocks": stocks,
+        "position_page": position_page,
+        "stock_page": stock_page,
+        "position_pager": _page_links(request, "position_page", position_page),
+        "stock_pager": _page_links(request, "stock_page", stock_page),
         "selected_symbol": selected_symbol,
         "selected_stock_symbol": selected_stock_symbol,
         "position_search": position_search,
         "stock_search": stock_search,
         "position_graph_data": position_graph_data,
         "stock_graph_data": stock_graph_data,
+        "position_periods": _period_links(request, "position_period", position_period),
+        "stock_periods": _period_links(request, "stock_period", stock_period),
+        "open_orders": open_orders,
+        "order_sides": Order.SIDES,
+        "order_types": Order.TYPES,
         "from_tile": from_tile,
     }
+    return ctx
+
+def _dashboard_context(request):
+    """
+    Run the dashboard plan one query at a time.
+    """
+    plan = _dashboard_plan(request)
+    results = None
+    try:
+        while True:
+            batch = plan.send(results)
+            results = {name: load() for name, load in batch.items()}
+    except StopIteration as done:
+        return done.value
+
+async def _dashboard_context_async(request):
+    """
+    Run the dashboard plan with each batch's loaders in parallel, one worker
+    thread (and connection) each.
+    """
+    plan = _dashboard_plan(request)
+    results = None
+    try:
+        while True:
+            batch = plan.send(results)
+            values = await asyncio.gather(*(_off_thread(load) for load in batch.values()))
+            results = dict(zip(batch, values))
+    except StopIteration as done:
+        return done.value
+
+# Threads for the async dashboard's loaders, one per loader in its largest
+# batch. Each keeps its connection between requests, as a WSGI worker does.
+LOADER_THREADS = 4
+_loaders = ThreadPoolExecutor(LOADER_THREADS, thread_name_prefix="dashboard-loader")
+
+def _off_thread(load):
+    """
+    Run a blocking loader on a loader thread. Django's async ORM sends
+    every query through the one thread-sensitive executor, so gathering
+    those would still run them one at a time. The thread's connection is
+    only replaced once CONN_MAX_AGE has passed or it has broken, as between
+    requests.
+    """
+    def run():
+        close_old_connections()
+        return load()
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(_loaders, context.run, run)
+
+def async_login_required(view):
+    """
+    login_required for async views. The session and user are loaded on the
+    sync executor once; request.user is a plain object after that.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+# Tile -> (template, context entries the rest of the page needs)
+DASHBOARD_TILES = {
+    "positions": ("partials/_positions_tile.html", ("portfolio_amount", "portfolio_change", "portfolio_stats", "selected_symbol")),
+    "stocks": ("partials/_stocks_tile.html", ("selected_stock_symbol",)),
+    "orders": ("partials/_orders_tile.html", ()),
+}
+
+def _cached_tiles(request):
+    """
+    (fragment cache key, {tile: cached tile or None}).
+    """
+    # Flash messages are shown once inside a tile, so those pages skip the cache
+    key = None
+    if not len(messages.get_messages(request)):
+        key = dashboard_key(request.user.id, request.GET.items())
+    return key, {name: fragments.get((name,) + key) if key else None for name in DASHBOARD_TILES}
+
+def _render_tiles(request, ctx, tiles, key):
+    for name, (template, fields) in DASHBOARD_TILES.items():
+        tiles[name] = {
+            "html": render_to_string(template, ctx, request),
+            "data": {field: ctx[field] for field in fields},
+        }
+        if key:
+            fragments.set((name,) + key, tiles[name])
+
+def _dashboard_page(request, ctx, tiles):
+    for name, tile in tiles.items():
+        ctx.update(tile["data"])
+        ctx[f"{name}_tile"] = tile["html"]
+
+    # Calculate total worth (balance + portfolio)
+    ctx["total_worth"] = request.user.balance + ctx["portfolio_amount"]
+    # Live quotes stream only where idle connections don't hold a thread
+    ctx["live_stream"] = settings.ASYNC_VIEWS
+    ctx["live_poll_seconds"] = CLIENT_POLL_SECONDS
     return render(request, "brokersystem/dashboard.html", ctx)
 
+def _picked_symbols(request):
+    """
+    Symbols the user chose to chart, which the tiered scheduler refreshes
+    first; the first-row auto-selection doesn't count.
+    """
+    return request.GET.get("symbol"), request.GET.get("stock_symbol")
+
+@login_required
+def dashboard_view(request):
+    """
+    Tiles are served from the fragment cache until a fetch cycle, a trade or a
+    change to the stock list makes them stale; only then is the context built
+    and the tiles rendered again.
+    """
+    key, tiles = _cached_tiles(request)
+    ctx = {}
+    if not all(tiles.values()):
+        ctx = _dashboard_context(request)
+        _render_tiles(request, ctx, tiles, key)
+    record_view(*_picked_symbols(request))
+    return _dashboard_page(request, ctx, tiles)
+
+@async_login_required
+async def dashboard_view_async(request):
+    """
+    dashboard_view for ASGI: the same tiles and plan, with independent
+    queries (positions, stock page, open orders, chart series) run
+    concurrently.
+    """
+    key, tiles = _cached_tiles(request)
+    ctx = {}
+    if not all(tiles.values()):
+        ctx = await _dashboard_context_async(request)
+        _render_tiles(request, ctx, tiles, key)
+    await sync_to_async(record_view)(*_picked_symbols(request))
+    return _dashboard_page(request, ctx, tiles)
 
 TWO_DP = Decimal("0.01")
 
 def _latest_price_for(stock: Stock):
     price = (
-        PriceHistory.objects
+        LatestQuote.objects
         .filter(stock=stock)
-        .order_by("-timestamp")
         .values_list("price", flat=True)
         .first()
     )
     return price
 
-@login_required
-def trade_view(request):
-    if request.method != "POST":
+def _back_to_tile(source_tile):
+    # Redirect back to dashboard with source tile parameter
+    if source_tile:
+        url = reverse('dashboard')
+        return HttpResponseRedirect(f"{url}?from={source_tile}")
+    else:
         return redirect("dashboard")
 
+def _parse_trade(request):
+    """
+    (side, symbol, quantity, source tile) from the trade form, or a redirect
+    carrying the error message. No queries.
+    """
     # Which button was pressed?
     buy_symbol = request.POST.get("buy", "").strip()
     sell_symbol = request.POST.get("sell", "").strip()
-    
-    # Determine which tile the action came from
-    source_tile = None
+
     if buy_symbol:
         side = "buy"
         symbol = buy_symbol
-        # Check if this came from positions or stocks based on context
-        if request.POST.get("from_positions"):
-            source_tile = "positions"
-        else:
-            source_tile = "stocks"
     elif sell_symbol:
         side = "sell"
         symbol = sell_symbol
-        # Check if this came from positions or stocks based on context
-        if request.POST.get("from_positions"):
-            source_tile = "positions"
-        else:
-            source_tile = "stocks"
     else:
         messages.error(request, "No action specified.")
         return redirect("dashboard")
 
+    # Determine which tile the action came from
+    if request.POST.get("from_positions"):
+        source_tile = "positions"
+    else:
+        source_tile = "stocks"
+
     # Quantity
     try:
         qty = int(request.POST.get("quantity", "1"))
@@ -274,42 +498,68 @@ def trade_view(request):
             raise ValueError
     except ValueError:
         messages.error(request, "Quantity must be a positive integer.")
-        if source_tile:
-            from django.http import HttpResponseRedirect
-            from django.urls import reverse
-            url = reverse('dashboard')
-            return HttpResponseRedirect(f"{url}?from={source_tile}")
-        else:
-            return redirect("dashboard")
+        return _back_to_tile(source_tile)
+
+    return side, symbol, qty, source_tile
+
+@login_required
+def trade_view(request):
+    if request.method != "POST":
+        return redirect("dashboard")
+
+    parsed = _parse_trade(request)
+    if isinstance(parsed, HttpResponse):
+        return parsed
+    side, symbol, qty, source_tile = parsed
 
     # Resolve stock
     try:
         stock = Stock.objects.get(symbol=symbol)
     except Stock.DoesNotExist:
         messages.error(request, f"Unknown symbol: {symbol}")
-        if source_tile:
-            from django.http import HttpResponseRedirect
-            from django.urls import reverse
-            url = reverse('dashboard')
-            return HttpResponseRedirect(f"{url}?from={source_tile}")
-        else:
-            return redirect("dashboard")
+        return _back_to_tile(source_tile)
 
     # Price (use latest from DB; if you pass a hidden input price, prefer/validate it here)
     price = _latest_price_for(stock)
     if price is None:
         messages.error(request, "No price available for this symbol.")
-        if source_tile:
-            from django.http import HttpResponseRedirect
-            from django.urls import reverse
-            url = reverse('dashboard')
-            return HttpResponseRedirect(f"{url}?from={source_tile}")
-        else:
-            return redirect("dashboard")
+        return _back_to_tile(source_tile)
+
+    return _execute_trade(request, side, stock, qty, price, source_tile)
+
+@async_login_required
+async def trade_view_async(request):
+    """
+    trade_view for ASGI. The stock and its latest price come back in one
+    async query; the trade's transaction runs on the sync executor, since
+    atomic blocks can't span awaits.
+    """
+    if request.method != "POST":
+        return redirect("dashboard")
+
+    parsed = _parse_trade(request)
+    if isinstance(parsed, HttpResponse):
+        return parsed
+    side, symbol, qty, source_tile = parsed
+
+    try:
+        stock = await Stock.objects.annotate(latest_price=F("latest_quote__price")).aget(symbol=symbol)
+    except Stock.DoesNotExist:
+        messages.error(request, f"Unknown symbol: {symbol}")
+        return _back_to_tile(source_tile)
+
+    if stock.latest_price is None:
+        messages.error(request, "No price available for this symbol.")
+        return _back_to_tile(source_tile)
+
+    return await sync_to_async(_execute_trade)(request, side, stock, qty, stock.latest_price, source_tile)
 
+def _execute_trade(request, side, stock, qty, price, source_tile):
+    symbol = stock.symbol
     notional = (price * Decimal(qty)).quantize(TWO_DP, rounding=ROUND_HALF_UP)
 
-    # Apply trade atomically
+    # Apply trade atomically. Lock order everywhere: Position rows (by stock),
+    # then the user row, so concurrent trades and baskets never deadlock.
     with transaction.atomic():
         # Lock user's position row for this stock (if it exists)
         pos = (
@@ -320,17 +570,31 @@ def trade_view(request):
         )
 
         if side == "buy":
-            # Check if user has sufficient balance
-            if request.user.balance < notional:
-                messages.error(request, f"Insufficient balance. You need ${notional} but only have ${request.user.balance}.")
-                if source_tile:
-                    from django.http import HttpResponseRedirect
-                    from django.urls import reverse
-                    url = reverse('dashboard')
-                    return HttpResponseRedirect(f"{url}?from={source_tile}")
-                else:
-                    return redirect("dashboard")
-            
+            if pos is None:
+                # Insert an empty row first, so concurrent first buys queue on
+                # the same lock instead of one failing on the unique constraint
+                Position.objects.bulk_create(
+                    [Position(user=request.user, stock=stock, quantity=0, price=price.quantize(TWO_DP, rounding=ROUND_HALF_UP))],
+                    ignore_conflicts=True,
+                )
+                pos = Position.objects.select_for_update().get(user=request.user, stock=stock)
+
+            # Debit right after the position lock, and only while the balance
+            # covers it: the UPDATE's row count decides, so concurrent buys
+            # can't overdraw the account, and a buy that can't be paid for
+            # stops before writing its transaction or position.
+            debited = (
+                CustomUser.objects
+                .filter(pk=request.user.pk, balance__gte=notional)
+                .update(balance=F('balance') - notional)
+            )
+            if not debited:
+                balance = CustomUser.objects.values_list("balance", flat=True).get(pk=request.user.pk)
+                # Drops the empty position row, if this buy inserted one
+                transaction.set_rollback(True)
+                messages.error(request, f"Insufficient balance. You need ${notional} but only have ${balance}.")
+                return _back_to_tile(source_tile)
+
             # Create transaction
             Transaction.objects.create(
                 user=request.user,
@@ -341,40 +605,20 @@ def trade_view(request):
                 executed_at=timezone.now(),
             )
 
-            if pos is None:
-                # New position at this price
-                Position.objects.create(
-                    user=request.user,
-                    stock=stock,
-                    quantity=qty,
-                    # Store average cost in Position.price (your schema)
-                    price=price.quantize(TWO_DP, rounding=ROUND_HALF_UP),
-                )
-            else:
-                # Weighted average cost update
-                old_qty = int(pos.quantity)
-                old_cost = Decimal(pos.price)
-                new_qty = old_qty + qty
-                new_avg = ((old_cost * old_qty) + (price * qty)) / Decimal(new_qty)
-                pos.quantity = new_qty
-                pos.price = new_avg.quantize(TWO_DP, rounding=ROUND_HALF_UP)
-                pos.save(update_fields=["quantity", "price", "last_updated"])
-
-            # Update user balance
-            request.user.balance = F('balance') - notional
-            request.user.save(update_fields=['balance'])
+            # Weighted average cost update (a new position starts at quantity 0)
+            old_qty = int(pos.quantity)
+            old_cost = Decimal(pos.price)
+            new_qty = old_qty + qty
+            new_avg = ((old_cost * old_qty) + (price * qty)) / Decimal(new_qty)
+            pos.quantity = new_qty
+            pos.price = new_avg.quantize(TWO_DP, rounding=ROUND_HALF_UP)
+            pos.save(update_fields=["quantity", "price", "last_updated"])
             messages.success(request, f"Bought {qty} {symbol} @ {price} (notional {notional}).")
 
         else:  # sell
             if pos is None or pos.quantity < qty:
                 messages.error(request, "Insufficient holdings to sell.")
-                if source_tile:
-                    from django.http import HttpResponseRedirect
-                    from django.urls import reverse
-                    url = reverse('dashboard')
-                    return HttpResponseRedirect(f"{url}?from={source_tile}")
-                else:
-                    return redirect("dashboard")
+                return _back_to_tile(source_tile)
 
             # Create transaction
             Transaction.objects.create(
@@ -399,11 +643,250 @@ def trade_view(request):
             request.user.save(update_fields=['balance'])
             messages.success(request, f"Sold {qty} {symbol} @ {price} (notional {notional}).")
 
-    # Redirect back to dashboard with source tile parameter
-    if source_tile:
-        from django.http import HttpResponseRedirect
-        from django.urls import reverse
-        url = reverse('dashboard')
-        return HttpResponseRedirect(f"{url}?from={source_tile}")
+    # Cached dashboard tiles for this user are now stale
+    bump_portfolio(request.user.id)
+    record_trade(request.user.id)
+
+    return _back_to_tile(source_tile)
+
+
+
+@login_required
+@require_POST
+def basket_order_view(request):
+    """
+    Several market buys/sells in one request, executed all or nothing.
+    POST JSON {"legs": [{"symbol": "AAPL", "side": "sell", "quantity": 5}, ...]}.
+    Answers with JSON instead of redirecting, so a rebalance is one round trip.
+    """
+    try:
+        payload = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"error": "Request body must be JSON."}, status=400)
+    try:
+        legs = parse_legs(payload.get("legs") if isinstance(payload, dict) else None)
+        result = execute_basket(request.user.id, legs)
+    except TradeError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    record_trade(request.user.id)
+    return JsonResponse(result)
+
+@login_required
+def place_order_view(request):
+    """
+    Rest a limit, stop or stop-limit order. The trigger engine checks it
+    against every fetch cycle; funds and holdings are checked when it fills.
+    """
+    if request.method != "POST":
+        return redirect("dashboard")
+
+    form = OrderForm(request.POST)
+    if form.is_valid():
+        order = form.save(commit=False)
+        order.user = request.user
+        order.save()
+        bump_portfolio(request.user.id)
+        messages.success(
+            request,
+            f"{order.get_order_type_display()} order placed: {order.side} {order.quantity} {order.stock.symbol}.",
+        )
     else:
+        for field, errors in form.errors.items():
+            for error in errors:
+                messages.error(request, error if field == "__all__" else f"{form.fields[field].label}: {error}")
+    return HttpResponseRedirect(f"{reverse('dashboard')}?from=orders")
+
+@login_required
+def cancel_order_view(request, order_id):
+    if request.method != "POST":
         return redirect("dashboard")
+
+    cancelled = (
+        Order.objects
+        .filter(id=order_id, user=request.user, status__in=Order.OPEN_STATUSES)
+        .update(status="cancelled", cancelled_at=timezone.now())
+    )
+    if cancelled:
+        bump_portfolio(request.user.id)
+        messages.success(request, "Order cancelled.")
+    else:
+        messages.error(request, "That order is no longer open.")
+    return HttpResponseRedirect(f"{reverse('dashboard')}?from=orders")
+
+
+def _price_api_stamp(request, symbol):
+    """
+    (stock_id, latest quote time) for the API's symbol, looked up once per request.
+    The latest quote time changes exactly when a fetch cycle refreshes the symbol.
+    """
+    if not hasattr(request, "_price_api_stamp"):
+        request._price_api_stamp = (
+            LatestQuote.objects
+            .filter(stock__symbol=symbol)
+            .values_list("stock_id", "timestamp")
+            .first()
+        )
+    return request._price_api_stamp
+
+def _price_api_etag(request, symbol):
+    stamp = _price_api_stamp(request, symbol)
+    if stamp is None:
+        return None
+    key = f"{symbol}|{stamp[1].isoformat()}|{sorted(request.GET.items())}"
+    return hashlib.md5(key.encode()).hexdigest()
+
+def _price_api_last_modified(request, symbol):
+    stamp = _price_api_stamp(request, symbol)
+    return stamp[1] if stamp else None
+
+def _parse_api_time(value):
+    """
+    Accept epoch seconds, an ISO datetime or an ISO date (UTC midnight).
+    """
+    if value.isdigit():
+        try:
+            return dt.datetime.fromtimestamp(int(value), tz=dt.timezone.utc)
+        except (OverflowError, OSError):
+            # Out of the platform's range: as unusable as a malformed value
+            raise ValueError(value)
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        parsed = dt.datetime.combine(day, dt.time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt.timezone.utc)
+    return parsed
+
+@require_GET
+@condition(etag_func=_price_api_etag, last_modified_func=_price_api_last_modified)
+def price_history_api(request, symbol):
+    """
+    Columnar price history for one symbol.
+    ?period=1D|1W|1M|3M|1Y, or ?from=&to= (epoch seconds or ISO), and
+    ?resolution=raw|1h|4h|12h|1d|auto, at most CHART_MAX_POINTS points.
+    Cacheable until the next fetch cycle.
+    """
+    stamp = _price_api_stamp(request, symbol)
+    if stamp is None:
+        return JsonResponse({"error": f"No prices for symbol: {symbol}"}, status=404)
+    stock_id, latest = stamp
+
+    period = request.GET.get("period", "").upper()
+    resolution = request.GET.get("resolution", "auto")
+    try:
+        if period in PERIODS:
+            window, bucket_seconds = PERIODS[period]
+            end, start = latest, latest - window
+            auto = next((name for name, secs in RESOLUTIONS.items() if secs == bucket_seconds), "raw")
+        else:
+            end = _parse_api_time(request.GET["to"]) if request.GET.get("to") else latest
+            start = _parse_api_time(request.GET["from"]) if request.GET.get("from") else end - PERIODS["1M"][0]
+            auto = auto_resolution(end - start)
+    except ValueError:
+        return JsonResponse({"error": "from/to must be epoch seconds or ISO dates."}, status=400)
+    if resolution == "auto":
+        resolution = auto
+    if resolution not in RESOLUTIONS:
+        return JsonResponse({"error": f"resolution must be one of: auto, {', '.join(RESOLUTIONS)}."}, status=400)
+    if start > end:
+        return JsonResponse({"error": "from must be before to."}, status=400)
+
+    response = StreamingHttpResponse(
+        stream_columns(stock_id, symbol, start, end, resolution),
+        content_type="application/json",
+    )
+    # Shared caches may keep the response until the next cycle is due
+    next_cycle = latest + dt.timedelta(minutes=cycle_interval_minutes())
+    max_age = max(0, int((next_cycle - timezone.now()).total_seconds()))
+    response["Cache-Control"] = f"public, max-age={max_age}"
+    return response
+
+
+@login_required
+@require_GET
+def portfolio_analytics_api(request):
+    """
+    The user's net-worth series (one point per day, the last one live),
+    daily returns, annualized volatility, max drawdown and Sharpe ratio.
+    """
+    total = sum((p["total"] for p in _user_positions(request.user.id)), Decimal("0.00"))
+    stats = summarize(history(request.user.id, request.user.balance), request.user.balance + total)
+    if stats is None:
+        return JsonResponse({"error": "No trades yet."}, status=404)
+    return JsonResponse(stats)
+
+@require_GET
+def metrics_view(request):
+    """
+    Fetch-cycle metrics for Prometheus; see metrics.py.
+    """
+    token = metrics.METRICS_TOKEN
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@login_required
+@require_GET
+def leaderboard_api(request):
+    """
+    Top users by net worth (?n=, up to 100) and the caller's own rank, from
+    the in-memory ranking; only the listed users' names are queried.
+    """
+    try:
+        n = min(max(int(request.GET.get("n", LEADERBOARD_SIZE)), 1), 100)
+    except ValueError:
+        return JsonResponse({"error": "n must be an integer."}, status=400)
+    board = get_board()
+    top = board.top(n)
+    names = dict(CustomUser.objects.filter(id__in=[user_id for _, user_id, _ in top]).values_list("id", "first_name"))
+    return JsonResponse({
+        "users": len(board),
+        "top": [
+            {"rank": rank, "name": names.get(user_id) or f"Trader {user_id}", "worth": float(worth), "me": user_id == request.user.id}
+            for rank, user_id, worth in top
+        ],
+        "me": {"rank": board.rank(request.user.id), "worth": float(board.worth(request.user.id) or 0)},
+    })
+
+def _event_stream(events):
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Don't let a proxy (nginx) buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+@login_required
+@require_GET
+def price_updates(request):
+    """
+    The quote diffs published after sequence number `after`, for dashboards
+    served under WSGI, which poll here instead of holding a worker thread on
+    an event stream: {"seq": n, "quotes": [{"t", "q"}, ...]}, or
+    {"seq": n, "reload": true} when the missed diffs can't be replayed.
+    Without `after` only the current sequence number is returned.
+    """
+    try:
+        after = int(request.GET["after"]) if "after" in request.GET else None
+    except ValueError:
+        return JsonResponse({"error": "after must be an integer."}, status=400)
+    seq, diffs = (current_seq(), []) if after is None else pending(after)
+    if diffs is None:
+        return JsonResponse({"seq": seq, "reload": True})
+    response = JsonResponse({"seq": seq, "quotes": [diff for _, diff in diffs]})
+    response["Cache-Control"] = "no-cache"
+    return response
+
+@async_login_required
+async def price_stream_async(request):
+    """
+    Server-sent events with one "quotes" diff per fetch cycle:
+    {"t": epoch seconds, "q": {symbol: price}} for the quotes that changed.
+    Reconnecting clients send Last-Event-ID and get the diffs they missed.
+    Only routed under ASGI, where idle connections wait on the event loop
+    instead of holding a thread each.
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    return _event_stream(QuoteStream(request.headers.get("Last-Event-ID")))
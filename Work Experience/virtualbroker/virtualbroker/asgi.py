@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'virtualbroker.settings')
+# The async dashboard and trade views stay opt-in (ASYNC_VIEWS=1, see
+# settings.ASYNC_VIEWS) until they measure at least even with the sync ones
 
 application = get_asgi_application()
@@ -79,14 +79,58 @@ WSGI_APPLICATION = 'virtualbroker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Django's SQLite backend plus busy_timeout and friends on every connection
+# (see brokersystem/sqlite/base.py). WAL is switched on once, by migrate
+# (SQLITE_WAL=0 keeps the rollback journal). Connections are reused across
+# requests for DB_CONN_MAX_AGE seconds.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'brokersystem.sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", "600")),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# Quote diffs, page-fragment versions, leaderboard deltas and the search
+# index version reach web processes through the cache, so it must be shared
+# by every process: set CACHE_LOCATION to a redis:// URL (needs the redis
+# package) or to a directory for a file-based cache. Unset, each process
+# keeps its own in memory, which only suits a single runserver process;
+# run_price_worker refuses to start then and runserver fetches prices itself.
+CACHE_LOCATION = os.getenv("CACHE_LOCATION", "")
+if CACHE_LOCATION.startswith(("redis://", "rediss://")):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_LOCATION,
+        }
+    }
+elif CACHE_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_LOCATION,
+            'OPTIONS': {'MAX_ENTRIES': 20000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Who fetches prices. Unset, runserver fetches in-process while the cache is
+# per-process memory; with CACHE_LOCATION set, run `manage.py run_price_worker`
+# next to the web processes (a database lease keeps one of them fetching).
+# "1" always fetches from runserver, "0" never does.
+PRICE_SCHEDULER_IN_WEB = os.getenv("PRICE_SCHEDULER_IN_WEB", "")
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -137,4 +181,11 @@ AUTH_USER_MODEL = 'brokersystem.CustomUser'
 AUTHENTICATION_BACKENDS = ['brokersystem.backends.EmailBackend']
 
 # Login URL for @login_required decorator
-LOGIN_URL = '/login/'
\ No newline at end of file
+LOGIN_URL = '/login/'
+# Serve the async dashboard and trade views, and stream live quotes. Only
+# for ASGI servers; under WSGI async views run on a per-request event loop.
+# Off by default: with loader threads keeping their connections the ASGI
+# dashboard is within a few percent of the sync view in
+# AsyncDashboardBenchmark, but not ahead. Its time goes to row conversion,
+# which holds the GIL, so the parallel loaders have little to overlap.
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "0") == "1"